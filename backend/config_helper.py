@@ -3,6 +3,7 @@ Helper para buscar configurações do sistema.
 Busca do banco de dados com fallback para .env
 """
 import os
+import time
 from sqlalchemy.orm import Session
 from typing import Optional
 import models
@@ -12,6 +13,10 @@ from database import SessionLocal
 
 _config_cache = None
 _cache_timestamp = None
+_config_version = 0
+
+# Tempo máximo (s) do cache; garante que alterações feitas por outro processo sejam vistas
+CONFIG_CACHE_TTL = float(os.getenv("CONFIG_CACHE_TTL", "60"))
 
 
 def get_system_config(db: Session = None, use_cache: bool = True) -> models.ConfiguracaoSistema:
@@ -22,9 +27,10 @@ def get_system_config(db: Session = None, use_cache: bool = True) -> models.Conf
     """
     global _config_cache, _cache_timestamp
 
-    # Se tem cache e solicitou uso de cache, retorna do cache
+    # Se tem cache válido e solicitou uso de cache, retorna do cache
     if use_cache and _config_cache is not None:
-        return _config_cache
+        if _cache_timestamp is not None and time.time() - _cache_timestamp < CONFIG_CACHE_TTL:
+            return _config_cache
 
     # Criar sessão se não foi fornecida
     close_session = False
@@ -38,6 +44,7 @@ def get_system_config(db: Session = None, use_cache: bool = True) -> models.Conf
 
         # Atualizar cache
         _config_cache = config
+        _cache_timestamp = time.time()
 
         return config
     finally:
@@ -46,9 +53,21 @@ def get_system_config(db: Session = None, use_cache: bool = True) -> models.Conf
 
 
 def clear_config_cache():
-    """Limpa o cache de configurações"""
-    global _config_cache
+    """Limpa o cache de configurações (serviços dependentes são recriados)"""
+    global _config_cache, _cache_timestamp, _config_version
     _config_cache = None
+    _cache_timestamp = None
+    _config_version += 1
+
+
+def get_config_version() -> tuple:
+    """
+    Retorna a versão atual da configuração.
+    Muda quando o cache é limpo neste processo ou quando o registro
+    no banco foi atualizado (atualizado_em), inclusive por outro processo.
+    """
+    config = get_system_config()
+    return (_config_version, config.id, config.atualizado_em)
 
 
 # Funções específicas para cada configuração com fallback para .env
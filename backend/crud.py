@@ -1,5 +1,5 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import desc
+from sqlalchemy import desc, func, case
 from typing import List, Optional
 import models
 import schemas
@@ -216,39 +216,23 @@ def update_conversa(db: Session, conversa_id: int, conversa: schemas.ConversaAtu
 
 
 def update_conversa_metricas(db: Session, conversa_id: int) -> Optional[models.Conversa]:
-    """Atualiza métricas calculadas da conversa"""
+    """
+    Recalcula do zero as métricas de uma conversa.
+    No fluxo normal as métricas são incrementais (ver create_mensagem);
+    use esta função ou reconciliar_metricas_conversas para corrigir divergências.
+    """
     db_conversa = get_conversa(db, conversa_id)
     if not db_conversa:
         return None
 
-    # Contar mensagens
-    total_msgs = db.query(models.Mensagem).filter(models.Mensagem.conversa_id == conversa_id).count()
-    msgs_bot = db.query(models.Mensagem).filter(
-        models.Mensagem.conversa_id == conversa_id,
-        models.Mensagem.direcao == models.DirecaoMensagem.ENVIADA
-    ).count()
-    msgs_usuario = db.query(models.Mensagem).filter(
-        models.Mensagem.conversa_id == conversa_id,
-        models.Mensagem.direcao == models.DirecaoMensagem.RECEBIDA
-    ).count()
-
-    # Calcular tempo médio de resposta
-    mensagens_com_tempo = db.query(models.Mensagem).filter(
-        models.Mensagem.conversa_id == conversa_id,
-        models.Mensagem.tempo_resposta.isnot(None)
-    ).all()
-
-    tempo_medio = None
-    if mensagens_com_tempo:
-        tempos = [m.tempo_resposta for m in mensagens_com_tempo if m.tempo_resposta]
-        if tempos:
-            tempo_medio = sum(tempos) / len(tempos)
+    metricas = _agregar_metricas_mensagens(db, [conversa_id]).get(conversa_id, {})
 
     # Atualizar conversa
-    db_conversa.total_mensagens = total_msgs
-    db_conversa.mensagens_bot = msgs_bot
-    db_conversa.mensagens_usuario = msgs_usuario
-    db_conversa.tempo_resposta_medio = tempo_medio
+    db_conversa.total_mensagens = metricas.get("total_mensagens", 0)
+    db_conversa.mensagens_bot = metricas.get("mensagens_bot", 0)
+    db_conversa.mensagens_usuario = metricas.get("mensagens_usuario", 0)
+    db_conversa.tempo_resposta_medio = metricas.get("tempo_resposta_medio")
+    db_conversa.mensagens_com_tempo = metricas.get("mensagens_com_tempo", 0)
     db_conversa.ultima_interacao = datetime.utcnow()
     db_conversa.atualizado_em = datetime.utcnow()
 
@@ -257,6 +241,129 @@ def update_conversa_metricas(db: Session, conversa_id: int) -> Optional[models.C
     return db_conversa
 
 
+def _agregar_metricas_mensagens(db: Session, conversa_ids: Optional[List[int]] = None) -> dict:
+    """
+    Calcula as métricas de várias conversas com uma única consulta agregada.
+    Retorna {conversa_id: {total_mensagens, mensagens_bot, mensagens_usuario,
+    tempo_resposta_medio, mensagens_com_tempo}}
+    """
+    com_tempo = models.Mensagem.tempo_resposta > 0
+
+    query = db.query(
+        models.Mensagem.conversa_id,
+        func.count(models.Mensagem.id),
+        func.sum(case((models.Mensagem.direcao == models.DirecaoMensagem.ENVIADA, 1), else_=0)),
+        func.sum(case((models.Mensagem.direcao == models.DirecaoMensagem.RECEBIDA, 1), else_=0)),
+        func.sum(case((com_tempo, models.Mensagem.tempo_resposta), else_=0)),
+        func.sum(case((com_tempo, 1), else_=0))
+    )
+    if conversa_ids is not None:
+        query = query.filter(models.Mensagem.conversa_id.in_(conversa_ids))
+
+    resultado = {}
+    for conversa_id, total, bot, usuario, soma_tempo, qtd_tempo in query.group_by(models.Mensagem.conversa_id):
+        qtd_tempo = int(qtd_tempo or 0)
+        resultado[conversa_id] = {
+            "total_mensagens": int(total or 0),
+            "mensagens_bot": int(bot or 0),
+            "mensagens_usuario": int(usuario or 0),
+            "tempo_resposta_medio": (float(soma_tempo) / qtd_tempo) if qtd_tempo else None,
+            "mensagens_com_tempo": qtd_tempo
+        }
+    return resultado
+
+
+def reconciliar_metricas_conversas(db: Session, pedido_id: Optional[int] = None, lote: int = 500) -> int:
+    """
+    Reconstrói em lote os contadores de métricas das conversas (job offline).
+
+    Args:
+        db: Sessão do banco de dados
+        pedido_id: Limitar a um pedido (opcional)
+        lote: Quantidade de conversas por transação
+
+    Returns:
+        Número de conversas reconciliadas
+    """
+    query = db.query(models.Conversa.id)
+    if pedido_id is not None:
+        query = query.filter(models.Conversa.pedido_id == pedido_id)
+    conversa_ids = [row[0] for row in query.order_by(models.Conversa.id)]
+
+    for inicio in range(0, len(conversa_ids), lote):
+        ids_lote = conversa_ids[inicio:inicio + lote]
+        metricas = _agregar_metricas_mensagens(db, ids_lote)
+
+        db.bulk_update_mappings(models.Conversa, [
+            {
+                "id": conversa_id,
+                "total_mensagens": metricas.get(conversa_id, {}).get("total_mensagens", 0),
+                "mensagens_bot": metricas.get(conversa_id, {}).get("mensagens_bot", 0),
+                "mensagens_usuario": metricas.get(conversa_id, {}).get("mensagens_usuario", 0),
+                "tempo_resposta_medio": metricas.get(conversa_id, {}).get("tempo_resposta_medio"),
+                "mensagens_com_tempo": metricas.get(conversa_id, {}).get("mensagens_com_tempo", 0)
+            }
+            for conversa_id in ids_lote
+        ])
+        db.commit()
+
+    return len(conversa_ids)
+
+
+def _incrementar_metricas_conversa(db: Session, mensagem: models.Mensagem):
+    """
+    Atualiza as métricas da conversa de forma incremental (O(1)), com um único
+    UPDATE na mesma transação do INSERT da mensagem.
+    A média de tempo de resposta é mantida como média móvel.
+    """
+    _incrementar_metricas_conversas(db, [mensagem])
+
+
+def _incrementar_metricas_conversas(
+    db: Session,
+    mensagens: List[models.Mensagem],
+    valores_conversa: Optional[dict] = None
+):
+    """
+    Versão em lote de _incrementar_metricas_conversa: as mensagens de cada
+    conversa são somadas e aplicadas em um único UPDATE por conversa, junto
+    com as alterações extras da conversa (valores_conversa: {conversa_id: {campo: valor}}).
+    """
+    agora = datetime.utcnow()
+    C = models.Conversa
+    valores_conversa = valores_conversa or {}
+
+    por_conversa = {}
+    for mensagem in mensagens:
+        por_conversa.setdefault(mensagem.conversa_id, []).append(mensagem)
+    for conversa_id in valores_conversa:
+        por_conversa.setdefault(conversa_id, [])
+
+    for conversa_id, lista in por_conversa.items():
+        valores = {C.atualizado_em: agora}
+        valores.update({getattr(C, campo): valor for campo, valor in valores_conversa.get(conversa_id, {}).items()})
+
+        if lista:
+            bot = sum(1 for m in lista if m.direcao == models.DirecaoMensagem.ENVIADA)
+            tempos = [m.tempo_resposta for m in lista if m.tempo_resposta]
+
+            valores[C.total_mensagens] = func.coalesce(C.total_mensagens, 0) + len(lista)
+            valores[C.ultima_interacao] = agora
+            if bot:
+                valores[C.mensagens_bot] = func.coalesce(C.mensagens_bot, 0) + bot
+            if len(lista) - bot:
+                valores[C.mensagens_usuario] = func.coalesce(C.mensagens_usuario, 0) + len(lista) - bot
+
+            if tempos:
+                n = func.coalesce(C.mensagens_com_tempo, 0)
+                valores[C.tempo_resposta_medio] = (
+                    func.coalesce(C.tempo_resposta_medio, 0) * n + sum(tempos)
+                ) / (n + len(tempos))
+                valores[C.mensagens_com_tempo] = n + len(tempos)
+
+        db.query(C).filter(C.id == conversa_id).update(valores, synchronize_session=False)
+
+
 # ============= MENSAGENS =============
 def get_mensagem(db: Session, mensagem_id: int) -> Optional[models.Mensagem]:
     return db.query(models.Mensagem).filter(models.Mensagem.id == mensagem_id).first()
@@ -277,13 +384,73 @@ def get_mensagens_by_conversa(db: Session, conversa_id: int, skip: int = 0, limi
 def create_mensagem(db: Session, mensagem: schemas.MensagemCriar) -> models.Mensagem:
     db_mensagem = models.Mensagem(**mensagem.model_dump())
     db.add(db_mensagem)
+
+    # Atualizar métricas da conversa (incremental, mesma transação)
+    _incrementar_metricas_conversa(db, db_mensagem)
+
     db.commit()
     db.refresh(db_mensagem)
+    return db_mensagem
 
-    # Atualizar métricas da conversa
-    update_conversa_metricas(db, mensagem.conversa_id)
 
-    return db_mensagem
+class UnidadeMensagens:
+    """
+    Unit of work de uma troca de mensagens (mensagem recebida, boas-vindas,
+    resposta e alterações da conversa): tudo gravado em uma única transação,
+    com um único UPDATE de conversa (métricas + campos) por conversa.
+
+    A unidade guarda só os dados, sem vínculo com sessão; pode ser gravada na
+    sessão do chamador (commit) ou junto com outras (services.message_writer).
+
+    Uso:
+        unidade = crud.UnidadeMensagens()
+        timestamp = unidade.adicionar_mensagem(mensagem_recebida)
+        unidade.atualizar_conversa(conversa_id, status=models.StatusConversa.ATIVA)
+        ids = unidade.commit(db)
+    """
+
+    def __init__(self):
+        self._mensagens: List[dict] = []
+        self._conversas: dict = {}
+
+    def __len__(self) -> int:
+        return len(self._mensagens) + len(self._conversas)
+
+    def adicionar_mensagem(self, mensagem: schemas.MensagemCriar) -> datetime:
+        """
+        Agenda o INSERT da mensagem
+
+        Returns:
+            Timestamp da mensagem (definido aqui, disponível antes da gravação)
+        """
+        dados = mensagem.model_dump()
+        dados["timestamp"] = datetime.utcnow()
+        self._mensagens.append(dados)
+        return dados["timestamp"]
+
+    def atualizar_conversa(self, conversa_id: int, **valores):
+        """Agenda alterações de campos da conversa (ex: status, tempo_primeira_resposta)"""
+        self._conversas.setdefault(conversa_id, {}).update(valores)
+
+    def aplicar(self, db: Session) -> List[models.Mensagem]:
+        """Coloca as alterações na sessão, sem commit (objetos novos a cada chamada)"""
+        mensagens = [models.Mensagem(**dados) for dados in self._mensagens]
+        db.add_all(mensagens)
+        _incrementar_metricas_conversas(db, mensagens, self._conversas)
+        return mensagens
+
+    def commit(self, db: Session) -> List[int]:
+        """
+        Grava a unidade em uma transação
+
+        Returns:
+            IDs das mensagens inseridas, na ordem em que foram adicionadas
+        """
+        mensagens = self.aplicar(db)
+        db.flush()
+        ids = [m.id for m in mensagens]
+        db.commit()
+        return ids
 
 
 def update_mensagem(db: Session, mensagem_id: int, mensagem: schemas.MensagemAtualizar) -> Optional[models.Mensagem]:
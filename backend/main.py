@@ -49,6 +49,38 @@ app.include_router(evolution.router)
 app.include_router(conversas.router)
 app.include_router(knowledge.router)
 
+# Fila de webhooks do Evolution (consumidores em background)
+from services import webhook_queue, evolution_client, ingestion_jobs, async_rag_service, transcription_service, tts_cache, conversation_state, message_writer
+
+
+@app.on_event("startup")
+async def iniciar_fila_webhooks():
+    """Inicia os consumidores da fila durável de webhooks"""
+    webhook_queue.iniciar_consumidores(evolution.processar_webhook_enfileirado)
+    # Indexa (em segundo plano) documentos antigos ainda fora do índice textual
+    ingestion_jobs.sincronizar_indices_textuais()
+    # Sobe o pool de transcrição e carrega o Whisper antes do primeiro áudio
+    transcription_service.iniciar()
+    # Mantém o cache de áudios de resposta dentro da cota de disco
+    tts_cache.iniciar_varredura()
+    # Grava em lote no banco o contexto das conversas (write-behind)
+    conversation_state.iniciar()
+    # Group commit das mensagens dos webhooks (se MESSAGE_GROUP_COMMIT=true)
+    message_writer.iniciar()
+
+
+@app.on_event("shutdown")
+async def parar_fila_webhooks():
+    """Para os consumidores (webhooks em andamento voltam para a fila)"""
+    await webhook_queue.parar_consumidores()
+    await message_writer.encerrar()
+    await evolution_client.fechar()
+    await async_rag_service.fechar()
+    ingestion_jobs.encerrar()
+    transcription_service.encerrar()
+    tts_cache.encerrar()
+    conversation_state.encerrar()
+
 # Servir arquivos estáticos do backend
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, Date, ForeignKey, Enum, Text, Boolean
+from sqlalchemy import Column, Integer, String, Float, DateTime, Date, ForeignKey, Enum, Text, Boolean, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 import enum
@@ -199,6 +199,7 @@ class Conversa(Base):
     mensagens_usuario = Column(Integer, default=0)
     tempo_primeira_resposta = Column(Float, nullable=True)  # segundos
     tempo_resposta_medio = Column(Float, nullable=True)  # segundos
+    mensagens_com_tempo = Column(Integer, default=0)  # Mensagens que entram na média de tempo_resposta
 
     # Dados Evolution API
     evolution_remote_jid = Column(String(200), nullable=True)  # ID do chat no Evolution
@@ -275,6 +276,44 @@ class MetricaDiaria(Base):
     atualizado_em = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 
+# ============= FILA DE WEBHOOKS =============
+
+class StatusWebhook(str, enum.Enum):
+    PENDENTE = "pendente"
+    PROCESSANDO = "processando"
+    CONCLUIDO = "concluido"
+    FALHOU = "falhou"
+
+
+class WebhookRecebido(Base):
+    """Webhook do Evolution gravado antes do processamento (fila durável)"""
+    __tablename__ = "webhooks_recebidos"
+
+    id = Column(Integer, primary_key=True, index=True)
+    pedido_id = Column(Integer, nullable=False, index=True)
+
+    # Chave de ordenação: webhooks da mesma conversa são processados em ordem
+    # Formato: "{pedido_id}:{telefone}"
+    chave_conversa = Column(String(200), nullable=False)
+
+    payload = Column(Text, nullable=False)  # JSON original do webhook
+    status = Column(Enum(StatusWebhook), default=StatusWebhook.PENDENTE, nullable=False)
+    tentativas = Column(Integer, default=0, nullable=False)
+    erro = Column(Text, nullable=True)
+
+    # Lease do consumidor: se o processo morrer, o webhook volta para a fila após este horário
+    bloqueado_ate = Column(DateTime, nullable=True)
+    consumidor = Column(String(200), nullable=True)  # Processo que reservou ("host:pid")
+
+    recebido_em = Column(DateTime, default=datetime.utcnow, nullable=False)
+    processado_em = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_webhooks_recebidos_status_id", "status", "id"),
+        Index("ix_webhooks_recebidos_chave_status", "chave_conversa", "status"),
+    )
+
+
 # ============= ADMINISTRADORES =============
 
 class Administrador(Base):
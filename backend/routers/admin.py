@@ -12,6 +12,7 @@ import bcrypt
 import models
 import schemas
 from database import get_db
+from services import webhook_context
 
 router = APIRouter(prefix="/api/admin", tags=["admin"])
 
@@ -405,6 +406,9 @@ def delete_client(client_id: int, db: Session = Depends(get_db)):
     db.delete(cliente)
     db.commit()
 
+    for pedido in pedidos:
+        webhook_context.invalidar(pedido.id)
+
     return {"message": f"Cliente {cliente.nome} e {len(pedidos)} pedido(s) excluído(s) com sucesso"}
 
 
@@ -520,6 +524,9 @@ def toggle_client(client_id: int, data: dict, db: Session = Depends(get_db)):
     db.commit()
     db.refresh(cliente)
 
+    if novo_status and estava_inativo and pedido:
+        webhook_context.invalidar(pedido.id)
+
     return response_data
 
 
@@ -611,6 +618,9 @@ def update_plan(plano_id: int, updates: dict, db: Session = Depends(get_db)):
     db.commit()
     db.refresh(plano)
 
+    # Plano é compartilhado por vários pedidos em cache
+    webhook_context.invalidar_todos()
+
     return plano
 
 
@@ -724,6 +734,7 @@ def update_order_status(pedido_id: int, novo_status: str, observacoes: Optional[
 
     db.commit()
     db.refresh(pedido)
+    webhook_context.invalidar(pedido_id)
 
     return {"message": "Status atualizado com sucesso", "pedido": pedido}
 
@@ -746,6 +757,7 @@ def update_order(pedido_id: int, updates: dict, db: Session = Depends(get_db)):
     pedido.atualizado_em = datetime.utcnow()
     db.commit()
     db.refresh(pedido)
+    webhook_context.invalidar(pedido_id)
 
     return pedido
 
@@ -792,6 +804,9 @@ def verificar_vencimentos(db: Session = Depends(get_db)):
 
     db.commit()
 
+    for desativado in clientes_desativados:
+        webhook_context.invalidar(desativado["pedido_id"])
+
     # Buscar pedidos que vão vencer em 10 dias
     pedidos_a_vencer = db.query(models.Pedido).join(
         models.Cliente
@@ -944,7 +959,86 @@ def update_configuracoes_sistema(
 ):
     """Atualiza as configurações globais do sistema"""
     import crud
-    return crud.update_configuracao_sistema(db, configuracao)
+    import config_helper
+    db_config = crud.update_configuracao_sistema(db, configuracao)
+
+    # Invalidar cache: serviços de IA são recriados com a nova configuração
+    config_helper.clear_config_cache()
+
+    return db_config
+
+
+# ============ CACHES ============
+
+@router.get("/cache/embeddings")
+def get_cache_embeddings():
+    """Tamanho e taxa de acerto do cache de embeddings"""
+    from services import embedding_cache
+    return embedding_cache.estatisticas()
+
+
+@router.delete("/cache/embeddings")
+def purge_cache_embeddings(modelo: Optional[str] = None):
+    """Limpa o cache de embeddings (todo ou apenas de um modelo)"""
+    from services import embedding_cache
+    removidos = embedding_cache.limpar(modelo)
+    return {
+        "success": True,
+        "message": f"{removidos} embeddings removidos do cache",
+        "removidos": removidos
+    }
+
+
+@router.get("/cache/transcricoes")
+def get_cache_transcricoes():
+    """Tamanho e taxa de acerto do cache de transcrições de áudio"""
+    from services import transcription_cache
+    return transcription_cache.estatisticas()
+
+
+@router.delete("/cache/transcricoes")
+def purge_cache_transcricoes():
+    """Limpa o cache de transcrições de áudio"""
+    from services import transcription_cache
+    removidos = transcription_cache.limpar()
+    return {
+        "success": True,
+        "message": f"{removidos} transcrições removidas do cache",
+        "removidos": removidos
+    }
+
+
+@router.get("/cache/audios")
+def get_cache_audios():
+    """Ocupação e taxa de acerto do cache de áudios de resposta (TTS)"""
+    from services import tts_cache
+    return tts_cache.estatisticas()
+
+
+@router.get("/cache/respostas")
+def get_cache_respostas():
+    """Entradas e taxa de acerto do cache de respostas do RAG"""
+    from services import answer_cache
+    return answer_cache.estatisticas()
+
+
+@router.delete("/cache/respostas")
+def purge_cache_respostas():
+    """Limpa o cache de respostas do RAG"""
+    from services import answer_cache
+    removidos = answer_cache.limpar()
+    return {
+        "success": True,
+        "message": f"{removidos} respostas removidas do cache",
+        "removidos": removidos
+    }
+
+
+@router.get("/ollama/escalonador")
+def get_ollama_escalonador():
+    """Slots em uso, filas por prioridade e tempo de espera do escalonador do Ollama"""
+    from services import ollama_scheduler
+    return ollama_scheduler.estatisticas()
 
 
 # ============ TESTE DE CONEXÃO DOS SERVIÇOS ============
@@ -7,10 +7,23 @@ import models
 from database import get_db
 from schemas_config import ConfiguracaoResponse, ConfiguracaoUpdate
 from pydantic import BaseModel
+from services import tts_cache, routing_engine, webhook_context
 
 router = APIRouter(prefix="/api/config", tags=["Configuration"])
 
 
+def _configuracao_agente_alterada(order: models.Pedido):
+    """
+    Atualiza o que depende de configuracao_agente (chamar após o commit)
+    - Recompila a tabela de roteamento do pedido
+    - Invalida o contexto cacheado dos webhooks
+    - Agenda a pré-renderização dos áudios das respostas fixas
+    """
+    routing_engine.compilar(order.id, order.configuracao_agente)
+    webhook_context.invalidar(order.id)
+    tts_cache.pre_renderizar(json.loads(order.configuracao_agente) if order.configuracao_agente else {})
+
+
 # ========== SCHEMAS ==========
 class RespostaPredefinida(BaseModel):
     id: int = None
@@ -125,6 +138,8 @@ def update_order_configuration(
         db.commit()
         db.refresh(order)
 
+    _configuracao_agente_alterada(order)
+
     return {"message": "Configuração atualizada com sucesso", "pedido_id": order.id}
 
 
@@ -239,6 +254,7 @@ def add_resposta(order_id: int, resposta: RespostaPredefinida, db: Session = Dep
     order.configuracao_agente = json.dumps(config, ensure_ascii=False)
 
     db.commit()
+    _configuracao_agente_alterada(order)
     return {"message": "Resposta adicionada", "id": novo_id}
 
 
@@ -260,6 +276,7 @@ def update_resposta(order_id: int, resposta_id: int, resposta: RespostaPredefini
             config["respostas"] = respostas
             order.configuracao_agente = json.dumps(config, ensure_ascii=False)
             db.commit()
+            _configuracao_agente_alterada(order)
             return {"message": "Resposta atualizada"}
 
     raise HTTPException(status_code=404, detail="Resposta não encontrada")
@@ -279,6 +296,7 @@ def delete_resposta(order_id: int, resposta_id: int, db: Session = Depends(get_d
     order.configuracao_agente = json.dumps(config, ensure_ascii=False)
 
     db.commit()
+    _configuracao_agente_alterada(order)
     return {"message": "Resposta removida"}
 
 
@@ -314,6 +332,7 @@ def add_menu_option(order_id: int, opcao: OpcaoMenu, db: Session = Depends(get_d
     order.configuracao_agente = json.dumps(config, ensure_ascii=False)
 
     db.commit()
+    _configuracao_agente_alterada(order)
     return {"message": "Opção adicionada", "id": novo_id}
 
 
@@ -335,6 +354,7 @@ def update_menu_option(order_id: int, menu_id: int, opcao: OpcaoMenu, db: Sessio
             config["menu"] = menu
             order.configuracao_agente = json.dumps(config, ensure_ascii=False)
             db.commit()
+            _configuracao_agente_alterada(order)
             return {"message": "Opção atualizada"}
 
     raise HTTPException(status_code=404, detail="Opção não encontrada")
@@ -354,6 +374,7 @@ def delete_menu_option(order_id: int, menu_id: int, db: Session = Depends(get_db
     order.configuracao_agente = json.dumps(config, ensure_ascii=False)
 
     db.commit()
+    _configuracao_agente_alterada(order)
     return {"message": "Opção removida"}
 
 
@@ -389,6 +410,7 @@ def add_fluxo(order_id: int, fluxo: FluxoConversa, db: Session = Depends(get_db)
     order.configuracao_agente = json.dumps(config, ensure_ascii=False)
 
     db.commit()
+    _configuracao_agente_alterada(order)
     return {"message": "Fluxo adicionado", "id": novo_id}
 
 
@@ -410,6 +432,7 @@ def update_fluxo(order_id: int, fluxo_id: int, fluxo: FluxoConversa, db: Session
             config["fluxos"] = fluxos
             order.configuracao_agente = json.dumps(config, ensure_ascii=False)
             db.commit()
+            _configuracao_agente_alterada(order)
             return {"message": "Fluxo atualizado"}
 
     raise HTTPException(status_code=404, detail="Fluxo não encontrado")
@@ -429,6 +452,7 @@ def delete_fluxo(order_id: int, fluxo_id: int, db: Session = Depends(get_db)):
     order.configuracao_agente = json.dumps(config, ensure_ascii=False)
 
     db.commit()
+    _configuracao_agente_alterada(order)
     return {"message": "Fluxo removido"}
 
 
@@ -464,6 +488,7 @@ def add_integracao(order_id: int, integracao: Integracao, db: Session = Depends(
     order.configuracao_agente = json.dumps(config, ensure_ascii=False)
 
     db.commit()
+    _configuracao_agente_alterada(order)
     return {"message": "Integração adicionada", "id": novo_id}
 
 
@@ -485,6 +510,7 @@ def update_integracao(order_id: int, integracao_id: int, integracao: Integracao,
             config["integracoes"] = integracoes
             order.configuracao_agente = json.dumps(config, ensure_ascii=False)
             db.commit()
+            _configuracao_agente_alterada(order)
             return {"message": "Integração atualizada"}
 
     raise HTTPException(status_code=404, detail="Integração não encontrada")
@@ -504,6 +530,7 @@ def delete_integracao(order_id: int, integracao_id: int, db: Session = Depends(g
     order.configuracao_agente = json.dumps(config, ensure_ascii=False)
 
     db.commit()
+    _configuracao_agente_alterada(order)
     return {"message": "Integração removida"}
 
 
@@ -566,6 +593,7 @@ def add_atendente(order_id: int, data: AtendenteAdd, db: Session = Depends(get_d
     config_bot.numeros_atendentes = json.dumps(atendentes)
 
     db.commit()
+    webhook_context.invalidar(order_id)
     return {"message": "Atendente adicionado", "numero": data.numero}
 
 
@@ -595,4 +623,5 @@ def remove_atendente(order_id: int, numero: str, db: Session = Depends(get_db)):
     config_bot.numeros_atendentes = json.dumps(atendentes)
 
     db.commit()
+    webhook_context.invalidar(order_id)
     return {"message": "Atendente removido"}
@@ -2,18 +2,17 @@
 Router para integração com Evolution API
 Gerencia webhooks, envio de mensagens e processamento inteligente
 """
-from fastapi import APIRouter, HTTPException, Depends, Request, BackgroundTasks
+from fastapi import APIRouter, HTTPException, Depends, Request
 from sqlalchemy.orm import Session, joinedload
 from typing import Dict, Any, Optional, List
-import httpx
 import json
 from datetime import datetime
 import re
-import unicodedata
 import models
 import crud
 import schemas
 from database import get_db
+from services import webhook_queue, evolution_client, transcription_service, routing_engine, conversation_state, webhook_context, message_writer
 
 router = APIRouter(prefix="/api/evolution", tags=["evolution"])
 
@@ -22,11 +21,7 @@ router = APIRouter(prefix="/api/evolution", tags=["evolution"])
 
 def normalize_text(text: str) -> str:
     """Remove acentos e normaliza texto para busca inteligente"""
-    if not text:
-        return ""
-    # Normalizar unicode e remover acentos
-    nfkd = unicodedata.normalize('NFD', text.lower())
-    return ''.join([c for c in nfkd if not unicodedata.combining(c)])
+    return routing_engine.normalizar(text)
 
 
 def extract_phone_number(data: Dict) -> str:
@@ -121,15 +116,8 @@ def generate_welcome_message(name: str, pedido: models.Pedido) -> str:
     """Gera mensagem de boas-vindas personalizada com menu"""
     greeting = get_greeting_by_time()
 
-    # Obter configuração do pedido
-    config = {}
-    menu_opcoes = []
-    if pedido.configuracao_agente:
-        try:
-            config = json.loads(pedido.configuracao_agente)
-            menu_opcoes = config.get('menu', [])
-        except:
-            pass
+    # Obter menu da configuração do pedido (tabela compilada)
+    menu_opcoes = routing_engine.obter(pedido).menu_opcoes
 
     # Mensagem inicial
     message = f"{greeting}, {name}!\n\n"
@@ -154,19 +142,17 @@ async def send_whatsapp_message(
 ) -> bool:
     """Envia mensagem via Evolution API"""
     try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(
-                f"{evolution_url}/message/sendText/{instance_name}",
-                headers={
-                    "apikey": evolution_key,
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "number": phone,
-                    "text": message
-                }
-            )
-            return response.status_code in [200, 201]
+        response = await evolution_client.post(
+            evolution_url,
+            f"/message/sendText/{instance_name}",
+            evolution_key,
+            instance_name=instance_name,
+            json={
+                "number": phone,
+                "text": message
+            }
+        )
+        return response.status_code in [200, 201]
     except Exception as e:
         print(f"Erro ao enviar mensagem: {e}")
         return False
@@ -184,23 +170,21 @@ async def send_whatsapp_list(
 ) -> bool:
     """Envia mensagem com lista interativa via Evolution API"""
     try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(
-                f"{evolution_url}/message/sendList/{instance_name}",
-                headers={
-                    "apikey": evolution_key,
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "number": phone,
-                    "title": title,
-                    "description": description,
-                    "buttonText": button_text,
-                    "footerText": "Kairix Bot",
-                    "sections": sections
-                }
-            )
-            return response.status_code == 200
+        response = await evolution_client.post(
+            evolution_url,
+            f"/message/sendList/{instance_name}",
+            evolution_key,
+            instance_name=instance_name,
+            json={
+                "number": phone,
+                "title": title,
+                "description": description,
+                "buttonText": button_text,
+                "footerText": "Kairix Bot",
+                "sections": sections
+            }
+        )
+        return response.status_code == 200
     except Exception as e:
         print(f"Erro ao enviar lista: {e}")
         return False
@@ -224,22 +208,20 @@ async def send_whatsapp_menu(
                 "type": 1
             })
 
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(
-                f"{evolution_url}/message/sendButtons/{instance_name}",
-                headers={
-                    "apikey": evolution_key,
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "number": phone,
-                    "title": "Menu",
-                    "description": message,
-                    "buttons": buttons,
-                    "footerText": "Kairix Bot"
-                }
-            )
-            return response.status_code == 200
+        response = await evolution_client.post(
+            evolution_url,
+            f"/message/sendButtons/{instance_name}",
+            evolution_key,
+            instance_name=instance_name,
+            json={
+                "number": phone,
+                "title": "Menu",
+                "description": message,
+                "buttons": buttons,
+                "footerText": "Kairix Bot"
+            }
+        )
+        return response.status_code == 200
     except Exception as e:
         print(f"Erro ao enviar menu: {e}")
         return False
@@ -307,49 +289,36 @@ async def process_message(
 ) -> Optional[str]:
     """Processa mensagem e retorna resposta baseada na configuração"""
 
-    normalized_input = normalize_text(message_text)
+    # Mensagem tokenizada uma única vez (tokens, números e forma normalizada)
+    mensagem = routing_engine.tokenizar(message_text)
+    normalized_input = mensagem.normalizado
 
-    # Carregar menu da configuração do pedido
-    menu_opcoes = []
-    if pedido.configuracao_agente:
-        try:
-            config_data = json.loads(pedido.configuracao_agente)
-            menu_opcoes = config_data.get('menu', [])
-        except:
-            pass
-
-    # Carregar contexto da conversa
-    contexto = {}
-    if conversa.contexto:
-        try:
-            contexto = json.loads(conversa.contexto)
-        except:
-            contexto = {}
+    # Tabela de roteamento compilada do pedido (menu, submenus e respostas rápidas)
+    tabela = routing_engine.obter(pedido)
+    menu_opcoes = tabela.menu_opcoes
+
+    # Carregar contexto da conversa (estado local versionado, fora do event loop; gravado no banco em segundo plano)
+    timeout_inatividade = config.timeout_inatividade
+    estado = await conversation_state.carregar_async(conversa, timeout_inatividade)
+    contexto = estado.contexto
 
     # ANTES DE QUALQUER COISA: Verificar saudações
-    saudacoes = ['oi', 'ola', 'bom dia', 'boa tarde', 'boa noite', 'opa', 'olá', 'eai', 'e ai']
-    for saudacao in saudacoes:
-        saudacao_norm = normalize_text(saudacao)
-        if saudacao_norm == normalized_input or normalized_input.startswith(saudacao_norm):
-            greeting = get_greeting_by_time()
-            # Limpar contexto
-            contexto = {}
-            crud.update_conversa(db, conversa.id, schemas.ConversaAtualizar(
-                contexto=json.dumps(contexto)
-            ))
-            # Mostrar menu com saudação
-            if menu_opcoes:
-                menu_texto, _ = gerar_menu_com_pergunta_rapida(menu_opcoes)
-                return f"{greeting}! 👋\n\nComo posso ajudar você?\n\n{menu_texto}"
-            return f"{greeting}! 👋\n\nComo posso ajudar você?\n\nDigite *menu* para ver as opções disponíveis."
+    if tabela.eh_saudacao(normalized_input):
+        greeting = get_greeting_by_time()
+        # Limpar contexto
+        contexto = {}
+        await conversation_state.salvar_async(estado, contexto, timeout_inatividade)
+        # Mostrar menu com saudação
+        if menu_opcoes:
+            menu_texto, _ = gerar_menu_com_pergunta_rapida(menu_opcoes)
+            return f"{greeting}! 👋\n\nComo posso ajudar você?\n\n{menu_texto}"
+        return f"{greeting}! 👋\n\nComo posso ajudar você?\n\nDigite *menu* para ver as opções disponíveis."
 
     # Verificar comando "voltar" ou "menu" (SEMPRE volta ao menu principal)
-    if 'voltar' in normalized_input or 'menu' in normalized_input:
+    if mensagem.pediu_navegacao():
         # Limpar contexto
         contexto = {}
-        crud.update_conversa(db, conversa.id, schemas.ConversaAtualizar(
-            contexto=json.dumps(contexto)
-        ))
+        await conversation_state.salvar_async(estado, contexto, timeout_inatividade)
 
         # Mostrar menu principal com opção de pergunta rápida
         if menu_opcoes:
@@ -358,141 +327,108 @@ async def process_message(
         return "Menu não configurado."
 
     # SEMPRE VERIFICAR RESPOSTAS RÁPIDAS (independente do modo)
-    respostas_rapidas = []
-    if pedido.configuracao_agente:
-        try:
-            config_data = json.loads(pedido.configuracao_agente)
-            respostas_rapidas = config_data.get('respostas', [])
-        except:
-            pass
-
-    if respostas_rapidas:
-        for resposta in respostas_rapidas:
-            palavras_chave = resposta.get('palavras_chave', [])
-            resposta_texto = resposta.get('resposta', '')
-
-            for palavra in palavras_chave:
-                palavra_norm = normalize_text(palavra)
-                if palavra_norm in normalized_input or normalized_input in palavra_norm:
-                    # Responder com opções de navegação
-                    resposta_completa = f"{resposta_texto}\n\n"
-                    resposta_completa += f"━━━━━━━━━━━━━━━━━\n"
-                    resposta_completa += f"Digite *menu* para voltar ao menu principal\n"
-                    resposta_completa += f"Ou faça outra pergunta rápida!"
-                    return resposta_completa
+    resposta = tabela.resposta_rapida(normalized_input)
+    if resposta:
+        resposta_texto = resposta.get('resposta', '')
+        # Responder com opções de navegação
+        resposta_completa = f"{resposta_texto}\n\n"
+        resposta_completa += f"━━━━━━━━━━━━━━━━━\n"
+        resposta_completa += f"Digite *menu* para voltar ao menu principal\n"
+        resposta_completa += f"Ou faça outra pergunta rápida!"
+        return resposta_completa
 
     # VERIFICAR SE ESTÁ EM UM SUBMENU ATIVO
     submenu_ativo = contexto.get('submenu_ativo')
     if submenu_ativo:
         # Processar escolha do submenu
-        submenu_opcoes = submenu_ativo.get('opcoes', [])
+        submenu = tabela.submenu_ativo(submenu_ativo)
 
         # Verificar se escolheu a opção "Pergunta Rápida" do submenu
-        numeros_usados = [int(op.get('numero', 0)) for op in submenu_opcoes if op.get('numero', '').isdigit()]
-        numero_pergunta_rapida = max(numeros_usados) + 1 if numeros_usados else len(submenu_opcoes) + 1
-
-        if str(numero_pergunta_rapida) in message_text or ('pergunta' in normalized_input and 'rapida' in normalized_input):
+        if submenu.pediu_pergunta_rapida(mensagem):
             # Limpar submenu e ativar modo pergunta rápida
             contexto.pop('submenu_ativo', None)
             contexto['modo_pergunta_rapida'] = True
-            crud.update_conversa(db, conversa.id, schemas.ConversaAtualizar(
-                contexto=json.dumps(contexto)
-            ))
+            await conversation_state.salvar_async(estado, contexto, timeout_inatividade)
             return "❓ *Modo Pergunta Rápida ativado!*\n\nPode fazer suas perguntas que vou responder o que souber.\n\n_Digite *menu* para voltar ao menu principal_"
 
-        for sub_opcao in submenu_opcoes:
-            numero = str(sub_opcao.get('numero', ''))
-            titulo = sub_opcao.get('titulo', '')
+        # Se escolheu uma opção do submenu (número ou título, token exato ou aproximado)
+        escolhas = submenu.escolhas(mensagem)
+        if escolhas:
+            sub_opcao = submenu.opcoes[escolhas[0]]
+            resposta = sub_opcao.get('resposta', 'Opção selecionada!')
 
-            # Se escolheu uma opção do submenu
-            if numero in message_text or normalize_text(titulo) in normalized_input:
-                resposta = sub_opcao.get('resposta', 'Opção selecionada!')
+            # Manter submenu ativo para permitir novas escolhas
+            # Não limpar o contexto - assim o usuário pode escolher outras opções do mesmo submenu
 
-                # Manter submenu ativo para permitir novas escolhas
-                # Não limpar o contexto - assim o usuário pode escolher outras opções do mesmo submenu
+            # Adicionar instruções de navegação
+            submenu_titulo = submenu_ativo.get('titulo', 'Menu')
+            resposta_completa = f"{resposta}\n\n"
+            resposta_completa += f"━━━━━━━━━━━━━━━━━\n"
+            resposta_completa += f"Digite *voltar* para retornar ao submenu {submenu_titulo}\n"
+            resposta_completa += f"Digite *menu* para voltar ao menu principal"
 
-                # Adicionar instruções de navegação
-                submenu_titulo = submenu_ativo.get('titulo', 'Menu')
-                resposta_completa = f"{resposta}\n\n"
-                resposta_completa += f"━━━━━━━━━━━━━━━━━\n"
-                resposta_completa += f"Digite *voltar* para retornar ao submenu {submenu_titulo}\n"
-                resposta_completa += f"Digite *menu* para voltar ao menu principal"
-
-                return resposta_completa
+            return resposta_completa
 
         # Se não escolheu nenhuma opção válida, informar
         submenu_titulo = submenu_ativo.get('titulo', 'submenu')
         return f"⚠️ Opção inválida.\n\nPor favor, escolha uma das opções do {submenu_titulo} ou:\n• Digite *voltar* para ver as opções novamente\n• Digite *menu* para voltar ao menu principal"
 
     # 2. Verificar se escolheu a opção "Pergunta Rápida"
-    if menu_opcoes:
-        # Calcular o número da opção "pergunta rápida"
-        numeros_usados = [int(op.get('numero', 0)) for op in menu_opcoes if op.get('numero', '').isdigit()]
-        numero_pergunta_rapida = max(numeros_usados) + 1 if numeros_usados else len(menu_opcoes) + 1
+    if menu_opcoes and tabela.menu.pediu_pergunta_rapida(mensagem):
+        # Ativar modo pergunta rápida
+        contexto['modo_pergunta_rapida'] = True
+        await conversation_state.salvar_async(estado, contexto, timeout_inatividade)
+        return "❓ *Modo Pergunta Rápida ativado!*\n\nPode fazer suas perguntas que vou responder o que souber.\n\n_Digite *menu* para voltar ao menu principal_"
+
+    # 3. Verificar menu interativo principal (opções escolhidas, da mais provável para a menos)
+    for indice in tabela.menu.escolhas(mensagem):
+        opcao = menu_opcoes[indice]
+        titulo = opcao.get('titulo', '')
+        acao = opcao.get('acao', 'resposta')
 
-        if str(numero_pergunta_rapida) in message_text or 'pergunta' in normalized_input and 'rapida' in normalized_input:
-            # Ativar modo pergunta rápida
-            contexto['modo_pergunta_rapida'] = True
+        if acao == 'resposta':
+            resposta = opcao.get('resposta', opcao.get('descricao', ''))
+            # Adicionar opções de navegação
+            resposta_completa = f"{resposta}\n\n"
+            resposta_completa += f"━━━━━━━━━━━━━━━━━\n"
+            resposta_completa += f"Digite *menu* para voltar ao menu principal\n"
+            resposta_completa += f"Ou faça uma pergunta rápida sobre qualquer assunto!"
+            return resposta_completa
+
+        elif acao == 'submenu':
+            # Submenu já decodificado na compilação da tabela
+            try:
+                submenu = tabela.menu.submenu(indice)
+
+                if submenu:
+                    # Salvar submenu no contexto
+                    contexto['submenu_ativo'] = {
+                        'titulo': titulo,
+                        'opcoes': submenu
+                    }
+                    await conversation_state.salvar_async(estado, contexto, timeout_inatividade)
+
+                    # Retornar opções do submenu com pergunta rápida
+                    menu_texto, _ = gerar_menu_com_pergunta_rapida(submenu, titulo)
+                    return f"{menu_texto}\n_Digite 'voltar' para retornar ao menu principal_"
+            except:
+                return "Erro ao carregar submenu."
+
+        elif acao == 'atendente':
+            # Mudar status da conversa para AGUARDANDO
             crud.update_conversa(db, conversa.id, schemas.ConversaAtualizar(
-                contexto=json.dumps(contexto)
+                status=models.StatusConversa.AGUARDANDO
             ))
-            return "❓ *Modo Pergunta Rápida ativado!*\n\nPode fazer suas perguntas que vou responder o que souber.\n\n_Digite *menu* para voltar ao menu principal_"
 
-    # 3. Verificar menu interativo principal
-    for opcao in menu_opcoes:
-        numero = str(opcao.get('numero', ''))
-        titulo = opcao.get('titulo', '')
-        acao = opcao.get('acao', 'resposta')
-
-        # Se escolheu esta opção
-        if numero in message_text or normalize_text(titulo) in normalized_input:
-
-            if acao == 'resposta':
-                resposta = opcao.get('resposta', opcao.get('descricao', ''))
-                # Adicionar opções de navegação
-                resposta_completa = f"{resposta}\n\n"
-                resposta_completa += f"━━━━━━━━━━━━━━━━━\n"
-                resposta_completa += f"Digite *menu* para voltar ao menu principal\n"
-                resposta_completa += f"Ou faça uma pergunta rápida sobre qualquer assunto!"
-                return resposta_completa
-
-            elif acao == 'submenu':
-                # Carregar submenu
-                submenu_json = opcao.get('submenu', '[]')
-                try:
-                    submenu = json.loads(submenu_json) if isinstance(submenu_json, str) else submenu_json
-
-                    if submenu:
-                        # Salvar submenu no contexto
-                        contexto['submenu_ativo'] = {
-                            'titulo': titulo,
-                            'opcoes': submenu
-                        }
-                        crud.update_conversa(db, conversa.id, schemas.ConversaAtualizar(
-                            contexto=json.dumps(contexto)
-                        ))
-
-                        # Retornar opções do submenu com pergunta rápida
-                        menu_texto, _ = gerar_menu_com_pergunta_rapida(submenu, titulo)
-                        return f"{menu_texto}\n_Digite 'voltar' para retornar ao menu principal_"
-                except:
-                    return "Erro ao carregar submenu."
-
-            elif acao == 'atendente':
-                # Mudar status da conversa para AGUARDANDO
-                crud.update_conversa(db, conversa.id, schemas.ConversaAtualizar(
-                    status=models.StatusConversa.AGUARDANDO
-                ))
-
-                # Enviar notificação para atendentes (se configurados)
-                await notify_attendants(
-                    config=config,
-                    customer_name=conversa.contato_nome,
-                    customer_phone=conversa.contato_numero,
-                    conversa_id=conversa.id
-                )
+            # Enviar notificação para atendentes (se configurados)
+            await notify_attendants(
+                config=config,
+                customer_name=conversa.contato_nome,
+                customer_phone=conversa.contato_numero,
+                conversa_id=conversa.id
+            )
 
-                return "Um atendente será notificado e entrará em contato em breve. Aguarde um momento..."
+            return "Um atendente será notificado e entrará em contato em breve. Aguarde um momento..."
 
     # 4. Se tem IA ativa (Bot IA ou Agente Financeiro)
     plano_tipo = pedido.plano.tipo if pedido and pedido.plano else None
@@ -525,7 +461,7 @@ async def process_with_ai(
 
 # ============ WEBHOOK RECEIVER ============
 
-async def process_webhook_background(pedido_id: int, data: dict, config, pedido):
+async def process_webhook_background(pedido_id: int, data: dict):
     """Processa webhook em background para resposta rápida"""
     print(f"🚨 BACKGROUND TASK CHAMADA! Pedido: {pedido_id}")
 
@@ -573,10 +509,23 @@ async def process_webhook_background(pedido_id: int, data: dict, config, pedido)
         #     print(f"⏭️ Mensagem ignorada - Número não permitido: {phone}")
         #     return
 
+        # Pedido, plano e configuração (cache por pedido) + conversa ativa do contato
+        contexto = webhook_context.carregar(db, pedido_id, phone)
+        pedido = contexto.pedido
+        config = contexto.config
+
+        if not pedido:
+            print(f"❌ Pedido {pedido_id} não encontrado!")
+            return
+
+        if not config or not config.evolution_url or not config.evolution_key:
+            print(f"⚠️ Evolution não configurado para pedido {pedido_id}")
+            return
+
         # === GRAVAR CONVERSA E MENSAGEM ===
 
         # 1. Buscar ou criar conversa
-        conversa = crud.get_conversa_by_numero(db, pedido_id, phone)
+        conversa = contexto.conversa
 
         if not conversa:
             # Extrair nome do contato
@@ -599,13 +548,13 @@ async def process_webhook_background(pedido_id: int, data: dict, config, pedido)
         else:
             is_first_message = False
 
+        # Reativação e mensagem recebida gravadas juntas (uma transação)
+        entrada = crud.UnidadeMensagens()
+
         # Se conversa estava AGUARDANDO, reativar automaticamente
         if conversa.status == models.StatusConversa.AGUARDANDO:
             print(f"🔄 Reativando conversa que estava aguardando atendente")
-            crud.update_conversa(db, conversa.id, schemas.ConversaAtualizar(
-                status=models.StatusConversa.ATIVA
-            ))
-            conversa = crud.get_conversa_by_numero(db, pedido_id, phone)  # Recarregar
+            entrada.atualizar_conversa(conversa.id, status=models.StatusConversa.ATIVA)
 
         # 2. Gravar mensagem recebida
         msg_id = data.get('data', {}).get('key', {}).get('id', None) or None
@@ -613,6 +562,10 @@ async def process_webhook_background(pedido_id: int, data: dict, config, pedido)
         # Salvar conversa_id ANTES de qualquer operação que possa dar erro
         conversa_id = conversa.id
 
+        # Última interação antes desta mensagem (usada nas boas-vindas do Agente IA)
+        ultima_interacao = conversa.ultima_interacao
+        tempo_primeira_resposta = conversa.tempo_primeira_resposta
+
         mensagem_recebida = schemas.MensagemCriar(
             conversa_id=conversa_id,
             tipo=schemas.TipoMensagem.TEXTO,
@@ -623,9 +576,10 @@ async def process_webhook_background(pedido_id: int, data: dict, config, pedido)
             respondida_por_bot=True
         )
 
+        timestamp_recebida = entrada.adicionar_mensagem(mensagem_recebida)
+
         try:
-            msg_recebida_db = crud.create_mensagem(db, mensagem_recebida)
-            timestamp_recebida = msg_recebida_db.timestamp
+            await message_writer.gravar(db, entrada)
         except Exception as e:
             # Se der erro de unique constraint no evolution_message_id, é porque o webhook veio duplicado
             # Nesse caso busca a resposta já enviada e reenvia
@@ -672,9 +626,9 @@ async def process_webhook_background(pedido_id: int, data: dict, config, pedido)
             # === AGENTE IA COM RAG ===
             print(f"🤖 Usando Agente IA com RAG para pedido {pedido_id}")
 
-            from services.ia_handler import IAHandler
+            from services import service_registry
 
-            ia_handler = IAHandler()
+            ia_handler = service_registry.get_ia_handler()
 
             # VERIFICAR SE PRECISA ENVIAR BOAS-VINDAS
             # Se última mensagem foi há mais de 10 minutos, enviar boas-vindas
@@ -685,14 +639,9 @@ async def process_webhook_background(pedido_id: int, data: dict, config, pedido)
                 enviar_boas_vindas = True
                 print(f"👋 Primeira mensagem - enviando boas-vindas")
             else:
-                # Verificar última mensagem da conversa
-                ultima_mensagem = db.query(models.Mensagem)\
-                    .filter(models.Mensagem.conversa_id == conversa_id)\
-                    .order_by(models.Mensagem.timestamp.desc())\
-                    .first()
-
-                if ultima_mensagem:
-                    tempo_decorrido = datetime.now() - ultima_mensagem.timestamp
+                # Verificar a interação anterior a esta mensagem (já lida com a conversa)
+                if ultima_interacao:
+                    tempo_decorrido = datetime.utcnow() - ultima_interacao
                     if tempo_decorrido > timedelta(minutes=10):
                         enviar_boas_vindas = True
                         print(f"👋 Última mensagem há {tempo_decorrido.seconds//60} minutos - enviando boas-vindas")
@@ -725,7 +674,9 @@ Como posso ajudar você hoje?"""
                     conteudo=welcome_text,
                     respondida_por_bot=True
                 )
-                crud.create_mensagem(db, welcome_msg)
+                saida = crud.UnidadeMensagens()
+                saida.adicionar_mensagem(welcome_msg)
+                await message_writer.gravar(db, saida)
                 print(f"✅ Boas-vindas enviadas")
 
             # Preparar configurações do bot
@@ -762,13 +713,15 @@ Como posso ajudar você hoje?"""
 
             # Gravar mensagem de boas-vindas
             welcome_msg = schemas.MensagemCriar(
-                conversa_id=conversa.id,
+                conversa_id=conversa_id,
                 tipo=schemas.TipoMensagem.TEXTO,
                 direcao=schemas.DirecaoMensagem.ENVIADA,
                 conteudo=welcome_message,
                 respondida_por_bot=True
             )
-            crud.create_mensagem(db, welcome_msg)
+            saida = crud.UnidadeMensagens()
+            saida.adicionar_mensagem(welcome_msg)
+            await message_writer.gravar(db, saida)
 
             # Para o Agente Normal, não processar a primeira mensagem
             # (usuário deve escolher opção do menu)
@@ -801,10 +754,10 @@ Como posso ajudar você hoje?"""
 
             # 5. Gravar resposta enviada (SEMPRE, mesmo se falhou o envio)
             # Isso garante histórico completo e permite testes sem Evolution configurado
-            print(f"💾 Salvando resposta do bot - Conversa: {conversa.id}, Texto: {response_text[:50]}...")
+            print(f"💾 Salvando resposta do bot - Conversa: {conversa_id}, Texto: {response_text[:50]}...")
 
             mensagem_enviada = schemas.MensagemCriar(
-                conversa_id=conversa.id,
+                conversa_id=conversa_id,
                 tipo=schemas.TipoMensagem.TEXTO,
                 direcao=schemas.DirecaoMensagem.ENVIADA,
                 conteudo=response_text,
@@ -812,76 +765,89 @@ Como posso ajudar você hoje?"""
                 tempo_resposta=tempo_resposta
             )
 
-            msg_salva = crud.create_mensagem(db, mensagem_enviada)
-            print(f"✅ Mensagem do bot salva com ID: {msg_salva.id}, Direção: {msg_salva.direcao}")
+            saida = crud.UnidadeMensagens()
+            saida.adicionar_mensagem(mensagem_enviada)
 
-            # 6. Atualizar tempo da primeira resposta se necessário
-            if not conversa.tempo_primeira_resposta:
-                crud.update_conversa(
-                    db,
-                    conversa.id,
-                    schemas.ConversaAtualizar(contexto=conversa.contexto)
-                )
-                # Atualizar manualmente o tempo_primeira_resposta
-                conversa.tempo_primeira_resposta = tempo_resposta
-                db.commit()
+            # 6. Atualizar tempo da primeira resposta se necessário (mesma transação da resposta)
+            # (contexto não é regravado aqui: o estado da conversa tem write-behind próprio)
+            if not tempo_primeira_resposta:
+                saida.atualizar_conversa(conversa_id, tempo_primeira_resposta=tempo_resposta)
+
+            ids = await message_writer.gravar(db, saida)
+            print(f"✅ Mensagem do bot salva com ID: {ids[0]}, Direção: {mensagem_enviada.direcao}")
 
     except Exception as e:
         print(f"❌ Erro processando webhook em background: {e}")
         import traceback
         traceback.print_exc()
+        # Propagar para a fila durável registrar a falha (nova tentativa ou FALHOU)
+        raise
     finally:
         # Fechar a sessão do banco
         db.close()
 
 
+async def processar_webhook_enfileirado(pedido_id: int, data: dict):
+    """Handler da fila durável: processa o webhook (contexto carregado no processamento)"""
+    await process_webhook_background(pedido_id, data)
+
+
 @router.post("/webhook/{pedido_id}")
 async def receive_webhook(
     pedido_id: int,
     request: Request,
-    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db)
 ):
     """
     Recebe webhooks do Evolution API - RESPOSTA RÁPIDA
     URL para configurar no Evolution: https://seu-dominio.com/api/evolution/webhook/{pedido_id}
+
+    O webhook é gravado na fila durável (webhooks_recebidos) e processado
+    pelos consumidores em background. Nada de IA/RAG roda dentro do request.
     """
     try:
-        print(f"\n{'='*80}")
-        print(f"🔔 WEBHOOK RECEBIDO - Pedido ID: {pedido_id}")
-        print(f"{'='*80}")
-
-        # Buscar pedido e configuração RAPIDAMENTE (carregar relacionamento plano)
-        pedido = db.query(models.Pedido).options(joinedload(models.Pedido.plano)).filter(models.Pedido.id == pedido_id).first()
-        if not pedido:
-            print(f"❌ Pedido {pedido_id} não encontrado!")
-            return {"status": "error", "message": "Pedido não encontrado"}
+        # Parse do webhook
+        data = await request.json()
+    except Exception as e:
+        print(f"❌ Webhook inválido: {e}")
+        raise HTTPException(status_code=400, detail="JSON inválido")
 
-        # Buscar configuração do bot
-        config = db.query(models.ConfiguracaoBot).filter(
-            models.ConfiguracaoBot.pedido_id == pedido_id
-        ).first()
+    try:
+        event_type = data.get('event', '')
 
-        if not config or not config.evolution_url or not config.evolution_key:
-            print(f"⚠️ Evolution não configurado para pedido {pedido_id}")
-            return {"status": "error", "message": "Evolution não configurado"}
+        print(f"🔔 WEBHOOK RECEBIDO - Pedido ID: {pedido_id} - Evento: {event_type}")
 
-        # Parse do webhook
-        data = await request.json()
+        # Eventos que não são mensagens não entram na fila
+        if event_type not in ['messages.upsert', 'message.create']:
+            return {"status": "ignored", "pedido_id": pedido_id}
 
-        # Log COMPLETO do webhook
-        print(f"📦 Dados recebidos: {json.dumps(data, indent=2, ensure_ascii=False)}")
-        print(f"{'='*80}\n")
+        # Telefone define a ordem de processamento na fila
+        phone = extract_phone_number(data.get('data', {}))
+        if not phone and data.get('sender'):
+            phone = data.get('sender', '').split('@')[0]
 
-        # PROCESSAR DIRETAMENTE (sem background por enquanto para debug)
-        await process_webhook_background(pedido_id, data, config, pedido)
+        webhook = webhook_queue.enfileirar_webhook(db, pedido_id, phone, data)
 
-        # Retornar resposta
-        return {"status": "received", "pedido_id": pedido_id}
+        return {"status": "received", "pedido_id": pedido_id, "webhook_id": webhook.id}
 
     except Exception as e:
+        # Webhook não gravado na fila: erro para o Evolution reenviar
         print(f"❌ Erro recebendo webhook: {e}")
-        return {"status": "error", "message": str(e)}
+        raise HTTPException(status_code=503, detail="Falha ao gravar o webhook na fila")
+
+
+@router.get("/queue/status")
+def get_queue_status(db: Session = Depends(get_db)):
+    """Retorna a situação da fila de webhooks, das lanes, da transcrição, do estado das conversas, do cache de contexto e da gravação de mensagens"""
+    return {
+        "fila": webhook_queue.estatisticas_fila(db),
+        "consumidor": webhook_queue.CONSUMIDOR_ID,
+        "lanes": webhook_queue.metricas_lanes(),
+        "transcricao": transcription_service.estatisticas(),
+        "estado_conversas": conversation_state.estatisticas(),
+        "contexto_webhook": webhook_context.estatisticas(),
+        "gravacao_mensagens": message_writer.estatisticas()
+    }
 
 
 # ============ CONFIGURAÇÃO EVOLUTION ============
@@ -925,6 +891,7 @@ async def save_evolution_config(
 
     db.commit()
     db.refresh(config)
+    webhook_context.invalidar(pedido_id)
 
     # Retornar URL do webhook para configurar no Evolution
     webhook_url = f"{config_data.get('kairix_url', 'https://seu-dominio.com')}/api/evolution/webhook/{pedido_id}"
@@ -980,24 +947,25 @@ async def test_evolution_connection(pedido_id: int, db: Session = Depends(get_db
         raise HTTPException(status_code=400, detail="Evolution não configurado")
 
     try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            response = await client.get(
-                f"{config.evolution_url}/instance/fetchInstances",
-                headers={"apikey": config.evolution_key}
-            )
+        response = await evolution_client.get(
+            config.evolution_url,
+            "/instance/fetchInstances",
+            config.evolution_key,
+            timeout=10.0
+        )
 
-            if response.status_code == 200:
-                instances = response.json()
-                return {
-                    "status": "success",
-                    "message": "Conexão estabelecida com sucesso!",
-                    "instances": instances
-                }
-            else:
-                return {
-                    "status": "error",
-                    "message": f"Erro na conexão: {response.status_code}"
-                }
+        if response.status_code == 200:
+            instances = response.json()
+            return {
+                "status": "success",
+                "message": "Conexão estabelecida com sucesso!",
+                "instances": instances
+            }
+        else:
+            return {
+                "status": "error",
+                "message": f"Erro na conexão: {response.status_code}"
+            }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao conectar: {str(e)}")
 
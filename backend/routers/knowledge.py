@@ -5,31 +5,24 @@ Upload, listagem e exclusão de documentos
 from fastapi import APIRouter, UploadFile, File, HTTPException, Depends
 from sqlalchemy.orm import Session
 from typing import List
+from fastapi.responses import StreamingResponse
 from pathlib import Path
 import os
+import json
 import shutil
+import asyncio
 
 from database import get_db
 import models
 from services.rag_service import RAGService
-from config_helper import get_qdrant_url, get_ollama_url, get_ollama_model, get_ollama_embeddings_model
+from services import service_registry, ingestion_jobs, text_index
 
 router = APIRouter(prefix="/api/knowledge", tags=["Knowledge Base"])
 
 
 def get_rag_service() -> RAGService:
-    """Inicializa serviço RAG com configurações do sistema"""
-    qdrant_url = get_qdrant_url()
-    ollama_url = get_ollama_url()
-    embeddings_model = get_ollama_embeddings_model()
-    llm_model = get_ollama_model()
-
-    return RAGService(
-        qdrant_url=qdrant_url,
-        ollama_url=ollama_url,
-        embeddings_model=embeddings_model,
-        llm_model=llm_model
-    )
+    """Retorna o serviço RAG compartilhado (recriado quando a configuração muda)"""
+    return service_registry.get_rag_service()
 
 
 def get_storage_path(phone_number: str) -> Path:
@@ -48,6 +41,9 @@ async def upload_document(
     """
     Upload de documento para base de conhecimento
 
+    O arquivo é salvo e a vetorização roda em background. Acompanhe o
+    progresso em /api/knowledge/jobs/{job_id} (ou /stream via SSE).
+
     Args:
         pedido_id: ID do pedido
         file: Arquivo (PDF, DOCX, TXT)
@@ -88,42 +84,78 @@ async def upload_document(
             detail=f"Formato não suportado. Use: {', '.join(allowed_extensions)}"
         )
 
-    try:
-        # Salvar arquivo
-        storage_path = get_storage_path(instance_name)
-        file_path = storage_path / file.filename
+    # Salvar arquivo
+    storage_path = get_storage_path(instance_name)
+    file_path = storage_path / file.filename
 
-        # Salvar conteúdo
+    try:
         with open(file_path, "wb") as buffer:
             shutil.copyfileobj(file.file, buffer)
+    except Exception as e:
+        if file_path.exists():
+            file_path.unlink()
+        raise HTTPException(status_code=500, detail=f"Erro ao salvar documento: {str(e)}")
+
+    print(f"📁 Arquivo salvo: {file_path}")
+
+    # Vetorização roda em background; o painel acompanha pelo job_id
+    job = ingestion_jobs.submeter(
+        pedido_id=pedido_id,
+        instance_name=instance_name,
+        file_path=str(file_path),
+        metadata={
+            "pedido_id": pedido_id,
+            "uploaded_by": pedido.cliente.nome
+        }
+    )
 
-        print(f"📁 Arquivo salvo: {file_path}")
+    return {
+        "success": True,
+        "message": "Documento recebido, processamento iniciado",
+        "filename": file.filename,
+        "job_id": job.id,
+        "status": job.status,
+        "instance_name": instance_name
+    }
 
-        # Vetorizar documento
-        rag_service = get_rag_service()
-        chunks_count = rag_service.vectorize_document(
-            phone_number=instance_name,
-            file_path=str(file_path),
-            metadata={
-                "pedido_id": pedido_id,
-                "uploaded_by": pedido.cliente.nome
-            }
-        )
 
-        return {
-            "success": True,
-            "message": "Documento processado com sucesso",
-            "filename": file.filename,
-            "chunks_count": chunks_count,
-            "instance_name": instance_name
-        }
+# ============ JOBS DE INGESTÃO ============
 
-    except Exception as e:
-        # Remover arquivo se houve erro
-        if file_path.exists():
-            file_path.unlink()
+@router.get("/jobs/pedido/{pedido_id}")
+def list_ingestion_jobs(pedido_id: int):
+    """Lista os jobs de ingestão recentes de um pedido"""
+    return {"jobs": [job.to_dict() for job in ingestion_jobs.listar(pedido_id)]}
 
-        raise HTTPException(status_code=500, detail=f"Erro ao processar documento: {str(e)}")
+
+@router.get("/jobs/{job_id}")
+def get_ingestion_job(job_id: str):
+    """Progresso de um job de ingestão (chunks, throughput e erro)"""
+    job = ingestion_jobs.obter(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    return job.to_dict()
+
+
+@router.get("/jobs/{job_id}/stream")
+async def stream_ingestion_job(job_id: str):
+    """Progresso de um job via Server-Sent Events (até o job finalizar)"""
+    job = ingestion_jobs.obter(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+
+    async def eventos():
+        ultimo = None
+        while True:
+            estado = job.to_dict()
+            atual = (estado["status"], estado["etapa"], estado["chunks_processados"])
+            if atual != ultimo:
+                yield f"data: {json.dumps(estado, ensure_ascii=False)}\n\n"
+                ultimo = atual
+            if job.finalizado:
+                break
+            await asyncio.sleep(0.5)
+
+    return StreamingResponse(eventos(), media_type="text/event-stream")
 
 
 @router.get("/list/{pedido_id}")
@@ -264,16 +296,16 @@ def delete_document(pedido_id: int, filename: str, db: Session = Depends(get_db)
 
     try:
         file_path.unlink()
+        text_index.remover_documento(instance_name, filename)
         print(f"🗑️  Arquivo deletado: {file_path}")
 
-        # TODO: Remover vetores específicos deste documento do Qdrant
-        # Por enquanto, seria necessário reprocessar todos os outros documentos
-        # ou implementar um sistema de tags para filtrar por arquivo
+        # Remover vetores deste documento do Qdrant (filtro por file_name)
+        rag_service = get_rag_service()
+        rag_service.delete_document_vectors(instance_name, filename)
 
         return {
             "success": True,
-            "message": f"Documento {filename} deletado",
-            "note": "Os vetores permanecerão no Qdrant. Para limpeza completa, delete toda a base."
+            "message": f"Documento {filename} deletado"
         }
 
     except Exception as e:
@@ -5,6 +5,7 @@ import crud
 import schemas
 import models
 from database import get_db
+from services import webhook_context
 import os
 
 router = APIRouter(prefix="/api/orders", tags=["Orders"])
@@ -128,6 +129,7 @@ def update_order_status(
     order = crud.update_order_status(db, order_id, status_update)
     if not order:
         raise HTTPException(status_code=404, detail="Pedido não encontrado")
+    webhook_context.invalidar(order_id)
     return order
 
 
@@ -141,6 +143,7 @@ def update_order(
     order = crud.update_order(db, order_id, order_update)
     if not order:
         raise HTTPException(status_code=404, detail="Pedido não encontrado")
+    webhook_context.invalidar(order_id)
     return order
 
 
@@ -169,6 +172,7 @@ def confirm_payment(
     )
 
     order = crud.update_order(db, order_id, order_update)
+    webhook_context.invalidar(order_id)
     return order
 
 
@@ -330,6 +334,7 @@ async def kirvano_webhook(webhook_data: dict, db: Session = Depends(get_db)):
 
     db.commit()
     db.refresh(order)
+    webhook_context.invalidar(order.id)
 
     response_data = {
         "status": "success",
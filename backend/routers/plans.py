@@ -5,6 +5,7 @@ import crud
 import schemas
 import models
 from database import get_db
+from services import webhook_context
 
 router = APIRouter(prefix="/api/plans", tags=["Plans"])
 
@@ -56,6 +57,8 @@ def update_plan(
     updated_plan = crud.update_plan(db, plan_id, plan)
     if not updated_plan:
         raise HTTPException(status_code=404, detail="Plano não encontrado")
+    # Plano fica no contexto cacheado dos webhooks (pedido.plano)
+    webhook_context.invalidar_todos()
     return updated_plan
 
 
@@ -65,4 +68,5 @@ def delete_plan(plan_id: int, db: Session = Depends(get_db)):
     success = crud.delete_plan(db, plan_id)
     if not success:
         raise HTTPException(status_code=404, detail="Plano não encontrado")
+    webhook_context.invalidar_todos()
     return {"message": "Plano deletado com sucesso"}
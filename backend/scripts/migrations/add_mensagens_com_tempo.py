@@ -0,0 +1,34 @@
+"""
+Script de migração para adicionar coluna mensagens_com_tempo na tabela conversas
+e popular os contadores incrementais de métricas a partir das mensagens existentes
+"""
+from database import engine, SessionLocal
+from sqlalchemy import text
+import crud
+
+def add_column():
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("""
+                ALTER TABLE conversas
+                ADD COLUMN IF NOT EXISTS mensagens_com_tempo INTEGER DEFAULT 0;
+            """))
+            conn.commit()
+            print("✅ Coluna 'mensagens_com_tempo' adicionada com sucesso!")
+
+    except Exception as e:
+        print(f"❌ Erro ao adicionar coluna: {e}")
+        if "already exists" in str(e) or "duplicate column" in str(e).lower():
+            print("ℹ️  A coluna já existe, continuando...")
+
+def populate_metrics():
+    db = SessionLocal()
+    try:
+        total = crud.reconciliar_metricas_conversas(db)
+        print(f"✅ Métricas de {total} conversas recalculadas")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    add_column()
+    populate_metrics()
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+"""
+Job offline que reconstrói os contadores de métricas das conversas
+(total_mensagens, mensagens_bot, mensagens_usuario, tempo_resposta_medio).
+
+As métricas são atualizadas de forma incremental a cada mensagem; este job
+recalcula tudo a partir da tabela mensagens para corrigir divergências.
+
+Uso:
+    python scripts/utils/reconciliar_metricas_conversas.py [pedido_id]
+"""
+import sys
+import time
+from database import SessionLocal
+import crud
+
+
+def main():
+    pedido_id = int(sys.argv[1]) if len(sys.argv) > 1 else None
+
+    db = SessionLocal()
+    try:
+        inicio = time.time()
+        print(f"📊 Reconciliando métricas de conversas{f' do pedido {pedido_id}' if pedido_id else ''}...")
+        total = crud.reconciliar_metricas_conversas(db, pedido_id=pedido_id)
+        print(f"✅ {total} conversas reconciliadas em {time.time() - inicio:.1f}s")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+"""
+Cache de respostas do RAG por instância
+- 1º nível: pergunta normalizada idêntica (sem acentos, pontuação e caixa)
+- 2º nível: pergunta semanticamente próxima (cosseno entre embeddings)
+- Invalidado quando a base de conhecimento da instância muda
+- TTL e limite de entradas por instância (LRU)
+"""
+import os
+import re
+import math
+import time
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+
+# Configurações (via .env)
+TTL_SEGUNDOS = int(os.getenv("ANSWER_CACHE_TTL", "3600"))
+MAX_POR_INSTANCIA = int(os.getenv("ANSWER_CACHE_MAX_POR_INSTANCIA", "200"))
+SIMILARIDADE_MINIMA = float(os.getenv("ANSWER_CACHE_SIMILARIDADE", "0.92"))
+HABILITADO = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+
+
+class _Entrada:
+    def __init__(self, pergunta: str, resposta: str, embedding: Optional[List[float]]):
+        self.pergunta = pergunta
+        self.resposta = resposta
+        self.embedding = embedding
+        self.norma = math.sqrt(sum(v * v for v in embedding)) if embedding else 0.0
+        self.criado_em = time.time()
+
+
+class _Contadores:
+    def __init__(self):
+        self.hits_exatos = 0
+        self.hits_semanticos = 0
+        self.misses = 0
+
+
+_caches: Dict[str, "OrderedDict[str, _Entrada]"] = {}
+_contadores: Dict[str, _Contadores] = {}
+_lock = threading.Lock()
+
+
+def normalizar_pergunta(pergunta: str) -> str:
+    """Minúsculas, sem acentos, sem pontuação e com espaços normalizados"""
+    texto = unicodedata.normalize("NFKD", pergunta.lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    texto = re.sub(r"[^\w\s]", " ", texto)
+    return re.sub(r"\s+", " ", texto).strip()
+
+
+def _cosseno(a: List[float], b: List[float], norma_b: float) -> float:
+    norma_a = math.sqrt(sum(v * v for v in a))
+    if not norma_a or not norma_b:
+        return 0.0
+    return sum(x * y for x, y in zip(a, b)) / (norma_a * norma_b)
+
+
+def _cache_da_instancia(instance_name: str) -> "OrderedDict[str, _Entrada]":
+    if instance_name not in _caches:
+        _caches[instance_name] = OrderedDict()
+        _contadores[instance_name] = _Contadores()
+    return _caches[instance_name]
+
+
+def _remover_expirados(cache: "OrderedDict[str, _Entrada]"):
+    limite = time.time() - TTL_SEGUNDOS
+    for chave in [c for c, e in cache.items() if e.criado_em < limite]:
+        del cache[chave]
+
+
+def buscar_exato(instance_name: str, pergunta: str) -> Optional[str]:
+    """1º nível: pergunta normalizada idêntica (não conta miss)"""
+    if not HABILITADO:
+        return None
+
+    chave = normalizar_pergunta(pergunta)
+
+    with _lock:
+        cache = _cache_da_instancia(instance_name)
+        _remover_expirados(cache)
+
+        entrada = cache.get(chave)
+        if entrada:
+            cache.move_to_end(chave)
+            _contadores[instance_name].hits_exatos += 1
+            print(f"♻️  Resposta cacheada (pergunta idêntica) para {instance_name}")
+            return entrada.resposta
+
+    return None
+
+
+def tem_candidatos_semanticos(instance_name: str) -> bool:
+    """Indica se vale gerar o embedding da pergunta para o 2º nível"""
+    if not HABILITADO:
+        return False
+    with _lock:
+        cache = _caches.get(instance_name)
+        return bool(cache) and any(e.embedding for e in cache.values())
+
+
+def buscar_similar(instance_name: str, embedding: Optional[List[float]]) -> Optional[str]:
+    """
+    2º nível: pergunta com embedding mais próximo acima do limiar
+
+    Args:
+        instance_name: Instância Evolution
+        embedding: Embedding da pergunta (None registra apenas o miss)
+    """
+    if not HABILITADO:
+        return None
+
+    with _lock:
+        cache = _cache_da_instancia(instance_name)
+        candidatos = [(c, e) for c, e in cache.items() if e.embedding] if embedding else []
+
+    melhor_chave, melhor_score = None, 0.0
+    for chave_candidato, candidato in candidatos:
+        score = _cosseno(embedding, candidato.embedding, candidato.norma)
+        if score > melhor_score:
+            melhor_chave, melhor_score = chave_candidato, score
+
+    with _lock:
+        cache = _cache_da_instancia(instance_name)
+        contadores = _contadores[instance_name]
+        if melhor_score >= SIMILARIDADE_MINIMA and melhor_chave in cache:
+            cache.move_to_end(melhor_chave)
+            contadores.hits_semanticos += 1
+            print(f"♻️  Resposta cacheada (similaridade {melhor_score:.3f}) para {instance_name}")
+            return cache[melhor_chave].resposta
+
+        contadores.misses += 1
+        return None
+
+
+def buscar(
+    instance_name: str,
+    pergunta: str,
+    embedding_fn: Optional[Callable[[str], List[float]]] = None
+) -> Optional[str]:
+    """
+    Busca resposta cacheada para a pergunta (1º e 2º níveis)
+
+    Args:
+        instance_name: Instância Evolution (base de conhecimento)
+        pergunta: Pergunta do usuário
+        embedding_fn: Gera o embedding da pergunta (habilita o 2º nível)
+
+    Returns:
+        Resposta cacheada ou None
+    """
+    if not HABILITADO:
+        return None
+
+    resposta = buscar_exato(instance_name, pergunta)
+    if resposta:
+        return resposta
+
+    embedding = None
+    if embedding_fn is not None and tem_candidatos_semanticos(instance_name):
+        embedding = embedding_fn(pergunta)
+
+    return buscar_similar(instance_name, embedding)
+
+
+def gravar(
+    instance_name: str,
+    pergunta: str,
+    resposta: str,
+    embedding: Optional[List[float]] = None
+):
+    """
+    Grava resposta gerada pelo LLM
+
+    Args:
+        instance_name: Instância Evolution
+        pergunta: Pergunta do usuário
+        resposta: Resposta enviada
+        embedding: Embedding da pergunta (para o 2º nível)
+    """
+    if not HABILITADO:
+        return
+
+    chave = normalizar_pergunta(pergunta)
+    if not chave:
+        return
+
+    with _lock:
+        cache = _cache_da_instancia(instance_name)
+        cache[chave] = _Entrada(pergunta, resposta, embedding)
+        cache.move_to_end(chave)
+
+        while len(cache) > MAX_POR_INSTANCIA:
+            cache.popitem(last=False)
+
+
+def invalidar_instancia(instance_name: str):
+    """Descarta respostas da instância (base de conhecimento alterada)"""
+    with _lock:
+        cache = _caches.get(instance_name)
+        if cache:
+            cache.clear()
+            print(f"🗑️  Cache de respostas invalidado: {instance_name}")
+
+
+def limpar() -> int:
+    """Descarta todas as respostas cacheadas e zera os contadores"""
+    with _lock:
+        total = sum(len(c) for c in _caches.values())
+        _caches.clear()
+        _contadores.clear()
+        return total
+
+
+def estatisticas() -> Dict:
+    """Entradas e taxa de acerto, geral e por instância"""
+    with _lock:
+        instancias = {}
+        for instance_name, cache in _caches.items():
+            c = _contadores[instance_name]
+            consultas = c.hits_exatos + c.hits_semanticos + c.misses
+            instancias[instance_name] = {
+                "entradas": len(cache),
+                "hits_exatos": c.hits_exatos,
+                "hits_semanticos": c.hits_semanticos,
+                "misses": c.misses,
+                "taxa_acerto": round((c.hits_exatos + c.hits_semanticos) / consultas * 100, 1) if consultas else 0.0
+            }
+
+        hits = sum(i["hits_exatos"] + i["hits_semanticos"] for i in instancias.values())
+        consultas = hits + sum(i["misses"] for i in instancias.values())
+
+        return {
+            "habilitado": HABILITADO,
+            "ttl_segundos": TTL_SEGUNDOS,
+            "similaridade_minima": SIMILARIDADE_MINIMA,
+            "entradas": sum(i["entradas"] for i in instancias.values()),
+            "taxa_acerto": round(hits / consultas * 100, 1) if consultas else 0.0,
+            "instancias": instancias
+        }
@@ -0,0 +1,347 @@
+"""
+Variante assíncrona do RAG para o caminho de mensagens do WhatsApp
+- Embeddings e geração via httpx.AsyncClient compartilhado (Ollama)
+- Busca e gravação no Qdrant via AsyncQdrantClient
+- Mesmos prompts, caches e índice textual do RAGService síncrono
+- Perguntas em andamento custam corrotinas, não threads
+"""
+import os
+import json
+import time
+import asyncio
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+import httpx
+from qdrant_client import AsyncQdrantClient
+from qdrant_client.models import PointStruct
+
+from config_helper import get_rag_search_limit
+from services import embedding_cache, answer_cache, ollama_scheduler
+from services.ollama_scheduler import PRIORIDADE_GERACAO, PRIORIDADE_CONSULTA
+from services.rag_service import (
+    RAGService,
+    SegmentadorResposta,
+    RODAPE_ATENDENTE,
+    MSG_ERRO_RESPOSTA,
+    MSG_SEM_CONTEXTO,
+    _embedding_dimensions,
+    _colecoes,
+    _colecoes_lock
+)
+
+
+# Configurações (via .env)
+OLLAMA_MAX_CONNECTIONS = int(os.getenv("OLLAMA_MAX_CONNECTIONS", "50"))
+
+_http: Optional[httpx.AsyncClient] = None
+
+# Clientes Qdrant compartilhados por URL (trocar a configuração não abre novas conexões)
+_qdrant_clients: Dict[str, AsyncQdrantClient] = {}
+
+
+def _get_http() -> httpx.AsyncClient:
+    """Cliente HTTP compartilhado para o Ollama (criado na primeira chamada)"""
+    global _http
+
+    if _http is None or _http.is_closed:
+        _http = httpx.AsyncClient(
+            timeout=httpx.Timeout(120.0, connect=10.0),
+            limits=httpx.Limits(max_connections=OLLAMA_MAX_CONNECTIONS)
+        )
+    return _http
+
+
+def _get_qdrant_client(qdrant_url: str) -> AsyncQdrantClient:
+    """Cliente Qdrant assíncrono da URL (criado na primeira chamada)"""
+    client = _qdrant_clients.get(qdrant_url)
+    if client is None:
+        client = _qdrant_clients[qdrant_url] = AsyncQdrantClient(url=qdrant_url)
+    return client
+
+
+async def fechar():
+    """Fecha os clientes HTTP do Ollama e do Qdrant (chamar no shutdown da aplicação)"""
+    global _http
+
+    if _http is not None:
+        await _http.aclose()
+        _http = None
+
+    while _qdrant_clients:
+        _, client = _qdrant_clients.popitem()
+        try:
+            await client.close()
+        except Exception as e:
+            print(f"⚠️  Erro ao fechar cliente Qdrant: {e}")
+
+
+class AsyncRAGService:
+    def __init__(self, rag_service: RAGService):
+        """
+        Inicializa serviço assíncrono
+
+        Args:
+            rag_service: RAGService síncrono da mesma configuração (prompts,
+                splitter, cache de coleções e índice textual)
+        """
+        self.rag = rag_service
+        self.ollama_url = rag_service.ollama_url
+        self.embeddings_model = rag_service.embeddings_model
+        self.llm_model = rag_service.llm_model
+        self.qdrant_client = _get_qdrant_client(rag_service.qdrant_url)
+
+    async def generate_embedding(self, text: str, tenant: str = "") -> List[float]:
+        """Gera embedding de consulta usando Ollama (consulta o cache de embeddings antes)"""
+        # Caches em SQLite (com lock) rodam fora do event loop
+        embedding = await asyncio.to_thread(embedding_cache.buscar, self.embeddings_model, text)
+        if embedding is not None:
+            return embedding
+
+        try:
+            async with ollama_scheduler.slot_async(self.embeddings_model, PRIORIDADE_CONSULTA, tenant):
+                response = await _get_http().post(
+                    f"{self.ollama_url}/api/embeddings",
+                    json={
+                        "model": self.embeddings_model,
+                        "prompt": text
+                    },
+                    timeout=30
+                )
+            response.raise_for_status()
+            embedding = response.json()["embedding"]
+        except Exception as e:
+            print(f"❌ Erro ao gerar embedding: {e}")
+            raise
+
+        _embedding_dimensions.setdefault(self.embeddings_model, len(embedding))
+        await asyncio.to_thread(embedding_cache.gravar, self.embeddings_model, text, embedding)
+        return embedding
+
+    async def collection_exists(self, phone_number: str) -> bool:
+        """Verifica se a coleção existe (mesmo cache por TTL do RAGService)"""
+        collection_name = self.rag.get_collection_name(phone_number)
+
+        with _colecoes_lock:
+            cacheado = _colecoes.get((self.rag.qdrant_url, collection_name))
+        if cacheado and cacheado[1] > time.time():
+            return cacheado[0]
+
+        try:
+            await self.qdrant_client.get_collection(collection_name)
+            existe = True
+        except Exception as e:
+            if "not found" not in str(e).lower() and "404" not in str(e):
+                raise
+            existe = False
+
+        self.rag._marcar_colecao(collection_name, existe)
+        return existe
+
+    async def upsert(self, phone_number: str, points: List[PointStruct]):
+        """Grava pontos na coleção da instância"""
+        await self.qdrant_client.upsert(
+            collection_name=self.rag.get_collection_name(phone_number),
+            points=points
+        )
+
+    async def _search_by_text(self, phone_number: str, query: str) -> List[Dict]:
+        """Busca textual no índice (preenchido na ingestão; SQLite fora do event loop)"""
+        return await asyncio.to_thread(self.rag._search_by_text, phone_number, query)
+
+    async def search(self, phone_number: str, query: str, limit: int = 50) -> List[Dict]:
+        """Busca híbrida: textual (rápida) + semântica (precisa)"""
+        collection_name = self.rag.get_collection_name(phone_number)
+
+        text_results = []
+        if self.rag._is_specific_query(query):
+            print("🔍 Tentando busca textual rápida primeiro...")
+            text_results = await self._search_by_text(phone_number, query)
+
+            if len(text_results) >= 3:
+                print(f"✅ Busca textual retornou {len(text_results)} resultados")
+                return text_results
+
+        try:
+            if not await self.collection_exists(phone_number):
+                print(f"⚠️  Coleção não encontrada: {collection_name}")
+                return text_results
+
+            query_embedding = await self.generate_embedding(query, tenant=phone_number)
+
+            print(f"🔍 Buscando {limit} chunks no Qdrant...")
+            results = await self.qdrant_client.search(
+                collection_name=collection_name,
+                query_vector=query_embedding,
+                limit=limit
+            )
+
+            return self.rag._combine_results(text_results, self.rag._format_points(results), limit)
+
+        except Exception as e:
+            print(f"❌ Erro na busca vetorial: {e}")
+            return text_results
+
+    async def generate_response(self, question: str, context_results: List[Dict], tenant: str = "") -> str:
+        """Gera resposta usando LLM com contexto RAG"""
+        prompt = self.rag._build_prompt(question, context_results)
+
+        try:
+            async with ollama_scheduler.slot_async(self.llm_model, PRIORIDADE_GERACAO, tenant):
+                response = await _get_http().post(
+                    f"{self.ollama_url}/api/generate",
+                    json=self.rag._generation_payload(prompt, stream=False),
+                    timeout=120
+                )
+            response.raise_for_status()
+            return response.json().get("response", "").strip() + RODAPE_ATENDENTE
+
+        except Exception as e:
+            print(f"❌ Erro ao gerar resposta: {e}")
+            return MSG_ERRO_RESPOSTA
+
+    async def generate_response_stream(
+        self,
+        question: str,
+        context_results: List[Dict],
+        tenant: str = ""
+    ) -> AsyncIterator[str]:
+        """
+        Gera resposta em streaming (NDJSON do Ollama)
+
+        Cancelar a corrotina que consome o iterador fecha a conexão,
+        interrompe a geração e devolve o slot do escalonador.
+        """
+        prompt = self.rag._build_prompt(question, context_results)
+
+        async with ollama_scheduler.slot_async(self.llm_model, PRIORIDADE_GERACAO, tenant), _get_http().stream(
+            "POST",
+            f"{self.ollama_url}/api/generate",
+            json=self.rag._generation_payload(prompt, stream=True)
+        ) as response:
+            response.raise_for_status()
+
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+
+                parte = json.loads(line)
+                if parte.get("error"):
+                    raise RuntimeError(parte["error"])
+                if parte.get("response"):
+                    yield parte["response"]
+                if parte.get("done"):
+                    return
+
+    async def _cached_answer(self, phone_number: str, question: str) -> Optional[str]:
+        """Consulta o cache de respostas (1º e 2º níveis)"""
+        cached = answer_cache.buscar_exato(phone_number, question)
+        if cached:
+            return cached
+
+        embedding = None
+        if answer_cache.tem_candidatos_semanticos(phone_number):
+            embedding = await self.generate_embedding(question, phone_number)
+        return answer_cache.buscar_similar(phone_number, embedding)
+
+    async def _cache_answer(self, phone_number: str, question: str, answer: str):
+        """Grava a resposta no cache de respostas (com o embedding da pergunta)"""
+        try:
+            answer_cache.gravar(phone_number, question, answer, await self.generate_embedding(question, phone_number))
+        except Exception as e:
+            print(f"⚠️ Erro ao gravar resposta no cache: {e}")
+
+    async def process_question(self, phone_number: str, question: str) -> str:
+        """Pipeline completo: busca + geração de resposta"""
+        print(f"🤔 Processando pergunta: {question}")
+
+        cached = await self._cached_answer(phone_number, question)
+        if cached:
+            return cached
+
+        results = await self.search(phone_number, question, limit=get_rag_search_limit())
+        if not results:
+            return MSG_SEM_CONTEXTO
+
+        print(f"📚 Encontrados {len(results)} documentos relevantes")
+
+        answer = await self.generate_response(question, results, tenant=phone_number)
+        if answer != MSG_ERRO_RESPOSTA:
+            await self._cache_answer(phone_number, question, answer)
+
+        return answer
+
+    async def process_question_stream(
+        self,
+        phone_number: str,
+        question: str,
+        on_segment: Callable[[str], Awaitable[None]]
+    ) -> str:
+        """
+        Pipeline completo com streaming: cada trecho pronto (frase/parágrafo)
+        é entregue a on_segment enquanto o LLM continua gerando
+
+        Args:
+            phone_number: Identificador da base (nome da instância)
+            question: Pergunta do usuário
+            on_segment: Corrotina chamada com cada trecho
+
+        Returns:
+            Resposta completa
+        """
+        print(f"🤔 Processando pergunta (streaming): {question}")
+
+        cached = await self._cached_answer(phone_number, question)
+        if cached:
+            await on_segment(cached)
+            return cached
+
+        results = await self.search(phone_number, question, limit=get_rag_search_limit())
+        if not results:
+            await on_segment(MSG_SEM_CONTEXTO)
+            return MSG_SEM_CONTEXTO
+
+        print(f"📚 Encontrados {len(results)} documentos relevantes")
+
+        segmentador = SegmentadorResposta()
+        enviados = []
+        pendente = None  # segura um trecho para o rodapé ir junto com o último
+
+        async def enviar(trecho: str):
+            enviados.append(trecho)
+            await on_segment(trecho)
+
+        try:
+            async for texto in self.generate_response_stream(question, results, tenant=phone_number):
+                for trecho in segmentador.adicionar(texto):
+                    if pendente:
+                        await enviar(pendente)
+                    pendente = trecho
+        except Exception as e:
+            print(f"❌ Erro ao gerar resposta em streaming: {e}")
+            if not enviados and not pendente:
+                await on_segment(MSG_ERRO_RESPOSTA)
+                return MSG_ERRO_RESPOSTA
+
+            # Resposta parcial: entrega o que foi gerado e não grava no cache;
+            # quem chamou avisa o usuário que a resposta ficou incompleta
+            for trecho in (pendente, segmentador.finalizar()):
+                if trecho:
+                    await enviar(trecho)
+            raise
+
+        restante = segmentador.finalizar()
+        if not enviados and not pendente and not restante:
+            # Modelo não gerou texto: erro, e nada vai para o cache
+            print("❌ Resposta vazia do modelo")
+            await on_segment(MSG_ERRO_RESPOSTA)
+            return MSG_ERRO_RESPOSTA
+
+        if pendente and restante:
+            await enviar(pendente)
+            pendente = None
+
+        # Último trecho leva o rodapé de atendimento
+        await enviar(((restante or pendente or "") + RODAPE_ATENDENTE).strip())
+
+        answer = "\n\n".join(enviados)
+        await self._cache_answer(phone_number, question, answer)
+        return answer
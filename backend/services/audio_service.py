@@ -1,39 +1,33 @@
 """
 Serviço de Áudio
-- Transcrição de áudio usando Whisper
+- Transcrição de áudio usando Whisper (pool de processos do transcription_service)
 - Geração de áudio (TTS) usando gTTS
 """
-import os
+import asyncio
 import tempfile
 from pathlib import Path
 from typing import Optional
-import whisper
 from gtts import gTTS
 from pydub import AudioSegment
 import requests
 
+from services import transcription_service, transcription_cache, tts_cache, evolution_client
+
 
 class AudioService:
-    def __init__(self, whisper_model: str = "base", audio_cache_dir: str = "storage/audio_cache"):
+    def __init__(self, whisper_model: str = transcription_service.MODELO_WHISPER, audio_cache_dir: str = "storage/audio_cache"):
         """
         Inicializa serviço de áudio
 
         Args:
-            whisper_model: Modelo do Whisper (tiny, base, small, medium, large)
+            whisper_model: Modelo do Whisper (tiny, base, small, medium, large);
+                carregado no pool de transcrição (WHISPER_MODEL)
             audio_cache_dir: Diretório para cache de áudios
         """
         self.whisper_model_name = whisper_model
-        self.whisper_model = None  # Lazy loading
         self.audio_cache_dir = Path(audio_cache_dir)
         self.audio_cache_dir.mkdir(parents=True, exist_ok=True)
 
-    def _load_whisper_model(self):
-        """Carrega modelo Whisper (lazy loading)"""
-        if self.whisper_model is None:
-            print(f"🎙️  Carregando modelo Whisper: {self.whisper_model_name}")
-            self.whisper_model = whisper.load_model(self.whisper_model_name)
-            print("✅ Modelo Whisper carregado")
-
     def transcribe_audio(self, audio_path: str, language: str = "pt") -> str:
         """
         Transcreve áudio para texto usando Whisper
@@ -44,20 +38,13 @@ class AudioService:
 
         Returns:
             Texto transcrito
+
+        Raises:
+            TranscricaoSaturada: Muitos áudios aguardando transcrição
         """
         try:
-            self._load_whisper_model()
-
-            print(f"🎙️  Transcrevendo áudio: {audio_path}")
-
-            # Transcrever
-            result = self.whisper_model.transcribe(
-                audio_path,
-                language=language,
-                fp16=False  # Compatibilidade com CPU
-            )
-
-            transcription = result["text"].strip()
+            # Modelo já carregado nos processos do pool (uma vez por processo)
+            transcription = transcription_service.transcrever(audio_path, language)
             print(f"✅ Transcrição: {transcription}")
 
             return transcription
@@ -167,72 +154,87 @@ class AudioService:
             print(f"❌ Erro ao gerar áudio: {e}")
             raise
 
-    def process_whatsapp_audio(self, audio_url: str) -> str:
+    async def download_audio_bytes(self, url: str) -> bytes:
+        """
+        Baixa áudio para a memória (cliente HTTP assíncrono compartilhado)
+
+        Args:
+            url: URL do áudio
+
+        Returns:
+            Conteúdo do áudio
+        """
+        try:
+            print(f"⬇️  Baixando áudio: {url}")
+
+            response = await evolution_client.get_client().get(url, timeout=30, follow_redirects=True)
+            response.raise_for_status()
+
+            print(f"✅ Áudio baixado: {len(response.content) / 1024:.0f} KB")
+            return response.content
+
+        except Exception as e:
+            print(f"❌ Erro ao baixar áudio: {e}")
+            raise
+
+    def _modelo_cache(self, language: str) -> str:
+        """Modelo do Whisper + idioma (parte da chave do cache de transcrições)"""
+        return f"{transcription_service.MODELO_WHISPER}:{language}"
+
+    async def process_whatsapp_audio_async(self, audio_url: str, media_key: Optional[str] = None) -> str:
         """
-        Pipeline completo para processar áudio do WhatsApp
-        1. Baixa o áudio
-        2. Converte para WAV
-        3. Transcreve
+        Pipeline completo para processar áudio do WhatsApp sem bloquear o event loop
+        1. Consulta o cache de transcrições pela mídia (sem baixar)
+        2. Baixa o áudio para a memória (httpx) e consulta o cache pelo conteúdo
+        3. Decodifica OGG/Opus uma única vez direto para float32 16 kHz e
+           transcreve no pool (sem arquivos temporários)
 
         Args:
             audio_url: URL do áudio do WhatsApp
+            media_key: Chave da mídia no webhook (transcription_cache.chave_midia)
 
         Returns:
             Texto transcrito
-        """
-        temp_files = []
 
-        try:
-            # Baixar áudio
-            audio_path = self.download_audio_from_url(audio_url)
-            temp_files.append(audio_path)
+        Raises:
+            TranscricaoSaturada: Muitos áudios aguardando transcrição
+        """
+        modelo = self._modelo_cache("pt")
+        # Cache de transcrições (SQLite com lock) fora do event loop
+        cached = await asyncio.to_thread(transcription_cache.buscar, modelo, [media_key])
+        if cached is not None:
+            return cached
 
-            # Converter para WAV (Whisper funciona melhor com WAV)
-            wav_path = self.convert_audio_format(audio_path, "wav")
-            temp_files.append(wav_path)
+        audio_bytes = await self.download_audio_bytes(audio_url)
 
-            # Transcrever
-            transcription = self.transcribe_audio(wav_path, language="pt")
+        chaves = [media_key, transcription_cache.chave_conteudo(audio_bytes)]
+        cached = await asyncio.to_thread(transcription_cache.buscar, modelo, chaves[1:])
+        if cached is not None:
+            # Mesmo áudio com outra mídia (encaminhado): guardar também a chave nova
+            await asyncio.to_thread(transcription_cache.gravar, modelo, chaves, cached)
+            return cached
 
-            return transcription
+        transcription = await transcription_service.transcrever_async(audio_bytes, language="pt")
+        print(f"✅ Transcrição: {transcription}")
 
-        finally:
-            # Limpar arquivos temporários
-            for temp_file in temp_files:
-                try:
-                    if os.path.exists(temp_file):
-                        os.remove(temp_file)
-                except Exception as e:
-                    print(f"⚠️  Erro ao remover arquivo temporário {temp_file}: {e}")
+        await asyncio.to_thread(transcription_cache.gravar, modelo, chaves, transcription)
+        return transcription
 
     def generate_response_audio(self, text: str, phone_number: str) -> str:
         """
         Gera áudio de resposta para o WhatsApp
 
+        O cache é por conteúdo e compartilhado entre contatos: a mesma resposta
+        (boas-vindas, menu, respostas predefinidas) é sintetizada uma única vez.
+
         Args:
             text: Texto da resposta
-            phone_number: Número do telefone (para organizar cache)
+            phone_number: Número do telefone (mantido por compatibilidade)
 
         Returns:
             Caminho do arquivo de áudio
         """
-        # Criar diretório específico do número
-        phone_cache_dir = self.audio_cache_dir / phone_number
-        phone_cache_dir.mkdir(parents=True, exist_ok=True)
-
-        # Gerar nome do arquivo baseado no hash do texto
-        import hashlib
-        text_hash = hashlib.md5(text.encode()).hexdigest()[:10]
-        audio_filename = f"response_{text_hash}.mp3"
-        audio_path = phone_cache_dir / audio_filename
-
-        # Se já existe em cache, retornar
-        if audio_path.exists():
-            print(f"📦 Áudio encontrado em cache: {audio_path}")
-            return str(audio_path)
-
-        # Gerar áudio
-        return self.text_to_speech(text, str(audio_path))
+        return tts_cache.obter(text)
 
     def cleanup_cache(self, phone_number: Optional[str] = None, max_age_days: int = 7):
         """
@@ -0,0 +1,309 @@
+"""
+Estado das conversas (contexto do menu) fora do banco principal
+- Camada local em SQLite (WAL), compartilhada pelos processos do servidor:
+  leitura e gravação por mensagem sem ida ao banco principal
+- Versão por conversa: gravação condicional à versão lida, para escritores
+  concorrentes não sobrescreverem um ao outro
+- Write-behind: alterações gravadas em lote em Conversa.contexto por uma
+  thread em segundo plano
+- Estado expira após o timeout de inatividade da configuração do bot
+- Conversa.contexto só é lido quando a conversa ainda não tem linha local;
+  daí em diante a camada local prevalece (alterações feitas direto no banco
+  principal são ignoradas até o estado expirar e ser removido)
+- Funções *_async rodam o SQLite fora do event loop
+"""
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Optional
+from sqlalchemy import update, bindparam
+
+
+# Configurações (via .env)
+STATE_PATH = os.getenv("CONVERSATION_STATE_PATH", "storage/conversation_state.db")
+INTERVALO_FLUSH = float(os.getenv("CONVERSATION_STATE_FLUSH_INTERVAL", "2"))
+LOTE_FLUSH = int(os.getenv("CONVERSATION_STATE_FLUSH_BATCH", "500"))
+TIMEOUT_PADRAO = 300  # segundos (padrão de ConfiguracaoBot.timeout_inatividade)
+
+_conn: Optional[sqlite3.Connection] = None
+_lock = threading.Lock()
+_flusher: Optional[threading.Thread] = None
+_parar = threading.Event()
+_conflitos = 0
+_gravados_no_banco = 0
+
+
+class EstadoConversa:
+    """Contexto lido de uma conversa e a versão usada na gravação condicional"""
+
+    def __init__(self, conversa_id: int, contexto: Dict, versao: int):
+        self.conversa_id = conversa_id
+        self.contexto = contexto
+        self.versao = versao
+        self._gravado = json.loads(json.dumps(contexto))
+
+    def alterado(self, contexto: Dict) -> bool:
+        return contexto != self._gravado
+
+
+def _get_conn() -> sqlite3.Connection:
+    """Abre o banco de estados (criado na primeira chamada)"""
+    global _conn
+
+    if _conn is None:
+        Path(STATE_PATH).parent.mkdir(parents=True, exist_ok=True)
+        _conn = sqlite3.connect(STATE_PATH, check_same_thread=False, timeout=10)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute("PRAGMA synchronous=NORMAL")
+        _conn.execute("""
+            CREATE TABLE IF NOT EXISTS estados (
+                conversa_id INTEGER PRIMARY KEY,
+                contexto TEXT NOT NULL,
+                versao INTEGER NOT NULL,
+                versao_persistida INTEGER NOT NULL,
+                expira_em REAL NOT NULL
+            )
+        """)
+        _conn.execute("CREATE INDEX IF NOT EXISTS idx_estados_pendentes ON estados (versao_persistida, versao)")
+        _conn.execute("CREATE INDEX IF NOT EXISTS idx_estados_expira_em ON estados (expira_em)")
+        _conn.commit()
+    return _conn
+
+
+def _decodificar(contexto: Optional[str]) -> Dict:
+    if not contexto:
+        return {}
+    try:
+        return json.loads(contexto)
+    except (json.JSONDecodeError, TypeError):
+        return {}
+
+
+def carregar(conversa, timeout_inatividade: Optional[int] = None) -> EstadoConversa:
+    """
+    Lê o contexto da conversa
+
+    Args:
+        conversa: models.Conversa (Conversa.contexto é usado só se a conversa
+            ainda não tem estado local; se tem, o estado local prevalece)
+        timeout_inatividade: Segundos sem mensagens até o estado expirar
+
+    Returns:
+        EstadoConversa (contexto vazio se expirou; a expiração é renovada)
+    """
+    return _carregar(conversa.id, conversa.contexto, timeout_inatividade)
+
+
+async def carregar_async(conversa, timeout_inatividade: Optional[int] = None) -> EstadoConversa:
+    """carregar() fora do event loop (os atributos do ORM são lidos antes, no loop)"""
+    return await asyncio.to_thread(_carregar, conversa.id, conversa.contexto, timeout_inatividade)
+
+
+def _carregar(conversa_id: int, contexto_banco: Optional[str], timeout_inatividade: Optional[int]) -> EstadoConversa:
+    timeout = timeout_inatividade or TIMEOUT_PADRAO
+    agora = time.time()
+
+    with _lock:
+        conn = _get_conn()
+        row = conn.execute(
+            "SELECT contexto, versao, expira_em FROM estados WHERE conversa_id = ?",
+            (conversa_id,)
+        ).fetchone()
+
+        if row is None:
+            # Primeira leitura neste servidor: parte do que está no banco principal
+            contexto_json = contexto_banco or "{}"
+            conn.execute(
+                "INSERT OR IGNORE INTO estados (conversa_id, contexto, versao, versao_persistida, expira_em) "
+                "VALUES (?, ?, 0, 0, ?)",
+                (conversa_id, contexto_json, agora + timeout)
+            )
+            conn.commit()
+            return EstadoConversa(conversa_id, _decodificar(contexto_json), 0)
+
+        contexto_json, versao, expira_em = row
+
+        if expira_em < agora and contexto_json != "{}":
+            # Conversa ficou inativa: menu volta ao início
+            conn.execute(
+                "UPDATE estados SET contexto = '{}', versao = versao + 1, expira_em = ? WHERE conversa_id = ?",
+                (agora + timeout, conversa_id)
+            )
+            contexto_json, versao = "{}", versao + 1
+        else:
+            # Mensagem recebida: renova a expiração
+            conn.execute(
+                "UPDATE estados SET expira_em = ? WHERE conversa_id = ?",
+                (agora + timeout, conversa_id)
+            )
+        conn.commit()
+
+    return EstadoConversa(conversa_id, _decodificar(contexto_json), versao)
+
+
+def salvar(estado: EstadoConversa, contexto: Dict, timeout_inatividade: Optional[int] = None) -> bool:
+    """
+    Grava o contexto se ninguém gravou depois da leitura (versão igual)
+
+    Args:
+        estado: Estado retornado por carregar()
+        contexto: Novo contexto da conversa
+        timeout_inatividade: Segundos sem mensagens até o estado expirar
+
+    Returns:
+        True se gravou; False se outro escritor gravou antes (conflito)
+    """
+    global _conflitos
+
+    timeout = timeout_inatividade or TIMEOUT_PADRAO
+    agora = time.time()
+
+    with _lock:
+        conn = _get_conn()
+        if not estado.alterado(contexto):
+            return True
+
+        cursor = conn.execute(
+            "UPDATE estados SET contexto = ?, versao = versao + 1, expira_em = ? "
+            "WHERE conversa_id = ? AND versao = ?",
+            (json.dumps(contexto), agora + timeout, estado.conversa_id, estado.versao)
+        )
+        conn.commit()
+
+        if cursor.rowcount == 0:
+            _conflitos += 1
+            print(f"⚠️  Contexto da conversa {estado.conversa_id} alterado por outro processamento; gravação descartada")
+            return False
+
+    estado.versao += 1
+    estado.contexto = contexto
+    estado._gravado = json.loads(json.dumps(contexto))
+    return True
+
+
+async def salvar_async(estado: EstadoConversa, contexto: Dict, timeout_inatividade: Optional[int] = None) -> bool:
+    """salvar() fora do event loop"""
+    return await asyncio.to_thread(salvar, estado, contexto, timeout_inatividade)
+
+
+# ============ WRITE-BEHIND ============
+
+def _expirar_inativos(conn: sqlite3.Connection):
+    """Estados expirados voltam a {} (e vão para o banco); os já gravados vazios são removidos"""
+    agora = time.time()
+    conn.execute(
+        "UPDATE estados SET contexto = '{}', versao = versao + 1 "
+        "WHERE expira_em < ? AND contexto != '{}'",
+        (agora,)
+    )
+    conn.execute(
+        "DELETE FROM estados WHERE expira_em < ? AND contexto = '{}' AND versao = versao_persistida",
+        (agora,)
+    )
+    conn.commit()
+
+
+def flush() -> int:
+    """
+    Grava em Conversa.contexto, em uma única transação, os estados alterados
+
+    Returns:
+        Número de conversas gravadas
+    """
+    global _gravados_no_banco
+
+    from database import SessionLocal
+    import models
+
+    with _lock:
+        conn = _get_conn()
+        _expirar_inativos(conn)
+        pendentes = conn.execute(
+            "SELECT conversa_id, contexto, versao FROM estados WHERE versao != versao_persistida LIMIT ?",
+            (LOTE_FLUSH,)
+        ).fetchall()
+
+    if not pendentes:
+        return 0
+
+    db = SessionLocal()
+    try:
+        # UPDATE em lote (executemany); conversas já removidas são ignoradas
+        tabela = models.Conversa.__table__
+        db.execute(
+            update(tabela).where(tabela.c.id == bindparam("b_id")).values(contexto=bindparam("b_contexto")),
+            [{"b_id": conversa_id, "b_contexto": contexto} for conversa_id, contexto, _ in pendentes]
+        )
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"❌ Erro ao gravar contexto das conversas: {e}")
+        return 0
+    finally:
+        db.close()
+
+    with _lock:
+        conn = _get_conn()
+        # Só marca como persistido se não mudou enquanto gravava no banco
+        conn.executemany(
+            "UPDATE estados SET versao_persistida = ? WHERE conversa_id = ? AND versao = ?",
+            [(versao, conversa_id, versao) for conversa_id, _, versao in pendentes]
+        )
+        conn.commit()
+
+    _gravados_no_banco += len(pendentes)
+    return len(pendentes)
+
+
+def _loop_flush():
+    while not _parar.wait(INTERVALO_FLUSH):
+        try:
+            while flush() >= LOTE_FLUSH:
+                pass
+        except Exception as e:
+            print(f"⚠️  Erro no write-behind do contexto das conversas: {e}")
+
+
+def iniciar():
+    """Inicia a thread de write-behind (chamar no startup)"""
+    global _flusher
+
+    if _flusher is not None and _flusher.is_alive():
+        return
+
+    _parar.clear()
+    _flusher = threading.Thread(target=_loop_flush, name="estado-conversas", daemon=True)
+    _flusher.start()
+
+
+def encerrar():
+    """Para a thread e grava o que estiver pendente (chamar no shutdown)"""
+    _parar.set()
+    if _flusher is not None:
+        _flusher.join(timeout=INTERVALO_FLUSH + 5)
+    try:
+        while flush() >= LOTE_FLUSH:
+            pass
+    except Exception as e:
+        print(f"⚠️  Erro ao gravar contexto das conversas no shutdown: {e}")
+
+
+def estatisticas() -> Dict:
+    """Estados em memória local, pendentes de gravação e conflitos"""
+    with _lock:
+        conn = _get_conn()
+        total, pendentes = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(versao != versao_persistida), 0) FROM estados"
+        ).fetchone()
+
+    return {
+        "conversas": total,
+        "pendentes_banco": pendentes,
+        "gravadas_banco": _gravados_no_banco,
+        "conflitos": _conflitos,
+        "intervalo_flush_s": INTERVALO_FLUSH
+    }
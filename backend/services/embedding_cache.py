@@ -0,0 +1,98 @@
+"""
+Cache persistente de embeddings (endereçado por conteúdo)
+- Chave: modelo de embeddings + SHA-256 do texto do chunk
+- Vetores gravados em SQLite como float32
+- Limite de entradas com descarte LRU (por último uso)
+- Contadores de hit/miss para o painel admin
+"""
+import os
+import hashlib
+from array import array
+from typing import Dict, List, Optional
+
+from services.sqlite_lru import CacheSQLiteLRU
+
+
+# Configurações (via .env)
+CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "storage/embedding_cache.db")
+MAX_ENTRADAS = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+
+_store = CacheSQLiteLRU(
+    CACHE_PATH,
+    tabela="embeddings",
+    coluna_chave="hash",
+    coluna_valor="vetor",
+    tipo_valor="BLOB",
+    max_entradas=MAX_ENTRADAS,
+    descricao="embeddings"
+)
+
+
+def hash_texto(texto: str) -> str:
+    """SHA-256 do texto (chave do cache)"""
+    return hashlib.sha256(texto.encode("utf-8")).hexdigest()
+
+
+def _para_blob(vetor: List[float]) -> bytes:
+    return array("f", vetor).tobytes()
+
+
+def _de_blob(blob: bytes) -> List[float]:
+    vetor = array("f")
+    vetor.frombytes(blob)
+    return vetor.tolist()
+
+
+def buscar_varios(modelo: str, textos: List[str]) -> Dict[int, List[float]]:
+    """
+    Busca embeddings já calculados
+
+    Args:
+        modelo: Modelo de embeddings
+        textos: Textos
+
+    Returns:
+        Dict {índice do texto: embedding} apenas para os encontrados
+    """
+    if not textos:
+        return {}
+
+    hashes = [hash_texto(t) for t in textos]
+    encontrados = {h: _de_blob(blob) for h, blob in _store.buscar(modelo, hashes).items()}
+
+    resultado = {i: encontrados[h] for i, h in enumerate(hashes) if h in encontrados}
+    _store.registrar_consulta(len(resultado), len(textos) - len(resultado))
+    return resultado
+
+
+def buscar(modelo: str, texto: str) -> Optional[List[float]]:
+    """Busca o embedding de um único texto"""
+    return buscar_varios(modelo, [texto]).get(0)
+
+
+def gravar_varios(modelo: str, textos: List[str], embeddings: List[List[float]]):
+    """Grava embeddings calculados e aplica o limite de entradas"""
+    _store.gravar(modelo, [(hash_texto(t), _para_blob(e)) for t, e in zip(textos, embeddings)])
+
+
+def gravar(modelo: str, texto: str, embedding: List[float]):
+    """Grava o embedding de um único texto"""
+    gravar_varios(modelo, [texto], [embedding])
+
+
+def estatisticas() -> Dict:
+    """Tamanho do cache e contadores de hit/miss"""
+    return _store.estatisticas()
+
+
+def limpar(modelo: Optional[str] = None) -> int:
+    """
+    Remove entradas do cache
+
+    Args:
+        modelo: Remove apenas deste modelo (None = todos)
+
+    Returns:
+        Número de entradas removidas
+    """
+    return _store.limpar(modelo)
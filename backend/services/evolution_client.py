@@ -0,0 +1,147 @@
+"""
+Cliente HTTP compartilhado para a Evolution API
+- Um único httpx.AsyncClient por processo (keep-alive, HTTP/2 quando disponível)
+- Limite de conexões simultâneas por instância
+- Timeouts configuráveis e retry com backoff exponencial
+"""
+import os
+import random
+import asyncio
+from typing import Any, Dict, Optional
+import httpx
+
+
+# Configurações (via .env)
+TIMEOUT = float(os.getenv("EVOLUTION_TIMEOUT", "30"))
+CONNECT_TIMEOUT = float(os.getenv("EVOLUTION_CONNECT_TIMEOUT", "5"))
+MAX_CONEXOES = int(os.getenv("EVOLUTION_MAX_CONNECTIONS", "100"))
+MAX_KEEPALIVE = int(os.getenv("EVOLUTION_MAX_KEEPALIVE", "20"))
+MAX_POR_INSTANCIA = int(os.getenv("EVOLUTION_MAX_POR_INSTANCIA", "4"))
+MAX_RETRIES = int(os.getenv("EVOLUTION_RETRIES", "2"))
+BACKOFF_BASE = float(os.getenv("EVOLUTION_BACKOFF", "0.5"))
+
+# Status que indicam que a requisição não foi processada e pode ser repetida
+STATUS_RETRY = {429, 502, 503, 504}
+
+_client: Optional[httpx.AsyncClient] = None
+_semaforos: Dict[str, asyncio.Semaphore] = {}
+
+
+def _http2_disponivel() -> bool:
+    """HTTP/2 requer o pacote h2 (httpx[http2])"""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def get_client() -> httpx.AsyncClient:
+    """Retorna o cliente compartilhado (criado na primeira chamada)"""
+    global _client
+
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            http2=_http2_disponivel(),
+            timeout=httpx.Timeout(TIMEOUT, connect=CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=MAX_CONEXOES,
+                max_keepalive_connections=MAX_KEEPALIVE
+            )
+        )
+    return _client
+
+
+def _semaforo(instance_name: Optional[str]) -> asyncio.Semaphore:
+    """Semáforo que limita requisições simultâneas de uma instância"""
+    chave = instance_name or ""
+    if chave not in _semaforos:
+        _semaforos[chave] = asyncio.Semaphore(MAX_POR_INSTANCIA)
+    return _semaforos[chave]
+
+
+async def request(
+    method: str,
+    base_url: str,
+    path: str,
+    api_key: str,
+    instance_name: Optional[str] = None,
+    json: Optional[Any] = None,
+    timeout: Optional[float] = None
+) -> httpx.Response:
+    """
+    Executa uma requisição na Evolution API usando o cliente compartilhado
+
+    Só repete a requisição quando ela comprovadamente não foi processada
+    (falha de conexão ou status 429/502/503/504), para não duplicar mensagens.
+
+    Args:
+        method: Método HTTP
+        base_url: URL base da Evolution API
+        path: Caminho do endpoint (ex: /message/sendText/{instancia})
+        api_key: API Key da Evolution
+        instance_name: Instância (para o limite de conexões por instância)
+        json: Corpo da requisição
+        timeout: Timeout específico desta chamada (segundos)
+
+    Returns:
+        Resposta HTTP
+    """
+    headers = {
+        "apikey": api_key,
+        "Content-Type": "application/json"
+    }
+    kwargs = {"headers": headers, "json": json}
+    if timeout is not None:
+        kwargs["timeout"] = httpx.Timeout(timeout, connect=CONNECT_TIMEOUT)
+
+    url = f"{base_url.rstrip('/')}{path}"
+    tentativa = 0
+
+    async with _semaforo(instance_name):
+        while True:
+            try:
+                response = await get_client().request(method, url, **kwargs)
+                if response.status_code not in STATUS_RETRY or tentativa >= MAX_RETRIES:
+                    return response
+                print(f"⚠️ Evolution respondeu {response.status_code}, tentando novamente...")
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+                if tentativa >= MAX_RETRIES:
+                    raise
+                print(f"⚠️ Falha de conexão com Evolution ({e}), tentando novamente...")
+
+            tentativa += 1
+            await asyncio.sleep(BACKOFF_BASE * (2 ** (tentativa - 1)) + random.uniform(0, BACKOFF_BASE))
+
+
+async def post(
+    base_url: str,
+    path: str,
+    api_key: str,
+    instance_name: Optional[str] = None,
+    json: Optional[Any] = None,
+    timeout: Optional[float] = None
+) -> httpx.Response:
+    """POST na Evolution API"""
+    return await request("POST", base_url, path, api_key, instance_name, json, timeout)
+
+
+async def get(
+    base_url: str,
+    path: str,
+    api_key: str,
+    instance_name: Optional[str] = None,
+    timeout: Optional[float] = None
+) -> httpx.Response:
+    """GET na Evolution API"""
+    return await request("GET", base_url, path, api_key, instance_name, None, timeout)
+
+
+async def fechar():
+    """Fecha o cliente compartilhado (chamar no shutdown da aplicação)"""
+    global _client
+
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+    _semaforos.clear()
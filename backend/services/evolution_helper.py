@@ -103,6 +103,9 @@ async def criar_instancia_evolution(
                 config.evolution_instance = instance_name
                 db.commit()
 
+                from services import webhook_context
+                webhook_context.invalidar(pedido.id)
+
             return {
                 "success": True,
                 "instance_name": instance_name,
@@ -3,18 +3,64 @@ Handler de mensagens para Agente IA
 Processa mensagens do WhatsApp usando RAG + Áudio
 """
 import os
+import asyncio
 from typing import Dict, Optional
-import httpx
 from pathlib import Path
 
-from services.rag_service import RAGService
+from services.rag_service import RAGService, STREAM_FLUSH
+from services.async_rag_service import AsyncRAGService
 from services.audio_service import AudioService
+from services import evolution_client, transcription_cache
+from services.transcription_service import TranscricaoSaturada
 from config_helper import get_qdrant_url, get_ollama_url, get_ollama_model, get_ollama_embeddings_model, get_evolution_api_url, get_evolution_api_key
 
 
+MSG_IA_INDISPONIVEL = "⚠️ Sistema de IA não disponível no momento.\n\nPor favor:\n• Digite *atendente* para falar com um humano\n• Ou aguarde alguns instantes e tente novamente"
+
+MSG_RESPOSTA_INCOMPLETA = "⚠️ Não consegui concluir esta resposta.\n\nPor favor, envie sua pergunta novamente ou digite *atendente* para falar com um humano."
+
+MSG_OCUPADO = "⏳ Estou atendendo muitas mensagens neste momento.\n\nPor favor, aguarde alguns instantes e envie sua pergunta novamente, ou digite *atendente* para falar com um humano."
+
+# Perguntas ao RAG em andamento neste processo (acima do limite o bot pede para aguardar)
+MAX_PERGUNTAS_SIMULTANEAS = int(os.getenv("IA_MAX_PERGUNTAS_SIMULTANEAS", "200"))
+_perguntas_em_andamento = 0
+
+
+def _admitir_pergunta() -> bool:
+    """Reserva uma vaga de pergunta (False se o limite foi atingido)"""
+    global _perguntas_em_andamento
+
+    if _perguntas_em_andamento >= MAX_PERGUNTAS_SIMULTANEAS:
+        print(f"🚦 {_perguntas_em_andamento} perguntas em andamento, pedindo para aguardar")
+        return False
+    _perguntas_em_andamento += 1
+    return True
+
+
+def _liberar_pergunta():
+    global _perguntas_em_andamento
+
+    _perguntas_em_andamento -= 1
+
+# Envios de presença em segundo plano (referência evita coleta antes de terminar)
+_presencas: set = set()
+
+
 class IAHandler:
-    def __init__(self):
-        """Inicializa handler de IA"""
+    def __init__(
+        self,
+        rag_service: Optional[RAGService] = None,
+        audio_service: Optional[AudioService] = None,
+        async_rag_service: Optional[AsyncRAGService] = None
+    ):
+        """
+        Inicializa handler de IA
+
+        Args:
+            rag_service: RAGService compartilhado (ver services.service_registry)
+            audio_service: AudioService compartilhado
+            async_rag_service: AsyncRAGService usado no caminho das mensagens
+        """
         # Configurações
         self.qdrant_url = get_qdrant_url()
         self.ollama_url = get_ollama_url()
@@ -24,13 +70,14 @@ class IAHandler:
         self.evolution_api_key = get_evolution_api_key()
 
         # Serviços
-        self.rag_service = RAGService(
+        self.rag_service = rag_service or RAGService(
             qdrant_url=self.qdrant_url,
             ollama_url=self.ollama_url,
             embeddings_model=self.embeddings_model,
             llm_model=self.llm_model
         )
-        self.audio_service = AudioService(whisper_model="base")
+        self.async_rag_service = async_rag_service or AsyncRAGService(self.rag_service)
+        self.audio_service = audio_service or AudioService()
 
     async def send_message(self, instance_name: str, phone_number: str, text: str) -> bool:
         """
@@ -45,21 +92,19 @@ class IAHandler:
             True se enviado com sucesso
         """
         try:
-            url = f"{self.evolution_url}/message/sendText/{instance_name}"
-
             payload = {
                 "number": phone_number,
                 "text": text
             }
 
-            headers = {
-                "apikey": self.evolution_api_key,
-                "Content-Type": "application/json"
-            }
-
-            async with httpx.AsyncClient(timeout=30) as client:
-                response = await client.post(url, json=payload, headers=headers)
-                response.raise_for_status()
+            response = await evolution_client.post(
+                self.evolution_url,
+                f"/message/sendText/{instance_name}",
+                self.evolution_api_key,
+                instance_name=instance_name,
+                json=payload
+            )
+            response.raise_for_status()
 
             print(f"✅ Mensagem enviada para {phone_number}")
             return True
@@ -81,8 +126,6 @@ class IAHandler:
             True se enviado com sucesso
         """
         try:
-            url = f"{self.evolution_url}/message/sendMedia/{instance_name}"
-
             # Ler áudio como base64
             import base64
             with open(audio_path, 'rb') as f:
@@ -96,14 +139,15 @@ class IAHandler:
                 "fileName": Path(audio_path).name
             }
 
-            headers = {
-                "apikey": self.evolution_api_key,
-                "Content-Type": "application/json"
-            }
-
-            async with httpx.AsyncClient(timeout=60) as client:
-                response = await client.post(url, json=payload, headers=headers)
-                response.raise_for_status()
+            response = await evolution_client.post(
+                self.evolution_url,
+                f"/message/sendMedia/{instance_name}",
+                self.evolution_api_key,
+                instance_name=instance_name,
+                json=payload,
+                timeout=60
+            )
+            response.raise_for_status()
 
             print(f"🔊 Áudio enviado para {phone_number}")
             return True
@@ -125,22 +169,21 @@ class IAHandler:
             True se enviado com sucesso
         """
         try:
-            url = f"{self.evolution_url}/chat/sendPresence/{instance_name}"
-
             payload = {
                 "number": phone_number,
                 "presence": state,
                 "delay": 3000  # 3 segundos
             }
 
-            headers = {
-                "apikey": self.evolution_api_key,
-                "Content-Type": "application/json"
-            }
-
-            async with httpx.AsyncClient(timeout=10) as client:
-                response = await client.post(url, json=payload, headers=headers)
-                response.raise_for_status()
+            response = await evolution_client.post(
+                self.evolution_url,
+                f"/chat/sendPresence/{instance_name}",
+                self.evolution_api_key,
+                instance_name=instance_name,
+                json=payload,
+                timeout=10
+            )
+            response.raise_for_status()
 
             print(f"⌨️  Status '{state}' enviado para {phone_number}")
             return True
@@ -191,45 +234,15 @@ class IAHandler:
             # Processar pergunta com RAG (usando instance_name como identificador da coleção)
             print(f"🔍 Iniciando processamento RAG para: {message_text[:50]}...")
 
-            # Executar RAG de forma assíncrona para não bloquear
-            import asyncio
-            from concurrent.futures import ThreadPoolExecutor
+            # Controle de admissão: corrotinas são baratas, mas Ollama/Qdrant não
+            if not _admitir_pergunta():
+                await self.send_message(instance_name, phone_number, MSG_OCUPADO)
+                return False
 
             try:
-                loop = asyncio.get_event_loop()
-                with ThreadPoolExecutor() as executor:
-                    # Adicionar timeout de 120 segundos (Ollama precisa mais tempo)
-                    answer = await asyncio.wait_for(
-                        loop.run_in_executor(
-                            executor,
-                            self.rag_service.process_question,
-                            instance_name,
-                            message_text
-                        ),
-                        timeout=120.0
-                    )
-                print(f"✅ RAG completou! Resposta: {answer[:100]}...")
-            except asyncio.TimeoutError:
-                print(f"⏱️ Timeout no processamento RAG (120s)")
-                answer = "⚠️ Sistema de IA não disponível no momento.\n\nPor favor:\n• Digite *atendente* para falar com um humano\n• Ou aguarde alguns instantes e tente novamente"
-            except Exception as e:
-                print(f"❌ Erro no processamento RAG: {e}")
-                import traceback
-                traceback.print_exc()
-
-                # Resposta de fallback se RAG falhar
-                answer = "⚠️ Sistema de IA não disponível no momento.\n\nPor favor:\n• Digite *atendente* para falar com um humano\n• Ou aguarde alguns instantes e tente novamente"
-
-            # Enviar resposta em texto
-            print(f"📤 Enviando resposta para {phone_number}...")
-            await self.send_message(instance_name, phone_number, answer)
-            print(f"✅ Resposta enviada com sucesso!")
-
-            # Gerar e enviar áudio da resposta (DESABILITADO - apenas texto)
-            # audio_path = self.audio_service.generate_response_audio(answer, phone_number)
-            # await self.send_audio(instance_name, phone_number, audio_path)
-
-            return True
+                return await self._answer_question(instance_name, phone_number, message_text)
+            finally:
+                _liberar_pergunta()
 
         except Exception as e:
             print(f"❌ Erro ao processar mensagem de texto: {e}")
@@ -240,12 +253,104 @@ class IAHandler:
 
             return False
 
+    async def _answer_question(self, instance_name: str, phone_number: str, message_text: str) -> bool:
+        """Responde uma pergunta com o RAG assíncrono (streaming ou resposta única)"""
+        # Streaming: envia frases/parágrafos conforme o LLM gera
+        if STREAM_FLUSH != "off":
+            return await self._process_question_streaming(instance_name, phone_number, message_text)
+
+        # RAG assíncrono (sem threads)
+        try:
+            # Timeout de 120 segundos (Ollama precisa mais tempo)
+            answer = await asyncio.wait_for(
+                self.async_rag_service.process_question(instance_name, message_text),
+                timeout=120.0
+            )
+            print(f"✅ RAG completou! Resposta: {answer[:100]}...")
+        except asyncio.TimeoutError:
+            print(f"⏱️ Timeout no processamento RAG (120s)")
+            answer = MSG_IA_INDISPONIVEL
+        except Exception as e:
+            print(f"❌ Erro no processamento RAG: {e}")
+            import traceback
+            traceback.print_exc()
+
+            # Resposta de fallback se RAG falhar
+            answer = MSG_IA_INDISPONIVEL
+
+        # Enviar resposta em texto
+        print(f"📤 Enviando resposta para {phone_number}...")
+        await self.send_message(instance_name, phone_number, answer)
+        print(f"✅ Resposta enviada com sucesso!")
+
+        # Gerar e enviar áudio da resposta (DESABILITADO - apenas texto)
+        # audio_path = self.audio_service.generate_response_audio(answer, phone_number)
+        # await self.send_audio(instance_name, phone_number, audio_path)
+
+        return True
+
+    async def _process_question_streaming(
+        self,
+        instance_name: str,
+        phone_number: str,
+        message_text: str,
+        timeout: float = 120.0
+    ) -> bool:
+        """
+        Executa o RAG em streaming e envia cada trecho da resposta assim que
+        fica pronto. O status "digitando" é enviado uma vez, em segundo plano
+        (send_presence leva ~3s e não pode segurar a geração)
+
+        Args:
+            instance_name: Nome da instância Evolution
+            phone_number: Número do destinatário
+            message_text: Pergunta do usuário
+            timeout: Tempo máximo total da geração (segundos)
+
+        Returns:
+            True se ao menos um trecho foi enviado
+        """
+        enviados = 0
+        completo = False
+
+        async def on_segment(trecho: str):
+            nonlocal enviados
+            await self.send_message(instance_name, phone_number, trecho)
+            enviados += 1
+
+        # "Digitando..." sem aguardar (não atrasa o primeiro trecho)
+        presenca = asyncio.create_task(self.send_presence(instance_name, phone_number, "composing"))
+        _presencas.add(presenca)
+        presenca.add_done_callback(_presencas.discard)
+
+        try:
+            # Cancelar no timeout fecha o stream do Ollama e interrompe a geração
+            await asyncio.wait_for(
+                self.async_rag_service.process_question_stream(instance_name, message_text, on_segment),
+                timeout=timeout
+            )
+            completo = True
+        except asyncio.TimeoutError:
+            print(f"⏱️ Timeout no processamento RAG ({timeout:.0f}s)")
+        except Exception as e:
+            print(f"❌ Erro no processamento RAG (streaming): {e}")
+
+        if not enviados:
+            await self.send_message(instance_name, phone_number, MSG_IA_INDISPONIVEL)
+        elif not completo:
+            # Parte da resposta já foi enviada: avisar que ficou incompleta
+            await self.send_message(instance_name, phone_number, MSG_RESPOSTA_INCOMPLETA)
+
+        print(f"✅ Resposta enviada em {enviados} trecho(s)")
+        return enviados > 0
+
     async def process_audio_message(
         self,
         instance_name: str,
         phone_number: str,
         audio_url: str,
-        config: Dict
+        config: Dict,
+        media_key: Optional[str] = None
     ) -> bool:
         """
         Processa mensagem de áudio do usuário
@@ -255,6 +360,7 @@ class IAHandler:
             phone_number: Número do remetente
             audio_url: URL do áudio
             config: Configurações do bot
+            media_key: Chave da mídia no webhook (cache de transcrições)
 
         Returns:
             True se processado com sucesso
@@ -268,42 +374,15 @@ class IAHandler:
             # except Exception as e:
             #     print(f"⚠️ Erro ao enviar presença (continuando...): {e}")
 
-            # Transcrever áudio
-            transcription = self.audio_service.process_whatsapp_audio(audio_url)
-            print(f"📝 Transcrição: {transcription}")
-
-            # Verificar se é comando de atendente
-            if self._is_attendant_request(transcription):
-                return await self._transfer_to_attendant(instance_name, phone_number, config)
-
-            # Processar pergunta com RAG (usando instance_name como identificador da coleção)
-            import asyncio
-            from concurrent.futures import ThreadPoolExecutor
+            # Mesmo controle de admissão das perguntas em texto (transcrição + RAG)
+            if not _admitir_pergunta():
+                await self.send_message(instance_name, phone_number, MSG_OCUPADO)
+                return False
 
             try:
-                loop = asyncio.get_event_loop()
-                with ThreadPoolExecutor() as executor:
-                    answer = await loop.run_in_executor(
-                        executor,
-                        self.rag_service.process_question,
-                        instance_name,
-                        transcription
-                    )
-            except Exception as e:
-                print(f"❌ Erro no processamento RAG de áudio: {e}")
-                import traceback
-                traceback.print_exc()
-
-                answer = "Desculpe, tive um problema ao processar seu áudio. Por favor, tente novamente ou digite *atendente* para falar com um humano."
-
-            # Enviar resposta em texto
-            await self.send_message(instance_name, phone_number, f"🎙️ *Você disse:* {transcription}\n\n{answer}")
-
-            # Gerar e enviar áudio da resposta (DESABILITADO - apenas texto)
-            # audio_path = self.audio_service.generate_response_audio(answer, phone_number)
-            # await self.send_audio(instance_name, phone_number, audio_path)
-
-            return True
+                return await self._answer_audio(instance_name, phone_number, audio_url, config, media_key)
+            finally:
+                _liberar_pergunta()
 
         except Exception as e:
             print(f"❌ Erro ao processar áudio: {e}")
@@ -313,6 +392,56 @@ class IAHandler:
 
             return False
 
+    async def _answer_audio(
+        self,
+        instance_name: str,
+        phone_number: str,
+        audio_url: str,
+        config: Dict,
+        media_key: Optional[str]
+    ) -> bool:
+        """Transcreve o áudio e responde a pergunta com o RAG assíncrono"""
+        # Transcrever áudio (download em memória + pool de transcrição do Whisper)
+        try:
+            transcription = await asyncio.wait_for(
+                self.audio_service.process_whatsapp_audio_async(audio_url, media_key),
+                timeout=120.0
+            )
+        except TranscricaoSaturada as e:
+            print(f"🚦 Transcrição saturada, pedindo para aguardar: {e}")
+            await self.send_message(instance_name, phone_number, MSG_OCUPADO)
+            return False
+        print(f"📝 Transcrição: {transcription}")
+
+        # Verificar se é comando de atendente
+        if self._is_attendant_request(transcription):
+            return await self._transfer_to_attendant(instance_name, phone_number, config)
+
+        # Processar pergunta com RAG (usando instance_name como identificador da coleção)
+        try:
+            answer = await asyncio.wait_for(
+                self.async_rag_service.process_question(instance_name, transcription),
+                timeout=120.0
+            )
+        except asyncio.TimeoutError:
+            print(f"⏱️ Timeout no processamento RAG de áudio (120s)")
+            answer = MSG_IA_INDISPONIVEL
+        except Exception as e:
+            print(f"❌ Erro no processamento RAG de áudio: {e}")
+            import traceback
+            traceback.print_exc()
+
+            answer = "Desculpe, tive um problema ao processar seu áudio. Por favor, tente novamente ou digite *atendente* para falar com um humano."
+
+        # Enviar resposta em texto
+        await self.send_message(instance_name, phone_number, f"🎙️ *Você disse:* {transcription}\n\n{answer}")
+
+        # Gerar e enviar áudio da resposta (DESABILITADO - apenas texto)
+        # audio_path = self.audio_service.generate_response_audio(answer, phone_number)
+        # await self.send_audio(instance_name, phone_number, audio_path)
+
+        return True
+
     def _is_attendant_request(self, text: str) -> bool:
         """
         Verifica se a mensagem é um pedido para falar com atendente
@@ -491,7 +620,8 @@ Como posso ajudar você hoje?"""
                     instance_name,
                     phone_number,
                     audio_url,
-                    config
+                    config,
+                    media_key=transcription_cache.chave_midia(audio_message)
                 )
 
             else:
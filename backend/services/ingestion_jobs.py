@@ -0,0 +1,221 @@
+"""
+Jobs de ingestão de documentos da base de conhecimento
+- O upload apenas salva o arquivo e cria um job
+- Um pool de workers extrai, divide, vetoriza e grava no Qdrant
+- O painel acompanha o progresso (chunks, throughput, erros) pelo ID do job
+- No startup, arquivos antigos ainda fora do índice textual são indexados
+  no mesmo pool (fora do caminho das perguntas)
+"""
+import os
+import time
+import uuid
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+
+# Configurações (via .env)
+NUM_WORKERS = int(os.getenv("INGESTION_WORKERS", "2"))
+RETENCAO_SEGUNDOS = int(os.getenv("INGESTION_JOB_RETENCAO", "3600"))
+KNOWLEDGE_BASE_DIR = Path("storage/knowledge_base")
+
+STATUS_PENDENTE = "pendente"
+STATUS_PROCESSANDO = "processando"
+STATUS_CONCLUIDO = "concluido"
+STATUS_ERRO = "erro"
+
+
+class IngestionJob:
+    def __init__(self, pedido_id: int, instance_name: str, file_path: str, metadata: Optional[Dict] = None):
+        """
+        Job de ingestão de um documento
+
+        Args:
+            pedido_id: ID do pedido
+            instance_name: Instância Evolution (identifica a coleção)
+            file_path: Caminho do arquivo salvo
+            metadata: Metadados gravados em cada chunk
+        """
+        self.id = uuid.uuid4().hex
+        self.pedido_id = pedido_id
+        self.instance_name = instance_name
+        self.file_path = file_path
+        self.filename = Path(file_path).name
+        self.metadata = metadata or {}
+
+        self.status = STATUS_PENDENTE
+        self.etapa = "na fila"
+        self.chunks_total = 0
+        self.chunks_processados = 0
+        self.erro: Optional[str] = None
+
+        self.criado_em = time.time()
+        self.iniciado_em: Optional[float] = None
+        self.finalizado_em: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def atualizar_progresso(self, etapa: str, processados: int, total: int):
+        """Callback de progresso chamado pelo RAGService"""
+        with self._lock:
+            self.etapa = etapa
+            self.chunks_processados = processados
+            self.chunks_total = total
+
+    @property
+    def finalizado(self) -> bool:
+        return self.status in (STATUS_CONCLUIDO, STATUS_ERRO)
+
+    def to_dict(self) -> Dict:
+        """Estado do job para a API"""
+        with self._lock:
+            fim = self.finalizado_em or time.time()
+            duracao = fim - self.iniciado_em if self.iniciado_em else 0.0
+            throughput = self.chunks_processados / duracao if duracao > 0 else 0.0
+            progresso = (self.chunks_processados / self.chunks_total * 100) if self.chunks_total else 0.0
+
+            return {
+                "job_id": self.id,
+                "pedido_id": self.pedido_id,
+                "filename": self.filename,
+                "status": self.status,
+                "etapa": self.etapa,
+                "chunks_total": self.chunks_total,
+                "chunks_processados": self.chunks_processados,
+                "progresso": round(progresso, 1),
+                "chunks_por_segundo": round(throughput, 2),
+                "duracao_segundos": round(duracao, 2),
+                "erro": self.erro,
+                "criado_em": self.criado_em,
+                "iniciado_em": self.iniciado_em,
+                "finalizado_em": self.finalizado_em
+            }
+
+
+_jobs: Dict[str, IngestionJob] = {}
+_jobs_lock = threading.Lock()
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    """Pool de workers de ingestão (criado sob demanda)"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=NUM_WORKERS, thread_name_prefix="ingestao")
+    return _executor
+
+
+def _limpar_jobs_antigos():
+    """Remove da memória jobs finalizados há mais tempo que a retenção"""
+    limite = time.time() - RETENCAO_SEGUNDOS
+    with _jobs_lock:
+        for job_id in [
+            j.id for j in _jobs.values()
+            if j.finalizado and j.finalizado_em is not None and j.finalizado_em < limite
+        ]:
+            del _jobs[job_id]
+
+
+def _executar(job: IngestionJob):
+    """Processa um job (roda em thread do pool)"""
+    from services import service_registry
+
+    job.status = STATUS_PROCESSANDO
+    job.iniciado_em = time.time()
+    job.etapa = "extraindo texto"
+
+    try:
+        rag_service = service_registry.get_rag_service()
+        chunks_count = rag_service.vectorize_document(
+            phone_number=job.instance_name,
+            file_path=job.file_path,
+            metadata=job.metadata,
+            progress_callback=job.atualizar_progresso
+        )
+        job.atualizar_progresso("concluído", chunks_count, chunks_count)
+        job.finalizado_em = time.time()
+        job.status = STATUS_CONCLUIDO
+        print(f"✅ Job de ingestão {job.id} concluído: {job.filename} ({chunks_count} chunks)")
+
+    except Exception as e:
+        print(f"❌ Job de ingestão {job.id} falhou: {e}")
+        job.erro = str(e)
+        job.etapa = "erro"
+        job.finalizado_em = time.time()
+        job.status = STATUS_ERRO
+
+        # Remover arquivo se houve erro (mesmo comportamento do upload síncrono)
+        try:
+            Path(job.file_path).unlink(missing_ok=True)
+        except Exception:
+            pass
+
+
+def submeter(pedido_id: int, instance_name: str, file_path: str, metadata: Optional[Dict] = None) -> IngestionJob:
+    """Cria um job de ingestão e o coloca no pool de workers"""
+    _limpar_jobs_antigos()
+
+    job = IngestionJob(pedido_id, instance_name, file_path, metadata)
+    with _jobs_lock:
+        _jobs[job.id] = job
+
+    _get_executor().submit(_executar, job)
+    return job
+
+
+def obter(job_id: str) -> Optional[IngestionJob]:
+    """Busca um job pelo ID"""
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+
+def listar(pedido_id: int) -> List[IngestionJob]:
+    """Jobs de um pedido, mais recentes primeiro"""
+    with _jobs_lock:
+        jobs = [j for j in _jobs.values() if j.pedido_id == pedido_id]
+    return sorted(jobs, key=lambda j: j.criado_em, reverse=True)
+
+
+def _arquivos_em_andamento(instance_name: str) -> set:
+    """Arquivos da instância com job de ingestão ainda não finalizado"""
+    with _jobs_lock:
+        return {
+            j.filename for j in _jobs.values()
+            if j.instance_name == instance_name and not j.finalizado
+        }
+
+
+def _sincronizar_indices_textuais():
+    """Indexa no índice textual os arquivos de todas as instâncias que ainda não estão nele"""
+    from services import service_registry
+
+    if not KNOWLEDGE_BASE_DIR.exists():
+        return
+
+    rag_service = service_registry.get_rag_service()
+    total = 0
+    for storage_path in KNOWLEDGE_BASE_DIR.iterdir():
+        if not storage_path.is_dir():
+            continue
+        try:
+            total += rag_service.sincronizar_indice_textual(
+                storage_path.name, storage_path, ignorar=_arquivos_em_andamento(storage_path.name)
+            )
+        except Exception as e:
+            print(f"⚠️ Erro ao sincronizar índice textual de {storage_path.name}: {e}")
+
+    if total:
+        print(f"📇 Índice textual: {total} arquivo(s) antigo(s) indexado(s)")
+
+
+def sincronizar_indices_textuais():
+    """Agenda a sincronização do índice textual no pool de ingestão (chamar no startup)"""
+    _get_executor().submit(_sincronizar_indices_textuais)
+
+
+def encerrar():
+    """Encerra o pool de workers (chamar no shutdown da aplicação)"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
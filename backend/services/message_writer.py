@@ -0,0 +1,171 @@
+"""
+Gravação das mensagens dos webhooks com group commit (opcional)
+- Cada troca de mensagens é uma crud.UnidadeMensagens (uma transação)
+- Com MESSAGE_GROUP_COMMIT=true, as unidades de várias conversas que chegam
+  dentro da janela são gravadas juntas em um único commit; quem gravou só
+  continua depois do commit (nada é confirmado antes de estar no banco)
+- Se o commit do grupo falhar, cada unidade é regravada isoladamente para
+  que o erro (ex: webhook duplicado) chegue apenas a quem o causou
+"""
+import os
+import asyncio
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy.orm import Session
+
+import crud
+from database import SessionLocal
+
+
+# Configurações (via .env)
+GROUP_COMMIT = os.getenv("MESSAGE_GROUP_COMMIT", "false").lower() == "true"
+JANELA_MS = float(os.getenv("MESSAGE_GROUP_COMMIT_WINDOW_MS", "5"))
+MAX_LOTE = int(os.getenv("MESSAGE_GROUP_COMMIT_MAX", "200"))
+
+_fila: Optional[asyncio.Queue] = None
+_tarefa: Optional[asyncio.Task] = None
+_lotes = 0
+_unidades = 0
+_maior_lote = 0
+_regravacoes = 0
+
+
+async def gravar(db: Session, unidade: crud.UnidadeMensagens) -> List[int]:
+    """
+    Grava a unidade e retorna os IDs das mensagens inseridas
+
+    Sem group commit ativo, grava direto na sessão do chamador.
+
+    Args:
+        db: Sessão do chamador
+        unidade: Mensagens e alterações da conversa da troca
+
+    Returns:
+        IDs das mensagens, na ordem em que foram adicionadas
+    """
+    if _tarefa is None or _tarefa.done():
+        return unidade.commit(db)
+
+    futuro = asyncio.get_running_loop().create_future()
+    await _fila.put((unidade, futuro))
+    return await futuro
+
+
+def _gravar_lote(unidades: List[crud.UnidadeMensagens]) -> List:
+    """Grava as unidades em um commit; em caso de erro, uma a uma (resultado: IDs ou exceção)"""
+    global _regravacoes
+
+    db = SessionLocal()
+    try:
+        try:
+            por_unidade = [unidade.aplicar(db) for unidade in unidades]
+            db.flush()
+            resultados = [[m.id for m in mensagens] for mensagens in por_unidade]
+            db.commit()
+            return resultados
+        except Exception:
+            db.rollback()
+            if len(unidades) == 1:
+                raise
+            _regravacoes += 1
+
+        resultados = []
+        for unidade in unidades:
+            try:
+                resultados.append(unidade.commit(db))
+            except Exception as e:
+                db.rollback()
+                resultados.append(e)
+        return resultados
+    finally:
+        db.close()
+
+
+async def _loop():
+    global _lotes, _unidades, _maior_lote
+
+    loop = asyncio.get_running_loop()
+
+    while True:
+        lote: List[Tuple[crud.UnidadeMensagens, asyncio.Future]] = [await _fila.get()]
+
+        # Juntar o que chegar dentro da janela (ou até o tamanho máximo)
+        prazo = loop.time() + JANELA_MS / 1000
+        while len(lote) < MAX_LOTE:
+            restante = prazo - loop.time()
+            if restante <= 0:
+                break
+            try:
+                lote.append(await asyncio.wait_for(_fila.get(), restante))
+            except asyncio.TimeoutError:
+                break
+
+        try:
+            resultados = await asyncio.to_thread(_gravar_lote, [unidade for unidade, _ in lote])
+        except asyncio.CancelledError:
+            for _, futuro in lote:
+                futuro.cancel()
+            raise
+        except Exception as e:
+            resultados = [e] * len(lote)
+
+        _lotes += 1
+        _unidades += len(lote)
+        _maior_lote = max(_maior_lote, len(lote))
+
+        for (_, futuro), resultado in zip(lote, resultados):
+            if futuro.done():
+                continue
+            if isinstance(resultado, Exception):
+                futuro.set_exception(resultado)
+            else:
+                futuro.set_result(resultado)
+
+
+def iniciar():
+    """Inicia o group commit, se habilitado (chamar no startup)"""
+    global _fila, _tarefa
+
+    if not GROUP_COMMIT or (_tarefa is not None and not _tarefa.done()):
+        return
+
+    _fila = asyncio.Queue()
+    _tarefa = asyncio.create_task(_loop())
+    print(f"💾 Group commit de mensagens ativo (janela {JANELA_MS:g} ms, até {MAX_LOTE} trocas)")
+
+
+async def encerrar():
+    """Para o group commit e grava o que ainda estiver na fila (chamar no shutdown)"""
+    global _tarefa
+
+    if _tarefa is None:
+        return
+
+    _tarefa.cancel()
+    await asyncio.gather(_tarefa, return_exceptions=True)
+    _tarefa = None
+
+    pendentes = []
+    while not _fila.empty():
+        pendentes.append(_fila.get_nowait())
+    if pendentes:
+        resultados = _gravar_lote([unidade for unidade, _ in pendentes])
+        for (_, futuro), resultado in zip(pendentes, resultados):
+            if futuro.done():
+                continue
+            if isinstance(resultado, Exception):
+                futuro.set_exception(resultado)
+            else:
+                futuro.set_result(resultado)
+
+
+def estatisticas() -> Dict:
+    """Lotes gravados e tamanho médio dos grupos"""
+    return {
+        "group_commit": _tarefa is not None and not _tarefa.done(),
+        "fila": _fila.qsize() if _fila is not None else 0,
+        "lotes": _lotes,
+        "trocas": _unidades,
+        "media_por_lote": round(_unidades / _lotes, 2) if _lotes else 0.0,
+        "maior_lote": _maior_lote,
+        "regravacoes_isoladas": _regravacoes
+    }
@@ -0,0 +1,256 @@
+"""
+Escalonador de chamadas ao Ollama
+- Limite de requisições simultâneas (em voo) por modelo
+- Lanes de prioridade: geração interativa > embedding de consulta > embedding de ingestão
+- Dentro de cada lane, revezamento entre instâncias (uma ingestão grande não
+  monopoliza a fila)
+- Ingestão nunca ocupa todos os slots de um modelo (reserva para o chat)
+- Métricas de tempo em fila por lane
+- Funciona para chamadas síncronas (threads) e assíncronas (asyncio)
+"""
+import os
+import time
+import asyncio
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager, asynccontextmanager
+from typing import Dict, Optional
+
+
+# Prioridades (menor = mais urgente)
+PRIORIDADE_GERACAO = 0
+PRIORIDADE_CONSULTA = 1
+PRIORIDADE_INGESTAO = 2
+
+NOMES_PRIORIDADE = {
+    PRIORIDADE_GERACAO: "geracao",
+    PRIORIDADE_CONSULTA: "consulta",
+    PRIORIDADE_INGESTAO: "ingestao"
+}
+
+
+def _limites_por_modelo() -> Dict[str, int]:
+    """Lê OLLAMA_MAX_EM_VOO_MODELOS (ex: "llama3:8b=2,nomic-embed-text=4")"""
+    limites = {}
+    for item in os.getenv("OLLAMA_MAX_EM_VOO_MODELOS", "").split(","):
+        if "=" in item:
+            modelo, limite = item.rsplit("=", 1)
+            limites[modelo.strip()] = int(limite)
+    return limites
+
+
+# Configurações (via .env)
+MAX_EM_VOO_PADRAO = int(os.getenv("OLLAMA_MAX_EM_VOO", "2"))
+MAX_EM_VOO_MODELOS = _limites_por_modelo()
+RESERVA_INTERATIVA = int(os.getenv("OLLAMA_RESERVA_INTERATIVA", "1"))
+
+
+class _Espera:
+    """Uma chamada aguardando slot"""
+
+    def __init__(self, prioridade: int, tenant: str):
+        self.prioridade = prioridade
+        self.tenant = tenant
+        self.enfileirado_em = time.monotonic()
+        self.concedido = False
+        self._evento: Optional[threading.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._future: Optional[asyncio.Future] = None
+
+    def conceder(self):
+        self.concedido = True
+        if self._evento is not None:
+            self._evento.set()
+        elif self._future is not None:
+            self._loop.call_soon_threadsafe(self._resolver)
+
+    def _resolver(self):
+        if not self._future.done():
+            self._future.set_result(True)
+
+
+class _MetricasLane:
+    def __init__(self):
+        self.atendidas = 0
+        self.soma_espera = 0.0
+        self.max_espera = 0.0
+
+
+class _Modelo:
+    """Slots e filas de um modelo"""
+
+    def __init__(self, modelo: str):
+        self.limite = max(1, MAX_EM_VOO_MODELOS.get(modelo, MAX_EM_VOO_PADRAO))
+        self.em_voo = 0
+        self.em_voo_ingestao = 0
+        # prioridade -> {tenant: deque[_Espera]} (ordem do dict = revezamento)
+        self.filas: Dict[int, "OrderedDict[str, deque]"] = {p: OrderedDict() for p in NOMES_PRIORIDADE}
+
+    def limite_ingestao(self) -> int:
+        if self.limite > RESERVA_INTERATIVA:
+            return self.limite - RESERVA_INTERATIVA
+        return self.limite
+
+    def aguardando(self, prioridade: int) -> int:
+        return sum(len(fila) for fila in self.filas[prioridade].values())
+
+
+_lock = threading.Lock()
+_modelos: Dict[str, _Modelo] = {}
+_metricas: Dict[int, _MetricasLane] = {p: _MetricasLane() for p in NOMES_PRIORIDADE}
+
+
+def _get_modelo(modelo: str) -> _Modelo:
+    if modelo not in _modelos:
+        _modelos[modelo] = _Modelo(modelo)
+    return _modelos[modelo]
+
+
+def _pode_executar(estado: _Modelo, prioridade: int) -> bool:
+    if estado.em_voo >= estado.limite:
+        return False
+    if prioridade == PRIORIDADE_INGESTAO and estado.em_voo_ingestao >= estado.limite_ingestao():
+        return False
+    return True
+
+
+def _ocupar(estado: _Modelo, espera: _Espera):
+    """Marca o slot como ocupado e registra o tempo de fila (com _lock)"""
+    estado.em_voo += 1
+    if espera.prioridade == PRIORIDADE_INGESTAO:
+        estado.em_voo_ingestao += 1
+
+    tempo_fila = time.monotonic() - espera.enfileirado_em
+    metricas = _metricas[espera.prioridade]
+    metricas.atendidas += 1
+    metricas.soma_espera += tempo_fila
+    metricas.max_espera = max(metricas.max_espera, tempo_fila)
+    espera.conceder()
+
+
+def _despachar(estado: _Modelo):
+    """Concede slots livres aos próximos da fila (com _lock)"""
+    for prioridade in sorted(estado.filas):
+        fila_tenants = estado.filas[prioridade]
+        while fila_tenants and _pode_executar(estado, prioridade):
+            tenant, fila = next(iter(fila_tenants.items()))
+            espera = fila.popleft()
+
+            # Revezamento: tenant vai para o fim se ainda tiver chamadas aguardando
+            del fila_tenants[tenant]
+            if fila:
+                fila_tenants[tenant] = fila
+
+            _ocupar(estado, espera)
+
+        # Prioridade mais alta ainda aguardando: não passar slots adiante
+        if estado.aguardando(prioridade):
+            return
+
+
+def _solicitar(modelo: str, espera: _Espera) -> bool:
+    """Concede imediatamente ou coloca na fila. Retorna True se concedido"""
+    with _lock:
+        estado = _get_modelo(modelo)
+
+        mais_urgentes = any(estado.aguardando(p) for p in estado.filas if p <= espera.prioridade)
+        if not mais_urgentes and _pode_executar(estado, espera.prioridade):
+            _ocupar(estado, espera)
+            return True
+
+        estado.filas[espera.prioridade].setdefault(espera.tenant, deque()).append(espera)
+        return False
+
+
+def _desistir(modelo: str, espera: _Espera):
+    """Remove da fila uma chamada cancelada; se já recebeu slot, devolve"""
+    with _lock:
+        estado = _get_modelo(modelo)
+        if not espera.concedido:
+            fila = estado.filas[espera.prioridade].get(espera.tenant)
+            if fila and espera in fila:
+                fila.remove(espera)
+                if not fila:
+                    del estado.filas[espera.prioridade][espera.tenant]
+            return
+
+    liberar(modelo, espera.prioridade)
+
+
+def liberar(modelo: str, prioridade: int):
+    """Devolve o slot e acorda o próximo da fila"""
+    with _lock:
+        estado = _get_modelo(modelo)
+        estado.em_voo = max(0, estado.em_voo - 1)
+        if prioridade == PRIORIDADE_INGESTAO:
+            estado.em_voo_ingestao = max(0, estado.em_voo_ingestao - 1)
+        _despachar(estado)
+
+
+@contextmanager
+def slot(modelo: str, prioridade: int, tenant: str = ""):
+    """
+    Reserva um slot do modelo (chamadas síncronas, bloqueia a thread)
+
+    Args:
+        modelo: Modelo do Ollama
+        prioridade: PRIORIDADE_GERACAO, PRIORIDADE_CONSULTA ou PRIORIDADE_INGESTAO
+        tenant: Instância que originou a chamada (revezamento justo)
+    """
+    espera = _Espera(prioridade, tenant or "")
+    espera._evento = threading.Event()
+
+    if not _solicitar(modelo, espera):
+        espera._evento.wait()
+
+    try:
+        yield
+    finally:
+        liberar(modelo, prioridade)
+
+
+@asynccontextmanager
+async def slot_async(modelo: str, prioridade: int, tenant: str = ""):
+    """Reserva um slot do modelo sem bloquear o event loop"""
+    espera = _Espera(prioridade, tenant or "")
+    espera._loop = asyncio.get_running_loop()
+    espera._future = espera._loop.create_future()
+
+    if not _solicitar(modelo, espera):
+        try:
+            await espera._future
+        except asyncio.CancelledError:
+            _desistir(modelo, espera)
+            raise
+
+    try:
+        yield
+    finally:
+        liberar(modelo, prioridade)
+
+
+def estatisticas() -> Dict:
+    """Ocupação por modelo e tempo em fila por lane"""
+    with _lock:
+        modelos = {
+            nome: {
+                "limite": estado.limite,
+                "em_voo": estado.em_voo,
+                "em_voo_ingestao": estado.em_voo_ingestao,
+                "aguardando": {
+                    NOMES_PRIORIDADE[p]: estado.aguardando(p) for p in estado.filas
+                }
+            }
+            for nome, estado in _modelos.items()
+        }
+
+        lanes = {
+            NOMES_PRIORIDADE[p]: {
+                "atendidas": m.atendidas,
+                "espera_media_s": round(m.soma_espera / m.atendidas, 3) if m.atendidas else 0.0,
+                "espera_max_s": round(m.max_espera, 3)
+            }
+            for p, m in _metricas.items()
+        }
+
+    return {"modelos": modelos, "lanes": lanes}
@@ -4,15 +4,26 @@ Vetorização de documentos e busca semântica usando Qdrant + Ollama
 """
 import os
 import json
+import uuid
+import hashlib
+import re
+import time
+import threading
 from pathlib import Path
-from typing import List, Dict, Optional
+from typing import Callable, List, Dict, Optional
 from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, VectorParams, PointStruct
+from qdrant_client.models import (
+    Distance, VectorParams, PointStruct, PayloadSchemaType,
+    Filter, FieldCondition, MatchValue, HasIdCondition, FilterSelector
+)
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from pypdf import PdfReader
 from docx import Document
 import chardet
+from services import embedding_cache, text_index, answer_cache, ollama_scheduler
+from services.ollama_scheduler import PRIORIDADE_GERACAO, PRIORIDADE_CONSULTA, PRIORIDADE_INGESTAO
 from config_helper import (
     get_rag_chunk_size,
     get_rag_chunk_overlap,
@@ -23,13 +34,101 @@ from config_helper import (
 )
 
 
+# Tamanho do lote de embeddings e concorrência para servidores sem lote
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", "4"))
+
+# Dimensão dos vetores por modelo de embeddings (compartilhado entre instâncias)
+_embedding_dimensions: Dict[str, int] = {}
+
+# Streaming da resposta do LLM: "sentence" (frases), "paragraph" (parágrafos) ou "off"
+STREAM_FLUSH = os.getenv("RAG_STREAM_FLUSH", "sentence").lower()
+STREAM_MIN_CHARS = int(os.getenv("RAG_STREAM_MIN_CHARS", "160"))
+
+RODAPE_ATENDENTE = "\n\n_Para falar com um atendente humano, digite *atendente*._"
+MSG_ERRO_RESPOSTA = "Desculpe, ocorreu um erro ao processar sua pergunta. Por favor, entre em contato com um atendente."
+MSG_SEM_CONTEXTO = "Ainda não tenho informações suficientes para responder. Por favor, entre em contato com um atendente digitando *atendente*."
+
+# Cache de existência das coleções: {(qdrant_url, coleção): (existe, expira_em)}
+COLLECTION_CACHE_TTL = float(os.getenv("QDRANT_COLLECTION_CACHE_TTL", "300"))
+COLLECTION_CACHE_TTL_NEGATIVO = float(os.getenv("QDRANT_COLLECTION_CACHE_TTL_NEGATIVO", "30"))
+_colecoes: Dict[tuple, tuple] = {}
+_colecoes_lock = threading.Lock()
+
+# Clientes Qdrant compartilhados por URL (trocar a configuração não abre novas conexões)
+_qdrant_clients: Dict[str, QdrantClient] = {}
+_qdrant_clients_lock = threading.Lock()
+
+# Namespace dos IDs determinísticos dos pontos no Qdrant
+POINT_ID_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "knowledge_base/points")
+
+# Servidores Ollama que suportam /api/embed (descoberto na primeira chamada)
+_embed_batch_support: Dict[str, bool] = {}
+
+
+def _get_qdrant_client(qdrant_url: str) -> QdrantClient:
+    """Cliente Qdrant da URL (criado na primeira chamada)"""
+    with _qdrant_clients_lock:
+        client = _qdrant_clients.get(qdrant_url)
+        if client is None:
+            client = _qdrant_clients[qdrant_url] = QdrantClient(url=qdrant_url)
+        return client
+
+
+class _BatchNaoSuportado(Exception):
+    """Servidor Ollama não possui o endpoint /api/embed"""
+
+
+class SegmentadorResposta:
+    """
+    Acumula o texto gerado em streaming e libera trechos completos
+    (frases ou parágrafos) com pelo menos STREAM_MIN_CHARS caracteres
+    """
+
+    # Fim de frase: pontuação seguida de espaço (ignora "1." de listas numeradas)
+    _FIM_FRASE = re.compile(r'(?<!\d)[.!?…]["\')*_]*\s+|\n\n+')
+    _FIM_PARAGRAFO = re.compile(r'\n\n+')
+
+    def __init__(self, politica: str = STREAM_FLUSH, min_chars: int = STREAM_MIN_CHARS):
+        self.padrao = self._FIM_PARAGRAFO if politica == "paragraph" else self._FIM_FRASE
+        self.min_chars = min_chars
+        self.buffer = ""
+
+    def adicionar(self, texto: str) -> List[str]:
+        """Adiciona texto gerado e retorna os trechos prontos para envio"""
+        self.buffer += texto
+        prontos = []
+
+        while True:
+            corte = None
+            for match in self.padrao.finditer(self.buffer):
+                if match.end() >= self.min_chars:
+                    corte = match.end()
+                    break
+            if corte is None:
+                break
+
+            trecho = self.buffer[:corte].strip()
+            self.buffer = self.buffer[corte:]
+            if trecho:
+                prontos.append(trecho)
+
+        return prontos
+
+    def finalizar(self) -> Optional[str]:
+        """Retorna o texto restante no buffer"""
+        restante = self.buffer.strip()
+        self.buffer = ""
+        return restante or None
+
+
 class RAGService:
     def __init__(self, qdrant_url: str, ollama_url: str, embeddings_model: str, llm_model: str):
         self.qdrant_url = qdrant_url
         self.ollama_url = ollama_url
         self.embeddings_model = embeddings_model
         self.llm_model = llm_model
-        self.qdrant_client = QdrantClient(url=qdrant_url)
+        self.qdrant_client = _get_qdrant_client(qdrant_url)
 
         # Buscar configurações do banco
         chunk_size = get_rag_chunk_size()
@@ -45,13 +144,44 @@ class RAGService:
         """Retorna nome da coleção para um número de telefone"""
         return f"kb_{phone_number}"
 
+    def _marcar_colecao(self, collection_name: str, existe: bool):
+        """Grava a existência da coleção no cache"""
+        ttl = COLLECTION_CACHE_TTL if existe else COLLECTION_CACHE_TTL_NEGATIVO
+        with _colecoes_lock:
+            _colecoes[(self.qdrant_url, collection_name)] = (existe, time.time() + ttl)
+
+    def collection_exists(self, phone_number: str) -> bool:
+        """
+        Verifica se a coleção existe, com cache por TTL
+
+        Em cache miss consulta apenas a coleção (get_collection) em vez de
+        listar todas as coleções do Qdrant.
+        """
+        collection_name = self.get_collection_name(phone_number)
+
+        with _colecoes_lock:
+            cacheado = _colecoes.get((self.qdrant_url, collection_name))
+        if cacheado and cacheado[1] > time.time():
+            return cacheado[0]
+
+        try:
+            self.qdrant_client.get_collection(collection_name)
+            existe = True
+        except Exception as e:
+            # Qdrant responde 404 para coleção inexistente; outros erros não são cacheados
+            if "not found" not in str(e).lower() and "404" not in str(e):
+                raise
+            existe = False
+
+        self._marcar_colecao(collection_name, existe)
+        return existe
+
     def create_collection_if_not_exists(self, phone_number: str, vector_size: int = 384):
         """Cria coleção no Qdrant se não existir"""
         collection_name = self.get_collection_name(phone_number)
 
         try:
-            collections = self.qdrant_client.get_collections().collections
-            exists = any(c.name == collection_name for c in collections)
+            exists = self.collection_exists(phone_number)
 
             if not exists:
                 self.qdrant_client.create_collection(
@@ -61,27 +191,209 @@ class RAGService:
                 print(f"✅ Coleção criada: {collection_name}")
             else:
                 print(f"ℹ️  Coleção já existe: {collection_name}")
+
+            # Índice de payload para filtrar/deletar por documento
+            # (idempotente; também cobre coleções criadas antes do índice)
+            self.qdrant_client.create_payload_index(
+                collection_name=collection_name,
+                field_name="file_name",
+                field_schema=PayloadSchemaType.KEYWORD
+            )
+            self._marcar_colecao(collection_name, True)
         except Exception as e:
             print(f"❌ Erro ao criar coleção: {e}")
             raise
 
-    def generate_embedding(self, text: str) -> List[float]:
-        """Gera embedding usando Ollama"""
+    @staticmethod
+    def get_point_id(phone_number: str, file_name: str, chunk_index: int, chunk: str) -> str:
+        """
+        ID estável (UUIDv5) de um chunk no Qdrant
+
+        Reenviar o mesmo arquivo sobrescreve os mesmos pontos em vez de
+        duplicá-los (hash() do Python muda a cada reinício do processo).
+        """
+        content_hash = hashlib.sha256(chunk.encode("utf-8")).hexdigest()
+        return str(uuid.uuid5(POINT_ID_NAMESPACE, f"{phone_number}/{file_name}/{chunk_index}/{content_hash}"))
+
+    def delete_document_vectors(self, phone_number: str, file_name: str, keep_ids: Optional[List[str]] = None):
+        """
+        Remove os vetores de um documento (filtro por file_name)
+
+        Args:
+            phone_number: Identificador da base (nome da instância)
+            file_name: Nome do arquivo
+            keep_ids: IDs que devem ser mantidos (pontos recém-gravados do documento)
+        """
+        collection_name = self.get_collection_name(phone_number)
+
+        filtro = Filter(
+            must=[FieldCondition(key="file_name", match=MatchValue(value=file_name))],
+            must_not=[HasIdCondition(has_id=keep_ids)] if keep_ids else None
+        )
+
         try:
-            response = requests.post(
-                f"{self.ollama_url}/api/embeddings",
-                json={
-                    "model": self.embeddings_model,
-                    "prompt": text
-                },
-                timeout=30
+            self.qdrant_client.delete(
+                collection_name=collection_name,
+                points_selector=FilterSelector(filter=filtro)
             )
+            print(f"🗑️  Vetores removidos: {file_name} ({collection_name})")
+        except Exception as e:
+            print(f"⚠️  Erro ao remover vetores de {file_name}: {e}")
+
+        answer_cache.invalidar_instancia(phone_number)
+
+    def generate_embedding(self, text: str, tenant: str = "") -> List[float]:
+        """
+        Gera embedding de consulta usando Ollama (consulta o cache de embeddings antes)
+
+        Args:
+            text: Texto
+            tenant: Instância que originou a chamada (escalonador do Ollama)
+        """
+        embedding = embedding_cache.buscar(self.embeddings_model, text)
+        if embedding is not None:
+            _embedding_dimensions.setdefault(self.embeddings_model, len(embedding))
+            return embedding
+
+        embedding = self._generate_embedding_ollama(text, PRIORIDADE_CONSULTA, tenant)
+        embedding_cache.gravar(self.embeddings_model, text, embedding)
+        return embedding
+
+    def _generate_embedding_ollama(self, text: str, prioridade: int = PRIORIDADE_CONSULTA, tenant: str = "") -> List[float]:
+        """Uma chamada a /api/embeddings (sem cache)"""
+        try:
+            with ollama_scheduler.slot(self.embeddings_model, prioridade, tenant):
+                response = requests.post(
+                    f"{self.ollama_url}/api/embeddings",
+                    json={
+                        "model": self.embeddings_model,
+                        "prompt": text
+                    },
+                    timeout=30
+                )
             response.raise_for_status()
-            return response.json()["embedding"]
+            embedding = response.json()["embedding"]
+            _embedding_dimensions.setdefault(self.embeddings_model, len(embedding))
+            return embedding
         except Exception as e:
             print(f"❌ Erro ao gerar embedding: {e}")
             raise
 
+    def generate_embeddings(
+        self,
+        texts: List[str],
+        on_progress: Optional[Callable[[int], None]] = None,
+        tenant: str = ""
+    ) -> List[List[float]]:
+        """
+        Gera embeddings de vários textos
+
+        Textos já presentes no cache de embeddings não vão ao Ollama. Os
+        demais usam o endpoint em lote do Ollama (/api/embed com lista em
+        "input"). Se o servidor não suportar lote, cai para /api/embeddings
+        com concorrência limitada (EMBEDDING_CONCURRENCY).
+
+        Usado na ingestão: as chamadas entram na lane de menor prioridade
+        do escalonador do Ollama.
+
+        Args:
+            texts: Textos
+            on_progress: Chamado após cada lote com o total de textos já processados
+            tenant: Instância dona do documento
+        """
+        if not texts:
+            return []
+
+        cacheados = embedding_cache.buscar_varios(self.embeddings_model, texts)
+        if cacheados:
+            _embedding_dimensions.setdefault(self.embeddings_model, len(next(iter(cacheados.values()))))
+            print(f"♻️  {len(cacheados)}/{len(texts)} embeddings reaproveitados do cache")
+
+        faltantes = [i for i in range(len(texts)) if i not in cacheados]
+        novos = self._generate_embeddings_sem_cache(
+            [texts[i] for i in faltantes],
+            on_progress=(lambda feitos: on_progress(len(cacheados) + feitos)) if on_progress else None,
+            tenant=tenant
+        )
+        embedding_cache.gravar_varios(self.embeddings_model, [texts[i] for i in faltantes], novos)
+
+        embeddings = [None] * len(texts)
+        for i, embedding in cacheados.items():
+            embeddings[i] = embedding
+        for i, embedding in zip(faltantes, novos):
+            embeddings[i] = embedding
+
+        if on_progress:
+            on_progress(len(texts))
+        return embeddings
+
+    def _generate_embeddings_sem_cache(
+        self,
+        texts: List[str],
+        on_progress: Optional[Callable[[int], None]] = None,
+        tenant: str = ""
+    ) -> List[List[float]]:
+        """Gera embeddings no Ollama em lotes de EMBEDDING_BATCH_SIZE"""
+        embeddings = []
+        for inicio in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+            lote = texts[inicio:inicio + EMBEDDING_BATCH_SIZE]
+
+            gerado = False
+            if _embed_batch_support.get(self.ollama_url, True):
+                try:
+                    embeddings.extend(self._generate_embeddings_batch(lote, tenant))
+                    gerado = True
+                except _BatchNaoSuportado:
+                    print("ℹ️  Ollama sem /api/embed, usando embeddings individuais")
+                    _embed_batch_support[self.ollama_url] = False
+
+            if not gerado:
+                with ThreadPoolExecutor(max_workers=EMBEDDING_CONCURRENCY) as executor:
+                    embeddings.extend(executor.map(
+                        lambda texto: self._generate_embedding_ollama(texto, PRIORIDADE_INGESTAO, tenant),
+                        lote
+                    ))
+
+            if on_progress:
+                on_progress(len(embeddings))
+
+        return embeddings
+
+    def _generate_embeddings_batch(self, texts: List[str], tenant: str = "") -> List[List[float]]:
+        """Uma chamada a /api/embed para um lote de textos"""
+        try:
+            with ollama_scheduler.slot(self.embeddings_model, PRIORIDADE_INGESTAO, tenant):
+                response = requests.post(
+                    f"{self.ollama_url}/api/embed",
+                    json={
+                        "model": self.embeddings_model,
+                        "input": texts
+                    },
+                    timeout=30 + 2 * len(texts)
+                )
+            if response.status_code == 404 and "model" not in response.text.lower():
+                raise _BatchNaoSuportado()
+            response.raise_for_status()
+
+            embeddings = response.json()["embeddings"]
+            if len(embeddings) != len(texts):
+                raise ValueError(f"Ollama retornou {len(embeddings)} embeddings para {len(texts)} textos")
+
+            if embeddings:
+                _embedding_dimensions.setdefault(self.embeddings_model, len(embeddings[0]))
+            return embeddings
+        except _BatchNaoSuportado:
+            raise
+        except Exception as e:
+            print(f"❌ Erro ao gerar embeddings em lote: {e}")
+            raise
+
+    def get_embedding_dimension(self) -> int:
+        """Dimensão dos vetores do modelo de embeddings (cacheada por modelo)"""
+        if self.embeddings_model not in _embedding_dimensions:
+            self.generate_embedding("dimensão")
+        return _embedding_dimensions[self.embeddings_model]
+
     def extract_text_from_file(self, file_path: str) -> str:
         """Extrai texto de PDF, DOCX ou TXT"""
         file_path = Path(file_path)
@@ -115,44 +427,77 @@ class RAGService:
             print(f"❌ Erro ao extrair texto de {file_path}: {e}")
             raise
 
-    def vectorize_document(self, phone_number: str, file_path: str, metadata: Optional[Dict] = None) -> int:
-        """Vetoriza um documento e armazena no Qdrant"""
+    def vectorize_document(
+        self,
+        phone_number: str,
+        file_path: str,
+        metadata: Optional[Dict] = None,
+        progress_callback: Optional[Callable[[str, int, int], None]] = None
+    ) -> int:
+        """
+        Vetoriza um documento e armazena no Qdrant
+
+        Args:
+            phone_number: Identificador da base (nome da instância)
+            file_path: Caminho do arquivo
+            metadata: Metadados gravados em cada chunk
+            progress_callback: Recebe (etapa, chunks_processados, chunks_total)
+        """
         print(f"📄 Vetorizando documento: {file_path}")
 
+        def progresso(etapa: str, processados: int, total: int):
+            if progress_callback:
+                progress_callback(etapa, processados, total)
+
         # Extrair texto
+        progresso("extraindo texto", 0, 0)
         text = self.extract_text_from_file(file_path)
 
         # Dividir em chunks
         chunks = self.text_splitter.split_text(text)
         print(f"📝 Documento dividido em {len(chunks)} chunks")
 
-        # Criar coleção se não existir
-        if chunks:
-            # Gerar embedding de exemplo para descobrir dimensão
-            sample_embedding = self.generate_embedding(chunks[0])
-            self.create_collection_if_not_exists(phone_number, vector_size=len(sample_embedding))
+        # Indexar texto para a busca textual (evita reabrir o arquivo a cada pergunta)
+        text_index.indexar_documento(phone_number, Path(file_path).name, chunks, Path(file_path).stat().st_mtime)
+
+        if not chunks:
+            # Documento reenviado sem texto: remover vetores da versão anterior
+            self.delete_document_vectors(phone_number, Path(file_path).name)
+            return 0
+
+        # Vetorizar chunks em lote
+        progresso("gerando embeddings", 0, len(chunks))
+        embeddings = self.generate_embeddings(
+            chunks,
+            on_progress=lambda feitos: progresso("gerando embeddings", feitos, len(chunks)),
+            tenant=phone_number
+        )
+
+        # Criar coleção se não existir (dimensão cacheada por modelo)
+        self.create_collection_if_not_exists(phone_number, vector_size=self.get_embedding_dimension())
 
         collection_name = self.get_collection_name(phone_number)
 
-        # Vetorizar e armazenar chunks
-        points = []
-        for i, chunk in enumerate(chunks):
-            embedding = self.generate_embedding(chunk)
+        file_name = Path(file_path).name
 
+        # Montar pontos
+        points = []
+        for i, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
             point_metadata = {
                 "text": chunk,
-                "file_name": Path(file_path).name,
+                "file_name": file_name,
                 "chunk_index": i,
                 **(metadata or {})
             }
 
             points.append(PointStruct(
-                id=hash(f"{phone_number}_{Path(file_path).name}_{i}") & 0x7FFFFFFF,
+                id=self.get_point_id(phone_number, file_name, i, chunk),
                 vector=embedding,
                 payload=point_metadata
             ))
 
         # Inserir no Qdrant
+        progresso("gravando no Qdrant", len(chunks), len(chunks))
         if points:
             self.qdrant_client.upsert(
                 collection_name=collection_name,
@@ -160,14 +505,78 @@ class RAGService:
             )
             print(f"✅ {len(points)} chunks vetorizados e armazenados")
 
+            # Remover chunks de uma versão anterior do mesmo arquivo
+            self.delete_document_vectors(phone_number, file_name, keep_ids=[p.id for p in points])
+
+        # Base mudou: respostas cacheadas podem estar desatualizadas
+        answer_cache.invalidar_instancia(phone_number)
+
         return len(chunks)
 
-    def _search_by_text(self, phone_number: str, query: str, storage_path: Path) -> List[Dict]:
-        """Busca textual direta nos arquivos (mais rápida para termos específicos)"""
+    def _pendencias_indice_textual(self, phone_number: str, storage_path: Path, ignorar: Optional[set] = None):
+        """
+        Compara os arquivos da pasta com o índice textual (só stat, sem abrir arquivos)
+
+        Args:
+            ignorar: Nomes de arquivos a não indexar agora (ex: ingestão em andamento)
+
+        Returns:
+            (arquivos a indexar [(Path, mtime)], nomes a remover do índice)
+        """
+        if not storage_path.exists():
+            return [], set()
+
+        indexados = text_index.documentos_indexados(phone_number)
+        falhas = text_index.falhas_registradas(phone_number)
+        ignorar = ignorar or set()
+        no_disco = set()
+        a_indexar = []
+
+        for file_path in storage_path.iterdir():
+            if not file_path.is_file():
+                continue
+            no_disco.add(file_path.name)
+            if file_path.name in ignorar:
+                continue
+
+            mtime = file_path.stat().st_mtime
+            # Indexado ou com falha registrada nesta mesma versão do arquivo
+            if indexados.get(file_path.name) != mtime and falhas.get(file_path.name) != mtime:
+                a_indexar.append((file_path, mtime))
+
+        return a_indexar, (set(indexados) - no_disco) - ignorar
+
+    def sincronizar_indice_textual(self, phone_number: str, storage_path: Path, ignorar: Optional[set] = None) -> int:
+        """
+        Indexa arquivos ainda fora do índice textual (ex: enviados antes do
+        índice existir). Roda em segundo plano (ver ingestion_jobs), nunca
+        no caminho da pergunta.
+
+        Returns:
+            Número de arquivos indexados
+        """
+        a_indexar, removidos = self._pendencias_indice_textual(phone_number, storage_path, ignorar)
+        indexados = 0
+
+        for file_path, mtime in a_indexar:
+            try:
+                chunks = self.text_splitter.split_text(self.extract_text_from_file(str(file_path)))
+                text_index.indexar_documento(phone_number, file_path.name, chunks, mtime)
+                indexados += 1
+                print(f"📇 Índice textual atualizado: {file_path.name} ({len(chunks)} chunks)")
+            except Exception as e:
+                # Não tentar de novo até o arquivo mudar
+                text_index.registrar_falha(phone_number, file_path.name, mtime, str(e))
+                print(f"⚠️ Erro ao indexar {file_path.name}: {e}")
+
+        for file_name in removidos:
+            text_index.remover_documento(phone_number, file_name)
+
+        return indexados
+
+    def _search_by_text(self, phone_number: str, query: str) -> List[Dict]:
+        """Busca textual no índice de chunks (mais rápida para termos específicos)"""
         try:
-            import re
-
-            results = []
             query_lower = query.lower()
 
             # Extrair palavras-chave da query (remover stopwords)
@@ -178,92 +587,71 @@ class RAGService:
             if not keywords:
                 return []
 
-            # Buscar em todos os arquivos da pasta
-            if not storage_path.exists():
-                return []
-
-            for file_path in storage_path.iterdir():
-                if not file_path.is_file():
-                    continue
-
-                try:
-                    # Extrair texto do arquivo
-                    text = self.extract_text_from_file(str(file_path))
-                    text_lower = text.lower()
-
-                    # Normalizar espaços
-                    text_norm = re.sub(r'\s+', ' ', text_lower)
-                    query_norm = re.sub(r'\s+', ' ', query_lower)
-
-                    # Buscar por frase exata ou palavras-chave
-                    found = False
-                    search_pos = -1
-
-                    if query_norm in text_norm:
-                        found = True
-                        search_pos = text_norm.find(query_norm)
-                    else:
-                        # Buscar por combinações de 2 palavras
-                        for i in range(len(keywords)-1):
-                            bigram = f"{keywords[i]} {keywords[i+1]}"
-                            if bigram in text_norm:
-                                found = True
-                                search_pos = text_norm.find(bigram)
-                                break
-
-                        # Se não encontrou, buscar palavra individual
-                        if not found:
-                            for keyword in keywords:
-                                if keyword in text_norm:
-                                    found = True
-                                    search_pos = text_norm.find(keyword)
-                                    break
-
-                    if found and search_pos >= 0:
-                        # Extrair contexto
-                        start = max(0, search_pos - 500)
-                        end = min(len(text), search_pos + 1500)
-                        context = text[start:end]
-
-                        results.append({
-                            "text": context,
-                            "score": 0.95,
-                            "file_name": file_path.name,
-                            "metadata": {
-                                "source": "text_search",
-                                "file_name": file_path.name
-                            }
-                        })
-                except Exception as e:
-                    print(f"⚠️ Erro ao buscar em {file_path.name}: {e}")
-                    continue
+            results = []
+            for hit in text_index.buscar(phone_number, query, keywords, limite=10):
+                results.append({
+                    "text": hit["text"],
+                    "score": 0.95,
+                    "file_name": hit["file_name"],
+                    "metadata": {
+                        "source": "text_search",
+                        "file_name": hit["file_name"],
+                        "chunk_index": hit["chunk_index"]
+                    }
+                })
 
             if results:
-                print(f"✅ Busca textual RÁPIDA: {len(results)} arquivo(s)")
-            return results[:10]
+                print(f"✅ Busca textual RÁPIDA: {len(results)} chunk(s)")
+            return results
 
         except Exception as e:
             print(f"❌ Erro na busca textual: {e}")
             return []
 
+    @staticmethod
+    def _is_specific_query(query: str) -> bool:
+        """Detecta se é pergunta específica que pode se beneficiar de busca textual"""
+        query_lower = query.lower()
+        return any(term in query_lower for term in [
+            'qual', 'quais', 'como', 'onde', 'quando', 'quanto', 'quem',
+            'mostre', 'liste', 'busque', 'encontre', 'procure'
+        ]) and len(query.split()) <= 10
+
+    @staticmethod
+    def _format_points(results) -> List[Dict]:
+        """Formata pontos retornados pelo Qdrant"""
+        return [
+            {
+                "text": result.payload.get("text", ""),
+                "score": result.score,
+                "file_name": result.payload.get("file_name", ""),
+                "metadata": result.payload
+            }
+            for result in results
+        ]
+
+    @staticmethod
+    def _combine_results(text_results: List[Dict], search_results: List[Dict], limit: int) -> List[Dict]:
+        """Combina resultados textuais (prioridade) com vetoriais, sem duplicatas"""
+        seen_texts = set()
+        unique_results = []
+        for result in text_results + search_results:
+            text_hash = hash(result["text"][:100])  # Hash dos primeiros 100 chars
+            if text_hash not in seen_texts:
+                seen_texts.add(text_hash)
+                unique_results.append(result)
+
+        return unique_results[:limit]
+
     def search(self, phone_number: str, query: str, limit: int = 50) -> List[Dict]:
         """Busca híbrida: textual (rápida) + semântica (precisa)"""
         collection_name = self.get_collection_name(phone_number)
 
         # Tentar busca textual primeiro para queries específicas
-        storage_path = Path("storage/knowledge_base") / phone_number
-
-        # Detectar se é pergunta específica que pode se beneficiar de busca textual
-        query_lower = query.lower()
-        is_specific_query = any(term in query_lower for term in [
-            'qual', 'quais', 'como', 'onde', 'quando', 'quanto', 'quem',
-            'mostre', 'liste', 'busque', 'encontre', 'procure'
-        ])
-
         text_results = []
-        if is_specific_query and len(query.split()) <= 10:
+        if self._is_specific_query(query):
             print("🔍 Tentando busca textual rápida primeiro...")
-            text_results = self._search_by_text(phone_number, query, storage_path)
+            text_results = self._search_by_text(phone_number, query)
 
             # Se encontrou resultados bons na busca textual, retornar
             if len(text_results) >= 3:
@@ -271,16 +659,13 @@ class RAGService:
                 return text_results
 
         try:
-            # Verificar se coleção existe
-            collections = self.qdrant_client.get_collections().collections
-            exists = any(c.name == collection_name for c in collections)
-
-            if not exists:
+            # Verificar se coleção existe (cacheado)
+            if not self.collection_exists(phone_number):
                 print(f"⚠️  Coleção não encontrada: {collection_name}")
                 return text_results  # Retornar resultados textuais se houver
 
             # Gerar embedding da query
-            query_embedding = self.generate_embedding(query)
+            query_embedding = self.generate_embedding(query, tenant=phone_number)
 
             # Buscar no Qdrant com limite maior
             print(f"🔍 Buscando {limit} chunks no Qdrant...")
@@ -290,36 +675,14 @@ class RAGService:
                 limit=limit
             )
 
-            # Formatar resultados
-            search_results = []
-            for result in results:
-                search_results.append({
-                    "text": result.payload.get("text", ""),
-                    "score": result.score,
-                    "file_name": result.payload.get("file_name", ""),
-                    "metadata": result.payload
-                })
-
-            # Combinar resultados textuais (prioridade) com vetoriais
-            combined_results = text_results + search_results
-
-            # Remover duplicatas mantendo os de maior score
-            seen_texts = set()
-            unique_results = []
-            for result in combined_results:
-                text_hash = hash(result["text"][:100])  # Hash dos primeiros 100 chars
-                if text_hash not in seen_texts:
-                    seen_texts.add(text_hash)
-                    unique_results.append(result)
-
-            return unique_results[:limit]
+            return self._combine_results(text_results, self._format_points(results), limit)
 
         except Exception as e:
             print(f"❌ Erro na busca vetorial: {e}")
             return text_results  # Retornar resultados textuais como fallback
 
-    def generate_response(self, phone_number: str, question: str, context_results: List[Dict]) -> str:
-        """Gera resposta usando LLM com contexto RAG"""
+    def _build_prompt(self, question: str, context_results: List[Dict]) -> str:
+        """Monta o prompt do LLM com o contexto RAG"""
         # Montar contexto
         context = "\n\n".join([
             f"[Fonte: {r['file_name']}]\n{r['text']}"
@@ -374,56 +737,77 @@ INSTRUÇÕES:
 
 RESPOSTA:"""
 
+        return prompt
+
+    def _generation_payload(self, prompt: str, stream: bool) -> Dict:
+        """Corpo da chamada a /api/generate (opções vindas do banco)"""
+        return {
+            "model": self.llm_model,
+            "prompt": prompt,
+            "stream": stream,
+            "options": {
+                "num_predict": get_rag_num_predict(),
+                "temperature": get_rag_temperature(),
+                "top_p": get_rag_top_p()
+            }
+        }
+
+    def generate_response(self, phone_number: str, question: str, context_results: List[Dict]) -> str:
+        """Gera resposta usando LLM com contexto RAG"""
+        prompt = self._build_prompt(question, context_results)
+
         try:
-            # Buscar configurações do banco
-            num_predict = get_rag_num_predict()
-            temperature = get_rag_temperature()
-            top_p = get_rag_top_p()
-
-            response = requests.post(
-                f"{self.ollama_url}/api/generate",
-                json={
-                    "model": self.llm_model,
-                    "prompt": prompt,
-                    "stream": False,
-                    "options": {
-                        "num_predict": num_predict,
-                        "temperature": temperature,
-                        "top_p": top_p
-                    }
-                },
-                timeout=120  # Aumentado para 120 segundos (queries complexas)
-            )
+            with ollama_scheduler.slot(self.llm_model, PRIORIDADE_GERACAO, phone_number):
+                response = requests.post(
+                    f"{self.ollama_url}/api/generate",
+                    json=self._generation_payload(prompt, stream=False),
+                    timeout=120  # Aumentado para 120 segundos (queries complexas)
+                )
             response.raise_for_status()
             answer = response.json().get("response", "").strip()
 
             # Adicionar mensagem para falar com atendente
-            answer += "\n\n_Para falar com um atendente humano, digite *atendente*._"
+            answer += RODAPE_ATENDENTE
 
             return answer
 
         except Exception as e:
             print(f"❌ Erro ao gerar resposta: {e}")
-            return "Desculpe, ocorreu um erro ao processar sua pergunta. Por favor, entre em contato com um atendente."
+            return MSG_ERRO_RESPOSTA
 
     def process_question(self, phone_number: str, question: str) -> str:
         """Pipeline completo: busca + geração de resposta"""
         print(f"🤔 Processando pergunta: {question}")
 
+        # Pergunta repetida (idêntica ou semanticamente próxima)
+        cached = answer_cache.buscar(phone_number, question, lambda q: self.generate_embedding(q, phone_number))
+        if cached:
+            return cached
+
         # Buscar contexto relevante (usando configuração do banco)
         search_limit = get_rag_search_limit()
         results = self.search(phone_number, question, limit=search_limit)
 
         if not results:
-            return "Ainda não tenho informações suficientes para responder. Por favor, entre em contato com um atendente digitando *atendente*."
+            return MSG_SEM_CONTEXTO
 
         print(f"📚 Encontrados {len(results)} documentos relevantes")
 
         # Gerar resposta
         answer = self.generate_response(phone_number, question, results)
 
+        if answer != MSG_ERRO_RESPOSTA:
+            self._cache_answer(phone_number, question, answer)
+
         return answer
 
+    def _cache_answer(self, phone_number: str, question: str, answer: str):
+        """Grava a resposta no cache de respostas (com o embedding da pergunta)"""
+        try:
+            answer_cache.gravar(phone_number, question, answer, self.generate_embedding(question, phone_number))
+        except Exception as e:
+            print(f"⚠️ Erro ao gravar resposta no cache: {e}")
+
     def delete_knowledge_base(self, phone_number: str):
         """Deleta toda a base de conhecimento de um número"""
         collection_name = self.get_collection_name(phone_number)
@@ -434,6 +818,12 @@ RESPOSTA:"""
         except Exception as e:
             print(f"⚠️  Erro ao deletar coleção: {e}")
 
+        with _colecoes_lock:
+            _colecoes.pop((self.qdrant_url, collection_name), None)
+
+        text_index.remover_indice(phone_number)
+        answer_cache.invalidar_instancia(phone_number)
+
     def list_documents(self, phone_number: str) -> List[str]:
         """Lista documentos vetorizados para um número"""
         collection_name = self.get_collection_name(phone_number)
@@ -0,0 +1,364 @@
+"""
+Tabela de roteamento compilada por pedido (respostas rápidas e menus)
+- Compilada uma vez por versão da configuração do agente (ao salvar ou na
+  primeira mensagem depois de uma alteração feita por outro processo)
+- Palavras-chave das respostas rápidas já normalizadas, em autômato
+  Aho-Corasick: uma única passada pela mensagem encontra todas
+- Opções de menu escolhidas por token exato (número em dict, palavras do
+  título em índice invertido), com aproximação ranqueada para erros de digitação
+- Submenus decodificados na compilação (sem json.loads por mensagem)
+"""
+import re
+import json
+import bisect
+import difflib
+import threading
+import unicodedata
+from collections import deque
+from typing import Dict, List, Optional, Set, Tuple
+
+
+SAUDACOES = ['oi', 'ola', 'bom dia', 'boa tarde', 'boa noite', 'opa', 'olá', 'eai', 'e ai']
+
+_ERRO_SUBMENU = object()  # submenu com JSON inválido
+
+# Palavras ignoradas ao comparar a mensagem com o título da opção
+STOPWORDS = {'a', 'o', 'as', 'os', 'e', 'de', 'da', 'do', 'das', 'dos', 'em', 'no', 'na',
+             'para', 'pra', 'com', 'um', 'uma', 'por', 'meu', 'minha', 'quero', 'ver'}
+
+# Comandos de navegação ("menu", "voltar", "voltar ao menu principal"): a
+# mensagem só pode ter essas palavras, para "cardápio do menu" não resetar o menu
+PALAVRAS_NAVEGACAO = {'voltar', 'menu'}
+COMPLEMENTOS_NAVEGACAO = {'ao', 'principal', 'inicio', 'opcoes', 'favor'}
+
+# Número de opção só vale em mensagens curtas ("2", "opção 2", "quero a 2");
+# telefones, preços e datas em frases maiores não escolhem opções
+MAX_TOKENS_NUMERO = 3
+SIMILARIDADE_MINIMA = 0.8   # aproximação por token (difflib), para erros de digitação
+TAMANHO_MINIMO_APROXIMADO = 4
+_RE_TOKEN = re.compile(r"\w+")
+_RE_NUMERO_COMPOSTO = re.compile(r"\d[.,:/-]\d")
+
+
+def normalizar(text: str) -> str:
+    """Remove acentos e normaliza texto para busca inteligente"""
+    if not text:
+        return ""
+    # Normalizar unicode e remover acentos
+    nfkd = unicodedata.normalize('NFD', text.lower())
+    return ''.join([c for c in nfkd if not unicodedata.combining(c)])
+
+
+SAUDACOES_NORMALIZADAS = tuple(dict.fromkeys(normalizar(s) for s in SAUDACOES))
+
+
+class MensagemTokenizada:
+    """Mensagem preparada uma única vez para todos os casamentos"""
+
+    def __init__(self, texto: str):
+        self.texto = texto or ""
+        self.normalizado = normalizar(self.texto)
+        self.tokens = _RE_TOKEN.findall(self.normalizado)
+        self.palavras = [t for t in self.tokens if not t.isdigit() and t not in STOPWORDS]
+        self.numeros = [t for t in self.tokens if t.isdigit()]
+        # Preço, data, hora ou telefone formatado ("2,50", "10/05", "14:30")
+        self.numero_composto = bool(_RE_NUMERO_COMPOSTO.search(self.texto))
+        self.exata = " ".join(self.tokens)
+
+    def pediu_navegacao(self) -> bool:
+        """Mensagem é um comando de voltar ao menu (token exato, sem outras palavras)"""
+        return bool(PALAVRAS_NAVEGACAO.intersection(self.palavras)) and all(
+            p in PALAVRAS_NAVEGACAO or p in COMPLEMENTOS_NAVEGACAO for p in self.palavras
+        )
+
+    def numero_escolhido(self) -> Optional[str]:
+        """Número isolado em mensagem curta (candidato a opção de menu)"""
+        if len(self.numeros) == 1 and len(self.tokens) <= MAX_TOKENS_NUMERO and not self.numero_composto:
+            return self.numeros[0].lstrip("0") or "0"
+        return None
+
+
+def tokenizar(texto: str) -> MensagemTokenizada:
+    """Tokeniza a mensagem (chamar uma vez por mensagem)"""
+    return MensagemTokenizada(texto)
+
+
+class AhoCorasick:
+    """Autômato para encontrar vários padrões de uma vez (índice do padrão = prioridade)"""
+
+    def __init__(self, padroes: List[str]):
+        self.goto: List[Dict[str, int]] = [{}]
+        self.falha: List[int] = [0]
+        self.saida: List[List[int]] = [[]]
+        # Padrão vazio está contido em qualquer texto
+        self.sempre = [i for i, p in enumerate(padroes) if p == ""]
+
+        for indice, padrao in enumerate(padroes):
+            if not padrao:
+                continue
+            no = 0
+            for c in padrao:
+                proximo = self.goto[no].get(c)
+                if proximo is None:
+                    proximo = len(self.goto)
+                    self.goto.append({})
+                    self.falha.append(0)
+                    self.saida.append([])
+                    self.goto[no][c] = proximo
+                no = proximo
+            self.saida[no].append(indice)
+
+        # Links de falha em largura (filhos da raiz falham para a raiz)
+        fila = deque(self.goto[0].values())
+        while fila:
+            no = fila.popleft()
+            for c, filho in self.goto[no].items():
+                fila.append(filho)
+                f = self.falha[no]
+                while f and c not in self.goto[f]:
+                    f = self.falha[f]
+                destino = self.goto[f].get(c, 0)
+                self.falha[filho] = destino if destino != filho else 0
+                self.saida[filho] = self.saida[filho] + self.saida[self.falha[filho]]
+
+    def encontrar(self, texto: str) -> Set[int]:
+        """Índices de todos os padrões contidos no texto"""
+        encontrados = set(self.sempre)
+        goto, falha, saida = self.goto, self.falha, self.saida
+        no = 0
+        for c in texto:
+            while no and c not in goto[no]:
+                no = falha[no]
+            no = goto[no].get(c, 0)
+            if saida[no]:
+                encontrados.update(saida[no])
+        return encontrados
+
+
+class MenuCompilado:
+    """Opções de um menu (principal ou submenu) prontas para casar com a mensagem"""
+
+    def __init__(self, opcoes: List[Dict], titulo: str = ""):
+        self.opcoes = opcoes
+        self.titulo = titulo
+
+        # Número da opção "pergunta rápida" (próximo número livre)
+        numeros_usados = [int(op.get('numero', 0)) for op in opcoes if op.get('numero', '').isdigit()]
+        self.numero_pergunta_rapida = str(max(numeros_usados) + 1 if numeros_usados else len(opcoes) + 1)
+
+        # Número da opção -> índice (primeira opção com o número vence)
+        self.por_numero: Dict[str, int] = {}
+        # Texto completo da opção ("2", "financeiro", "2 financeiro") -> índice
+        self.por_texto: Dict[str, int] = {}
+        # Palavras significativas do título e índice invertido palavra -> opções
+        self.palavras_titulo: List[Set[str]] = []
+        self.indice_palavras: Dict[str, Set[int]] = {}
+
+        for i, opcao in enumerate(opcoes):
+            numero = " ".join(_RE_TOKEN.findall(normalizar(str(opcao.get('numero', '')))))
+            if numero.isdigit():
+                self.por_numero.setdefault(numero.lstrip("0") or "0", i)
+
+            titulo_tokens = _RE_TOKEN.findall(normalizar(opcao.get('titulo', '')))
+            for texto in (numero, " ".join(titulo_tokens), f"{numero} {' '.join(titulo_tokens)}".strip()):
+                if texto:
+                    self.por_texto.setdefault(texto, i)
+
+            palavras = {t for t in titulo_tokens if not t.isdigit() and t not in STOPWORDS}
+            self.palavras_titulo.append(palavras)
+            for palavra in palavras:
+                self.indice_palavras.setdefault(palavra, set()).add(i)
+
+        self._vocabulario = list(self.indice_palavras)
+
+        # Submenus decodificados uma vez
+        self.submenus: Dict[int, object] = {}
+        for i, opcao in enumerate(opcoes):
+            if opcao.get('acao', 'resposta') != 'submenu':
+                continue
+            submenu_json = opcao.get('submenu', '[]')
+            try:
+                self.submenus[i] = json.loads(submenu_json) if isinstance(submenu_json, str) else submenu_json
+            except Exception:
+                self.submenus[i] = _ERRO_SUBMENU
+
+    def pediu_pergunta_rapida(self, mensagem: MensagemTokenizada) -> bool:
+        """Número da opção "pergunta rápida" ou as palavras "pergunta rápida" na mensagem"""
+        return mensagem.numero_escolhido() == self.numero_pergunta_rapida or (
+            'pergunta' in mensagem.normalizado and 'rapida' in mensagem.normalizado
+        )
+
+    def _palavras_aproximadas(self, palavra: str) -> List[Tuple[str, float]]:
+        """Palavras de títulos parecidas com a palavra da mensagem (erros de digitação)"""
+        if len(palavra) < TAMANHO_MINIMO_APROXIMADO:
+            return []
+        resultado = []
+        for candidata in difflib.get_close_matches(palavra, self._vocabulario, n=3, cutoff=SIMILARIDADE_MINIMA):
+            resultado.append((candidata, difflib.SequenceMatcher(None, palavra, candidata).ratio()))
+        return resultado
+
+    def escolhas(self, mensagem: MensagemTokenizada) -> List[int]:
+        """
+        Opções escolhidas pela mensagem, da mais provável para a menos provável
+
+        1. Mensagem igual ao número, ao título ou a "número título" da opção
+        2. Número isolado em mensagem curta ("opção 2")
+        3. Todas as palavras do título presentes na mensagem (token exato)
+        4. Todas as palavras do título presentes com erros de digitação
+        """
+        if mensagem.exata in self.por_texto:
+            return [self.por_texto[mensagem.exata]]
+
+        numero = mensagem.numero_escolhido()
+        if numero is not None and numero in self.por_numero:
+            return [self.por_numero[numero]]
+
+        if not mensagem.palavras or not self.indice_palavras:
+            return []
+
+        # Palavra do título -> similaridade com a mensagem (1.0 = token exato)
+        similaridade: Dict[str, float] = {}
+        for palavra in mensagem.palavras:
+            if palavra in self.indice_palavras:
+                similaridade[palavra] = 1.0
+                continue
+            for candidata, score in self._palavras_aproximadas(palavra):
+                similaridade[candidata] = max(similaridade.get(candidata, 0.0), score)
+
+        candidatas: Set[int] = set()
+        for palavra in similaridade:
+            candidatas |= self.indice_palavras[palavra]
+
+        ranking = []
+        for indice in candidatas:
+            palavras = self.palavras_titulo[indice]
+            if not palavras.issubset(similaridade):
+                continue
+            exatas = sum(1 for p in palavras if similaridade[p] == 1.0)
+            score = sum(similaridade[p] for p in palavras) / len(palavras)
+            # Título todo exato antes de aproximado; depois mais palavras (mais específico)
+            ranking.append((exatas < len(palavras), -score, -len(palavras), indice))
+
+        return [indice for *_, indice in sorted(ranking)]
+
+    def submenu(self, indice: int) -> Optional[List[Dict]]:
+        """
+        Sub-opções já decodificadas da opção
+
+        Raises:
+            ValueError: JSON do submenu inválido
+        """
+        submenu = self.submenus.get(indice)
+        if submenu is _ERRO_SUBMENU:
+            raise ValueError("Submenu com JSON inválido")
+        return submenu
+
+
+class TabelaRoteamento:
+    """Roteamento compilado da configuração do agente de um pedido"""
+
+    def __init__(self, configuracao_agente: Optional[str]):
+        self.versao = configuracao_agente
+
+        config_data = {}
+        if configuracao_agente:
+            try:
+                config_data = json.loads(configuracao_agente)
+            except Exception:
+                config_data = {}
+
+        self.menu_opcoes: List[Dict] = config_data.get('menu', []) or []
+        self.respostas: List[Dict] = config_data.get('respostas', []) or []
+        self.menu = MenuCompilado(self.menu_opcoes)
+        self._submenus_ativos: Dict[str, MenuCompilado] = {}
+        for i, opcao in enumerate(self.menu_opcoes):
+            submenu = self.menu.submenus.get(i)
+            if isinstance(submenu, list) and submenu:
+                titulo = opcao.get('titulo', '')
+                self._submenus_ativos[titulo] = MenuCompilado(submenu, titulo)
+
+        # Respostas rápidas: palavras-chave normalizadas na ordem de prioridade
+        palavras = []
+        self._resposta_da_palavra: List[int] = []
+        for i, resposta in enumerate(self.respostas):
+            for palavra in resposta.get('palavras_chave', []):
+                palavras.append(normalizar(palavra))
+                self._resposta_da_palavra.append(i)
+
+        self._palavras = AhoCorasick(palavras)
+        # Para "mensagem contida na palavra-chave": todas as palavras num único texto
+        self._palavras_concatenadas = "\x00".join(palavras)
+        self._inicio_palavras = []
+        posicao = 0
+        for palavra in palavras:
+            self._inicio_palavras.append(posicao)
+            posicao += len(palavra) + 1
+
+    def eh_saudacao(self, normalized_input: str) -> bool:
+        return normalized_input.startswith(SAUDACOES_NORMALIZADAS)
+
+    def resposta_rapida(self, normalized_input: str) -> Optional[Dict]:
+        """
+        Primeira resposta rápida cuja palavra-chave está na mensagem
+        (ou contém a mensagem)
+        """
+        if not self._resposta_da_palavra:
+            return None
+
+        encontradas = self._palavras.encontrar(normalized_input)
+        melhor = min(encontradas) if encontradas else None
+
+        if "\x00" not in normalized_input:
+            posicao = self._palavras_concatenadas.find(normalized_input)
+            if posicao >= 0:
+                indice = bisect.bisect_right(self._inicio_palavras, posicao) - 1
+                if melhor is None or indice < melhor:
+                    melhor = indice
+
+        if melhor is None:
+            return None
+        return self.respostas[self._resposta_da_palavra[melhor]]
+
+    def submenu_ativo(self, submenu_ativo: Dict) -> MenuCompilado:
+        """Menu compilado do submenu salvo no contexto da conversa"""
+        titulo = submenu_ativo.get('titulo', '')
+        opcoes = submenu_ativo.get('opcoes', [])
+
+        compilado = self._submenus_ativos.get(titulo)
+        if compilado is not None and compilado.opcoes == opcoes:
+            return compilado
+
+        # Contexto salvo com uma versão anterior do menu
+        return MenuCompilado(opcoes, titulo)
+
+
+_tabelas: Dict[int, TabelaRoteamento] = {}
+_lock = threading.Lock()
+
+
+def compilar(pedido_id: int, configuracao_agente: Optional[str]) -> TabelaRoteamento:
+    """Compila e guarda a tabela do pedido (chamar ao salvar a configuração)"""
+    tabela = TabelaRoteamento(configuracao_agente)
+    with _lock:
+        _tabelas[pedido_id] = tabela
+    return tabela
+
+
+def obter(pedido) -> TabelaRoteamento:
+    """
+    Tabela de roteamento do pedido, recompilada apenas se a configuração mudou
+
+    A versão é o próprio JSON salvo: alterações feitas por outro processo
+    (outro worker, painel admin, scripts) também são detectadas.
+    """
+    with _lock:
+        tabela = _tabelas.get(pedido.id)
+    if tabela is not None and tabela.versao == pedido.configuracao_agente:
+        return tabela
+    return compilar(pedido.id, pedido.configuracao_agente)
+
+
+def invalidar(pedido_id: int):
+    """Descarta a tabela do pedido"""
+    with _lock:
+        _tabelas.pop(pedido_id, None)
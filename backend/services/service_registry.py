@@ -0,0 +1,94 @@
+"""
+Registro de serviços de IA por processo
+- RAGService, AsyncRAGService, AudioService e IAHandler são criados uma vez por versão da configuração
+- Reutilizados entre requisições/mensagens (splitter e modelo Whisper aquecidos)
+- Clientes Qdrant são compartilhados por URL entre versões (não vazam a cada troca)
+- Recriados de forma atômica quando ConfiguracaoSistema muda
+"""
+import threading
+from typing import Optional
+
+import config_helper
+from config_helper import get_qdrant_url, get_ollama_url, get_ollama_model, get_ollama_embeddings_model
+from services.rag_service import RAGService
+from services.async_rag_service import AsyncRAGService
+from services.audio_service import AudioService
+
+
+class ServicosIA:
+    """Conjunto de serviços construídos para uma versão da configuração"""
+
+    def __init__(self, versao: tuple, rag_service: RAGService, audio_service: AudioService):
+        from services.ia_handler import IAHandler
+
+        self.versao = versao
+        self.rag_service = rag_service
+        self.async_rag_service = AsyncRAGService(rag_service)
+        self.audio_service = audio_service
+        self.ia_handler = IAHandler(
+            rag_service=rag_service,
+            audio_service=audio_service,
+            async_rag_service=self.async_rag_service
+        )
+
+
+_lock = threading.Lock()
+_servicos: Optional[ServicosIA] = None
+
+
+def _construir_rag_service() -> RAGService:
+    """Cria RAGService com as configurações atuais do sistema"""
+    return RAGService(
+        qdrant_url=get_qdrant_url(),
+        ollama_url=get_ollama_url(),
+        embeddings_model=get_ollama_embeddings_model(),
+        llm_model=get_ollama_model()
+    )
+
+
+def get_servicos() -> ServicosIA:
+    """
+    Retorna os serviços da versão atual da configuração.
+    Se a configuração mudou, constrói um novo conjunto e troca a referência
+    de uma vez; quem já está usando o conjunto antigo termina normalmente.
+    """
+    global _servicos
+
+    versao = config_helper.get_config_version()
+    atual = _servicos
+    if atual is not None and atual.versao == versao:
+        return atual
+
+    with _lock:
+        atual = _servicos
+        if atual is not None and atual.versao == versao:
+            return atual
+
+        print(f"🔧 Construindo serviços de IA (configuração {versao[0]}/{versao[2]})")
+
+        # AudioService não depende da configuração: manter o modelo Whisper já carregado
+        audio_service = atual.audio_service if atual is not None else AudioService()
+
+        novo = ServicosIA(versao, _construir_rag_service(), audio_service)
+        _servicos = novo
+        return novo
+
+
+def get_rag_service() -> RAGService:
+    """RAGService compartilhado"""
+    return get_servicos().rag_service
+
+
+def get_async_rag_service() -> AsyncRAGService:
+    """AsyncRAGService compartilhado"""
+    return get_servicos().async_rag_service
+
+
+def get_audio_service() -> AudioService:
+    """AudioService compartilhado"""
+    return get_servicos().audio_service
+
+
+def get_ia_handler():
+    """IAHandler compartilhado"""
+    return get_servicos().ia_handler
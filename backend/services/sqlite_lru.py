@@ -0,0 +1,188 @@
+"""
+Armazenamento chave-valor em SQLite com descarte LRU
+- Base dos caches persistentes (embeddings, transcrições)
+- Chave: modelo + chave do item; cada leitura atualiza o último uso
+- Limite de entradas verificado a cada ~1% de inserções
+- Contadores de hit/miss e estatísticas para o painel admin
+"""
+import time
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class CacheSQLiteLRU:
+    def __init__(
+        self,
+        caminho: str,
+        tabela: str,
+        coluna_chave: str,
+        coluna_valor: str,
+        tipo_valor: str,
+        max_entradas: int,
+        descricao: str
+    ):
+        """
+        Inicializa o armazenamento (o banco é aberto na primeira operação)
+
+        Args:
+            caminho: Arquivo SQLite
+            tabela: Nome da tabela
+            coluna_chave: Coluna da chave do item (a outra parte da chave é "modelo")
+            coluna_valor: Coluna do valor
+            tipo_valor: Tipo SQLite do valor (TEXT, BLOB)
+            max_entradas: Limite de entradas (as usadas há mais tempo são removidas)
+            descricao: Nome usado nos logs (ex: "embeddings")
+        """
+        self.caminho = caminho
+        self.tabela = tabela
+        self.coluna_chave = coluna_chave
+        self.coluna_valor = coluna_valor
+        self.tipo_valor = tipo_valor
+        self.max_entradas = max_entradas
+        self.descricao = descricao
+
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._conn: Optional[sqlite3.Connection] = None
+        self._insercoes_desde_limpeza = 0
+
+    def _get_conn(self) -> sqlite3.Connection:
+        """Abre o banco (criado na primeira chamada); chamar com o lock"""
+        if self._conn is None:
+            Path(self.caminho).parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.caminho, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS {self.tabela} (
+                    modelo TEXT NOT NULL,
+                    {self.coluna_chave} TEXT NOT NULL,
+                    {self.coluna_valor} {self.tipo_valor} NOT NULL,
+                    ultimo_uso REAL NOT NULL,
+                    PRIMARY KEY (modelo, {self.coluna_chave})
+                )
+            """)
+            self._conn.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_{self.tabela}_ultimo_uso ON {self.tabela} (ultimo_uso)"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def buscar(self, modelo: str, chaves: List[str]) -> Dict[str, Any]:
+        """
+        Busca os valores das chaves e marca o uso (não altera os contadores)
+
+        Returns:
+            Dict {chave: valor} apenas para as encontradas
+        """
+        encontrados: Dict[str, Any] = {}
+        unicas = list(dict.fromkeys(c for c in chaves if c))
+        if not unicas:
+            return encontrados
+
+        with self.lock:
+            conn = self._get_conn()
+            # SQLite limita o número de parâmetros por consulta
+            for inicio in range(0, len(unicas), 500):
+                parte = unicas[inicio:inicio + 500]
+                placeholders = ",".join("?" * len(parte))
+                rows = conn.execute(
+                    f"SELECT {self.coluna_chave}, {self.coluna_valor} FROM {self.tabela} "
+                    f"WHERE modelo = ? AND {self.coluna_chave} IN ({placeholders})",
+                    [modelo, *parte]
+                ).fetchall()
+                encontrados.update(rows)
+
+            if encontrados:
+                agora = time.time()
+                conn.executemany(
+                    f"UPDATE {self.tabela} SET ultimo_uso = ? WHERE modelo = ? AND {self.coluna_chave} = ?",
+                    [(agora, modelo, c) for c in encontrados]
+                )
+                conn.commit()
+
+        return encontrados
+
+    def registrar_consulta(self, hits: int, misses: int):
+        """Soma aos contadores de hit/miss"""
+        with self.lock:
+            self.hits += hits
+            self.misses += misses
+
+    def gravar(self, modelo: str, itens: List[Tuple[str, Any]]):
+        """Grava (ou substitui) itens [(chave, valor)] e aplica o limite de entradas"""
+        if not itens:
+            return
+
+        agora = time.time()
+        with self.lock:
+            conn = self._get_conn()
+            conn.executemany(
+                f"INSERT OR REPLACE INTO {self.tabela} "
+                f"(modelo, {self.coluna_chave}, {self.coluna_valor}, ultimo_uso) VALUES (?, ?, ?, ?)",
+                [(modelo, chave, valor, agora) for chave, valor in itens]
+            )
+            conn.commit()
+
+            # Verificar o limite a cada ~1% de inserções para não contar a tabela sempre
+            self._insercoes_desde_limpeza += len(itens)
+            if self._insercoes_desde_limpeza >= max(100, self.max_entradas // 100):
+                self._insercoes_desde_limpeza = 0
+                self._aplicar_limite(conn)
+
+    def _aplicar_limite(self, conn: sqlite3.Connection):
+        """Remove as entradas menos usadas recentemente acima de max_entradas"""
+        total = conn.execute(f"SELECT COUNT(*) FROM {self.tabela}").fetchone()[0]
+        excedente = total - self.max_entradas
+        if excedente > 0:
+            conn.execute(
+                f"DELETE FROM {self.tabela} WHERE rowid IN "
+                f"(SELECT rowid FROM {self.tabela} ORDER BY ultimo_uso LIMIT ?)",
+                (excedente,)
+            )
+            conn.commit()
+            print(f"🗑️  Cache de {self.descricao}: {excedente} entradas antigas removidas")
+
+    def estatisticas(self) -> Dict:
+        """Tamanho do cache e contadores de hit/miss"""
+        with self.lock:
+            conn = self._get_conn()
+            por_modelo = dict(conn.execute(
+                f"SELECT modelo, COUNT(*) FROM {self.tabela} GROUP BY modelo"
+            ).fetchall())
+            consultas = self.hits + self.misses
+
+            return {
+                "entradas": sum(por_modelo.values()),
+                "por_modelo": por_modelo,
+                "max_entradas": self.max_entradas,
+                "hits": self.hits,
+                "misses": self.misses,
+                "taxa_acerto": round(self.hits / consultas * 100, 1) if consultas else 0.0,
+                "tamanho_bytes": Path(self.caminho).stat().st_size if Path(self.caminho).exists() else 0
+            }
+
+    def limpar(self, modelo: Optional[str] = None) -> int:
+        """
+        Remove entradas do cache
+
+        Args:
+            modelo: Remove apenas deste modelo (None = todos e zera os contadores)
+
+        Returns:
+            Número de entradas removidas
+        """
+        with self.lock:
+            conn = self._get_conn()
+            if modelo:
+                cursor = conn.execute(f"DELETE FROM {self.tabela} WHERE modelo = ?", (modelo,))
+            else:
+                cursor = conn.execute(f"DELETE FROM {self.tabela}")
+                self.hits = 0
+                self.misses = 0
+            conn.commit()
+            conn.execute("VACUUM")
+            return cursor.rowcount
@@ -0,0 +1,240 @@
+"""
+Índice textual da base de conhecimento
+- O texto de cada documento é extraído e dividido em chunks uma única vez (no upload)
+- Chunks ficam num banco SQLite por instância, com índice FTS5
+- A busca textual do RAG vira uma consulta no índice, sem reabrir os arquivos
+- Arquivos cuja extração falhou ficam registrados (com o mtime) e só são
+  tentados de novo se forem alterados
+- Sem FTS5 no SQLite, cai para busca com LIKE no texto normalizado
+"""
+import os
+import re
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+
+
+# Configurações (via .env)
+INDEX_DIR = Path(os.getenv("TEXT_INDEX_DIR", "storage/text_index"))
+
+# Uma conexão e um lock por instância: indexar uma base não trava a busca nas outras
+_conexoes: Dict[str, sqlite3.Connection] = {}
+_locks: Dict[str, threading.RLock] = {}
+_locks_lock = threading.Lock()
+_fts5_disponivel: Optional[bool] = None
+
+
+def normalizar(texto: str) -> str:
+    """Minúsculas e espaços normalizados"""
+    return re.sub(r'\s+', ' ', texto.lower()).strip()
+
+
+def _suporta_fts5() -> bool:
+    """Verifica uma vez se o SQLite foi compilado com FTS5"""
+    global _fts5_disponivel
+    if _fts5_disponivel is None:
+        try:
+            conn = sqlite3.connect(":memory:")
+            conn.execute("CREATE VIRTUAL TABLE t USING fts5(x)")
+            conn.close()
+            _fts5_disponivel = True
+        except sqlite3.OperationalError:
+            print("⚠️ SQLite sem FTS5, índice textual usará LIKE")
+            _fts5_disponivel = False
+    return _fts5_disponivel
+
+
+def _caminho(instance_name: str) -> Path:
+    return INDEX_DIR / f"{instance_name}.db"
+
+
+def _lock(instance_name: str) -> threading.RLock:
+    """Lock do índice da instância (protege a conexão compartilhada)"""
+    with _locks_lock:
+        return _locks.setdefault(instance_name, threading.RLock())
+
+
+def _get_conn(instance_name: str) -> sqlite3.Connection:
+    """Conexão com o índice da instância (criado na primeira chamada; chamar com o lock da instância)"""
+    conn = _conexoes.get(instance_name)
+    if conn is not None:
+        return conn
+
+    INDEX_DIR.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(_caminho(instance_name)), check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS documentos (
+            file_name TEXT PRIMARY KEY,
+            mtime REAL NOT NULL,
+            chunks INTEGER NOT NULL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS falhas (
+            file_name TEXT PRIMARY KEY,
+            mtime REAL NOT NULL,
+            erro TEXT
+        )
+    """)
+    if _suporta_fts5():
+        conn.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS chunks USING fts5(
+                file_name UNINDEXED,
+                chunk_index UNINDEXED,
+                texto,
+                tokenize = 'unicode61 remove_diacritics 2'
+            )
+        """)
+    else:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS chunks (
+                file_name TEXT NOT NULL,
+                chunk_index INTEGER NOT NULL,
+                texto TEXT NOT NULL,
+                texto_norm TEXT NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_file ON chunks (file_name)")
+    conn.commit()
+
+    _conexoes[instance_name] = conn
+    return conn
+
+
+def indexar_documento(instance_name: str, file_name: str, chunks: List[str], mtime: float):
+    """
+    Grava (ou substitui) os chunks de um documento no índice
+
+    Args:
+        instance_name: Instância Evolution
+        file_name: Nome do arquivo
+        chunks: Chunks de texto (os mesmos vetorizados no Qdrant)
+        mtime: Data de modificação do arquivo (detecta arquivos alterados)
+    """
+    with _lock(instance_name):
+        conn = _get_conn(instance_name)
+        conn.execute("DELETE FROM chunks WHERE file_name = ?", (file_name,))
+
+        if _suporta_fts5():
+            conn.executemany(
+                "INSERT INTO chunks (file_name, chunk_index, texto) VALUES (?, ?, ?)",
+                [(file_name, i, chunk) for i, chunk in enumerate(chunks)]
+            )
+        else:
+            conn.executemany(
+                "INSERT INTO chunks (file_name, chunk_index, texto, texto_norm) VALUES (?, ?, ?, ?)",
+                [(file_name, i, chunk, normalizar(chunk)) for i, chunk in enumerate(chunks)]
+            )
+
+        conn.execute(
+            "INSERT OR REPLACE INTO documentos (file_name, mtime, chunks) VALUES (?, ?, ?)",
+            (file_name, mtime, len(chunks))
+        )
+        conn.execute("DELETE FROM falhas WHERE file_name = ?", (file_name,))
+        conn.commit()
+
+
+def registrar_falha(instance_name: str, file_name: str, mtime: float, erro: str):
+    """Registra que a extração do arquivo falhou nesta versão (mtime)"""
+    with _lock(instance_name):
+        conn = _get_conn(instance_name)
+        conn.execute(
+            "INSERT OR REPLACE INTO falhas (file_name, mtime, erro) VALUES (?, ?, ?)",
+            (file_name, mtime, erro)
+        )
+        conn.commit()
+
+
+def falhas_registradas(instance_name: str) -> Dict[str, float]:
+    """Arquivos cuja indexação falhou: {file_name: mtime}"""
+    with _lock(instance_name):
+        conn = _get_conn(instance_name)
+        return dict(conn.execute("SELECT file_name, mtime FROM falhas").fetchall())
+
+
+def documentos_indexados(instance_name: str) -> Dict[str, float]:
+    """Arquivos já indexados da instância: {file_name: mtime}"""
+    with _lock(instance_name):
+        conn = _get_conn(instance_name)
+        return dict(conn.execute("SELECT file_name, mtime FROM documentos").fetchall())
+
+
+def remover_documento(instance_name: str, file_name: str):
+    """Remove um documento do índice"""
+    with _lock(instance_name):
+        conn = _get_conn(instance_name)
+        conn.execute("DELETE FROM chunks WHERE file_name = ?", (file_name,))
+        conn.execute("DELETE FROM documentos WHERE file_name = ?", (file_name,))
+        conn.execute("DELETE FROM falhas WHERE file_name = ?", (file_name,))
+        conn.commit()
+
+
+def remover_indice(instance_name: str):
+    """Apaga o índice inteiro da instância"""
+    with _lock(instance_name):
+        conn = _conexoes.pop(instance_name, None)
+        if conn is not None:
+            conn.close()
+        for sufixo in ("", "-wal", "-shm"):
+            Path(f"{_caminho(instance_name)}{sufixo}").unlink(missing_ok=True)
+
+
+def _termo_fts(texto: str) -> str:
+    """Frase entre aspas para o MATCH do FTS5 (sem operadores do usuário)"""
+    return '"' + texto.replace('"', ' ') + '"'
+
+
+def _consultar(conn: sqlite3.Connection, termo: str, limite: int) -> List[Dict]:
+    """Busca chunks que contêm o termo (frase ou palavra)"""
+    if _suporta_fts5():
+        rows = conn.execute(
+            "SELECT file_name, chunk_index, texto FROM chunks WHERE chunks MATCH ? "
+            "ORDER BY bm25(chunks) LIMIT ?",
+            (f"texto:{_termo_fts(termo)}", limite)
+        ).fetchall()
+    else:
+        rows = conn.execute(
+            "SELECT file_name, chunk_index, texto FROM chunks WHERE texto_norm LIKE ? LIMIT ?",
+            (f"%{termo}%", limite)
+        ).fetchall()
+
+    return [
+        {"file_name": file_name, "chunk_index": int(chunk_index), "text": texto}
+        for file_name, chunk_index, texto in rows
+    ]
+
+
+def buscar(instance_name: str, query: str, keywords: List[str], limite: int = 10) -> List[Dict]:
+    """
+    Busca chunks por frase exata, depois pares de palavras-chave, depois
+    palavras-chave isoladas (mesma prioridade da busca antiga nos arquivos)
+
+    Args:
+        instance_name: Instância Evolution
+        query: Pergunta do usuário
+        keywords: Palavras-chave da pergunta (sem stopwords)
+        limite: Máximo de chunks retornados
+
+    Returns:
+        Lista de {file_name, chunk_index, text}
+    """
+    termos = [normalizar(query)]
+    termos += [f"{keywords[i]} {keywords[i + 1]}" for i in range(len(keywords) - 1)]
+    termos += keywords
+
+    with _lock(instance_name):
+        conn = _get_conn(instance_name)
+        for termo in termos:
+            if not termo:
+                continue
+            try:
+                resultados = _consultar(conn, termo, limite)
+            except sqlite3.OperationalError as e:
+                print(f"⚠️ Termo inválido para o índice textual ({termo}): {e}")
+                continue
+            if resultados:
+                return resultados
+
+    return []
@@ -0,0 +1,91 @@
+"""
+Cache persistente de transcrições de áudio
+- Chave: modelo do Whisper + idioma + identificador do áudio
+  (mediaKey/fileSha256 do WhatsApp, antes do download, ou SHA-256 dos bytes)
+- Webhook reentregue ou áudio encaminhado para várias instâncias não passa
+  pelo Whisper de novo
+- Limite de entradas com descarte LRU (por último uso)
+"""
+import os
+import hashlib
+from typing import Dict, List, Optional
+
+from services.sqlite_lru import CacheSQLiteLRU
+
+
+# Configurações (via .env)
+CACHE_PATH = os.getenv("TRANSCRIPTION_CACHE_PATH", "storage/transcription_cache.db")
+MAX_ENTRADAS = int(os.getenv("TRANSCRIPTION_CACHE_MAX_ENTRIES", "50000"))
+
+_store = CacheSQLiteLRU(
+    CACHE_PATH,
+    tabela="transcricoes",
+    coluna_chave="chave",
+    coluna_valor="texto",
+    tipo_valor="TEXT",
+    max_entradas=MAX_ENTRADAS,
+    descricao="transcrições"
+)
+
+
+def chave_conteudo(audio_bytes: bytes) -> str:
+    """Chave a partir do conteúdo baixado (SHA-256 dos bytes)"""
+    return "sha256:" + hashlib.sha256(audio_bytes).hexdigest()
+
+
+def chave_midia(audio_message: Dict) -> Optional[str]:
+    """
+    Chave a partir dos metadados da mídia no webhook (permite pular o download)
+
+    Args:
+        audio_message: Conteúdo de message.audioMessage do webhook
+
+    Returns:
+        "midia:<fileSha256 ou mediaKey>" ou None se o webhook não trouxer
+    """
+    for campo in ("fileSha256", "mediaKey"):
+        valor = audio_message.get(campo)
+        if isinstance(valor, str) and valor:
+            return f"midia:{campo}:{valor}"
+    return None
+
+
+def buscar(modelo: str, chaves: List[str]) -> Optional[str]:
+    """
+    Busca a transcrição pela primeira chave encontrada
+
+    Args:
+        modelo: Modelo do Whisper + idioma (ex: "base:pt")
+        chaves: Identificadores do áudio (None/vazios são ignorados)
+
+    Returns:
+        Texto transcrito ou None
+    """
+    chaves = [c for c in chaves if c]
+    if not chaves:
+        return None
+
+    encontrados = _store.buscar(modelo, chaves)
+    chave = next((c for c in chaves if c in encontrados), None)
+    if chave is None:
+        _store.registrar_consulta(0, 1)
+        return None
+
+    _store.registrar_consulta(1, 0)
+    print(f"♻️  Transcrição cacheada ({chave[:24]}...)")
+    return encontrados[chave]
+
+
+def gravar(modelo: str, chaves: List[str], texto: str):
+    """Grava a transcrição sob todas as chaves do áudio e aplica o limite de entradas"""
+    _store.gravar(modelo, [(c, texto) for c in chaves if c])
+
+
+def estatisticas() -> Dict:
+    """Tamanho do cache e contadores de hit/miss"""
+    return _store.estatisticas()
+
+
+def limpar() -> int:
+    """Remove todas as transcrições cacheadas e zera os contadores"""
+    return _store.limpar()
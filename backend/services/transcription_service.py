@@ -0,0 +1,283 @@
+"""
+Serviço de transcrição (Whisper) em pool de processos
+- O modelo é carregado uma vez por processo do pool, no startup da aplicação
+- Inferência fora do processo da API (não disputa o GIL nem o event loop)
+- Limite de clipes aguardando (acima dele a transcrição é recusada)
+- Métricas de profundidade da fila e fator de tempo real (RTF) por clipe
+- Aceita o áudio em memória (bytes): uma única decodificação via ffmpeg por
+  pipe, direto para o array float32 de 16 kHz que o Whisper consome
+"""
+import os
+import time
+import asyncio
+import subprocess
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Optional, Tuple, Union
+
+
+class TranscricaoSaturada(Exception):
+    """Muitos áudios aguardando transcrição: o clipe não foi aceito"""
+
+
+def _workers_padrao() -> int:
+    """Metade dos núcleos (cada worker usa várias threads do PyTorch), até 4"""
+    return max(1, min(4, (os.cpu_count() or 2) // 2))
+
+
+# Configurações (via .env)
+MODELO_WHISPER = os.getenv("WHISPER_MODEL", "base")
+NUM_WORKERS = int(os.getenv("TRANSCRICAO_WORKERS", str(_workers_padrao())))
+MAX_FILA = int(os.getenv("TRANSCRICAO_MAX_FILA", "16"))
+PRELOAD = os.getenv("WHISPER_PRELOAD", "true").lower() == "true"
+# spawn: o pool é criado (e recriado) com o uvicorn já cheio de threads; fork
+# copiaria locks presos por outras threads e poderia travar o processo filho
+MP_CONTEXT = os.getenv("TRANSCRICAO_MP_CONTEXT", "spawn")
+SAMPLE_RATE = 16000  # taxa usada pelo Whisper
+
+
+# ============ PROCESSOS DO POOL ============
+
+_modelo_worker = None
+
+
+def _inicializar_worker(modelo: str, threads: int):
+    """Carrega o Whisper no processo do pool (roda uma vez por processo)"""
+    global _modelo_worker
+
+    import torch
+    import whisper
+
+    torch.set_num_threads(threads)
+    inicio = time.time()
+    _modelo_worker = whisper.load_model(modelo)
+    print(f"✅ Whisper '{modelo}' carregado no worker {os.getpid()} ({time.time() - inicio:.1f}s)")
+
+
+def _aquecer() -> int:
+    """Tarefa vazia: força a criação do processo e o carregamento do modelo"""
+    return os.getpid()
+
+
+def _decodificar(dados: bytes):
+    """
+    Decodifica áudio em memória (OGG/Opus, MP3, ...) para float32 mono 16 kHz
+
+    O ffmpeg lê do stdin e escreve PCM no stdout: nenhum arquivo temporário
+    """
+    import numpy as np
+
+    processo = subprocess.run(
+        [
+            "ffmpeg", "-nostdin", "-threads", "0",
+            "-i", "pipe:0",
+            "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(SAMPLE_RATE),
+            "pipe:1"
+        ],
+        input=dados,
+        capture_output=True,
+        check=False
+    )
+    if processo.returncode != 0:
+        raise RuntimeError(f"Falha ao decodificar áudio: {processo.stderr.decode(errors='ignore')[-300:]}")
+
+    return np.frombuffer(processo.stdout, np.int16).astype(np.float32) / 32768.0
+
+
+def _transcrever_no_worker(audio: Union[str, bytes], language: str) -> Tuple[str, float, float]:
+    """
+    Transcreve no processo do pool
+
+    Args:
+        audio: Caminho do arquivo ou conteúdo do áudio em memória
+
+    Returns:
+        (texto, duração do áudio em s, tempo de inferência em s)
+    """
+    if isinstance(audio, (bytes, bytearray)):
+        audio = _decodificar(bytes(audio))
+    else:
+        import whisper
+        audio = whisper.load_audio(audio)
+
+    duracao = len(audio) / SAMPLE_RATE
+
+    inicio = time.time()
+    result = _modelo_worker.transcribe(
+        audio,
+        language=language,
+        fp16=False  # Compatibilidade com CPU
+    )
+    return result["text"].strip(), duracao, time.time() - inicio
+
+
+# ============ PROCESSO DA API ============
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+_lock = threading.Lock()
+_pendentes = 0
+_rejeitadas = 0
+_transcritos = 0
+_rtfs = deque(maxlen=200)          # (duração, inferência, rtf) dos últimos clipes
+_ultimo: Optional[Dict] = None
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    """Pool de processos (criado na primeira chamada ou no startup)"""
+    global _pool
+
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                threads = max(1, (os.cpu_count() or 1) // NUM_WORKERS)
+                _pool = ProcessPoolExecutor(
+                    max_workers=NUM_WORKERS,
+                    mp_context=multiprocessing.get_context(MP_CONTEXT),
+                    initializer=_inicializar_worker,
+                    initargs=(MODELO_WHISPER, threads)
+                )
+                print(f"🎙️  Pool de transcrição: {NUM_WORKERS} processo(s), {threads} thread(s) cada, modelo '{MODELO_WHISPER}'")
+    return _pool
+
+
+def iniciar():
+    """Cria o pool e carrega o modelo em todos os processos (chamar no startup)"""
+    if not PRELOAD:
+        return
+
+    pool = _get_pool()
+    # Uma tarefa por worker garante que todos os processos sobem e carregam o modelo
+    for _ in range(NUM_WORKERS):
+        pool.submit(_aquecer)
+
+
+def _admitir():
+    global _pendentes, _rejeitadas
+    with _lock:
+        if _pendentes >= NUM_WORKERS + MAX_FILA:
+            _rejeitadas += 1
+            raise TranscricaoSaturada(f"{_pendentes} áudios aguardando transcrição")
+        _pendentes += 1
+
+
+def _registrar(duracao: float, inferencia: float):
+    global _transcritos, _ultimo
+    rtf = inferencia / duracao if duracao > 0 else 0.0
+    with _lock:
+        _transcritos += 1
+        _rtfs.append((duracao, inferencia, rtf))
+        _ultimo = {
+            "duracao_audio_s": round(duracao, 2),
+            "inferencia_s": round(inferencia, 2),
+            "rtf": round(rtf, 3)
+        }
+    print(f"⏱️  Transcrição: {duracao:.1f}s de áudio em {inferencia:.1f}s (RTF {rtf:.2f})")
+
+
+def _liberar():
+    global _pendentes
+    with _lock:
+        _pendentes -= 1
+
+
+def _descrever(audio: Union[str, bytes]) -> str:
+    if isinstance(audio, (bytes, bytearray)):
+        return f"{len(audio) / 1024:.0f} KB em memória"
+    return audio
+
+
+def transcrever(audio: Union[str, bytes], language: str = "pt") -> str:
+    """
+    Transcreve um áudio no pool (bloqueia a thread chamadora)
+
+    Args:
+        audio: Caminho do arquivo ou conteúdo do áudio em memória
+        language: Idioma do áudio (pt, en, es, etc)
+
+    Returns:
+        Texto transcrito
+
+    Raises:
+        TranscricaoSaturada: Muitos áudios aguardando transcrição
+    """
+    _admitir()
+    try:
+        print(f"🎙️  Transcrevendo áudio: {_descrever(audio)}")
+        pool = _get_pool()
+        try:
+            texto, duracao, inferencia = pool.submit(_transcrever_no_worker, audio, language).result()
+        except BrokenProcessPool:
+            _descartar_pool(pool)
+            raise
+        _registrar(duracao, inferencia)
+        return texto
+    finally:
+        _liberar()
+
+
+async def transcrever_async(audio: Union[str, bytes], language: str = "pt") -> str:
+    """
+    Transcreve um áudio no pool sem ocupar threads nem o event loop
+
+    Cancelar a corrotina (ex: wait_for) retira o clipe do pool se ele ainda
+    não começou a ser transcrito.
+
+    Raises:
+        TranscricaoSaturada: Muitos áudios aguardando transcrição
+    """
+    _admitir()
+    try:
+        print(f"🎙️  Transcrevendo áudio: {_descrever(audio)}")
+        pool = _get_pool()
+        try:
+            texto, duracao, inferencia = await asyncio.wrap_future(
+                pool.submit(_transcrever_no_worker, audio, language)
+            )
+        except BrokenProcessPool:
+            _descartar_pool(pool)
+            raise
+        _registrar(duracao, inferencia)
+        return texto
+    finally:
+        _liberar()
+
+
+def _descartar_pool(pool: ProcessPoolExecutor):
+    """Worker morreu (falta de memória, falha ao carregar o modelo): o próximo áudio cria outro pool"""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+
+
+def estatisticas() -> Dict:
+    """Profundidade da fila e RTF dos últimos clipes"""
+    with _lock:
+        rtfs = sorted(r for _, _, r in _rtfs)
+        audio_total = sum(d for d, _, _ in _rtfs)
+        inferencia_total = sum(i for _, i, _ in _rtfs)
+
+        return {
+            "modelo": MODELO_WHISPER,
+            "workers": NUM_WORKERS,
+            "max_fila": MAX_FILA,
+            "pendentes": _pendentes,
+            "na_fila": max(0, _pendentes - NUM_WORKERS),
+            "transcritos": _transcritos,
+            "rejeitados": _rejeitadas,
+            "rtf_medio": round(inferencia_total / audio_total, 3) if audio_total else 0.0,
+            "rtf_p95": round(rtfs[int(len(rtfs) * 0.95) - 1 if len(rtfs) > 1 else 0], 3) if rtfs else 0.0,
+            "ultimo": _ultimo
+        }
+
+
+def encerrar():
+    """Encerra o pool de processos (chamar no shutdown da aplicação)"""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
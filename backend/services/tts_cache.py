@@ -0,0 +1,271 @@
+"""
+Cache de áudios de resposta (TTS) endereçado por conteúdo
+- Chave: idioma + SHA-256 do texto, compartilhada entre contatos e instâncias
+- Respostas estáticas (respostas predefinidas e menu) pré-renderizadas ao salvar
+- Varredura em segundo plano mantém o diretório dentro da cota de disco,
+  removendo os áudios usados há mais tempo (LRU pelo mtime)
+"""
+import os
+import json
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+
+
+# Configurações (via .env)
+CACHE_DIR = Path(os.getenv("TTS_CACHE_DIR", "storage/audio_cache/tts"))
+COTA_BYTES = int(float(os.getenv("TTS_CACHE_MAX_MB", "500")) * 1024 * 1024)
+INTERVALO_VARREDURA = int(os.getenv("TTS_CACHE_SWEEP_INTERVAL", "600"))
+# Desligado por padrão: as respostas em áudio estão desativadas
+PRE_RENDERIZAR = os.getenv("TTS_PRE_RENDER", "false").lower() == "true"
+IDIOMA_PADRAO = "pt-br"
+
+_locks: Dict[str, threading.Lock] = {}
+_locks_lock = threading.Lock()
+_pre_render: Optional[ThreadPoolExecutor] = None
+_varredura: Optional[threading.Thread] = None
+_parar = threading.Event()
+_contadores_lock = threading.Lock()
+_hits = 0
+_misses = 0
+_removidos = 0
+
+
+def caminho(texto: str, idioma: str = IDIOMA_PADRAO) -> Path:
+    """Arquivo do áudio no cache (subpasta pelos 2 primeiros caracteres do hash)"""
+    chave = hashlib.sha256(f"{idioma}\n{texto.strip()}".encode("utf-8")).hexdigest()
+    return CACHE_DIR / chave[:2] / f"{chave}.mp3"
+
+
+def _lock_do_arquivo(path: Path) -> threading.Lock:
+    with _locks_lock:
+        return _locks.setdefault(path.name, threading.Lock())
+
+
+def _sintetizar(texto: str, idioma: str, path: Path):
+    """Gera o MP3 com gTTS (grava em arquivo temporário e renomeia)"""
+    from gtts import gTTS
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporario = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        gTTS(text=texto, lang=idioma, slow=False).save(str(temporario))
+        os.replace(temporario, path)
+    finally:
+        if temporario.exists():
+            temporario.unlink()
+
+
+def _contar(hit: bool):
+    global _hits, _misses
+
+    with _contadores_lock:
+        if hit:
+            _hits += 1
+        else:
+            _misses += 1
+
+
+def obter(texto: str, idioma: str = IDIOMA_PADRAO) -> str:
+    """
+    Retorna o áudio do texto, sintetizando apenas se ainda não estiver no cache
+
+    Args:
+        texto: Texto da resposta
+        idioma: Idioma do gTTS (pt-br, en, es, etc)
+
+    Returns:
+        Caminho do arquivo MP3
+    """
+    path = caminho(texto, idioma)
+
+    if path.exists():
+        try:
+            os.utime(path)  # marca o uso para o descarte LRU
+            _contar(hit=True)
+            return str(path)
+        except FileNotFoundError:
+            pass  # removido pela varredura entre a verificação e o utime: tratar como miss
+
+    # Um único gTTS por texto, mesmo com vários contatos pedindo ao mesmo tempo
+    with _lock_do_arquivo(path):
+        if path.exists():
+            _contar(hit=True)
+            return str(path)
+
+        _contar(hit=False)
+        print(f"🔊 Gerando áudio: {texto[:50]}...")
+        _sintetizar(texto, idioma, path)
+        print(f"✅ Áudio gerado: {path}")
+
+    with _locks_lock:
+        _locks.pop(path.name, None)
+
+    return str(path)
+
+
+def textos_estaticos(config: Dict) -> List[str]:
+    """
+    Textos fixos da configuração do agente (respostas predefinidas, respostas
+    do menu e dos submenus)
+    """
+    textos = [r.get("resposta") for r in config.get("respostas", [])]
+
+    for opcao in config.get("menu", []):
+        textos.append(opcao.get("resposta"))
+
+        submenu = opcao.get("submenu")
+        if isinstance(submenu, str) and submenu:
+            try:
+                submenu = json.loads(submenu)
+            except json.JSONDecodeError:
+                submenu = []
+        if isinstance(submenu, list):
+            textos.extend(s.get("resposta") for s in submenu if isinstance(s, dict))
+
+    # Remover vazios e repetidos mantendo a ordem
+    return list(dict.fromkeys(t.strip() for t in textos if isinstance(t, str) and t.strip()))
+
+
+def _pre_renderizar_textos(textos: List[str], idioma: str):
+    gerados = 0
+    for texto in textos:
+        if _parar.is_set():
+            return
+        if caminho(texto, idioma).exists():
+            continue
+        try:
+            obter(texto, idioma)
+            gerados += 1
+        except Exception as e:
+            print(f"⚠️  Erro ao pré-renderizar áudio: {e}")
+
+    if gerados:
+        print(f"🔊 {gerados} áudio(s) de resposta pré-renderizado(s)")
+
+
+def pre_renderizar(config: Dict, idioma: str = IDIOMA_PADRAO):
+    """
+    Agenda a síntese dos textos estáticos da configuração (não bloqueia)
+
+    Args:
+        config: Configuração do agente (configuracao_agente já decodificada)
+        idioma: Idioma do gTTS
+    """
+    global _pre_render
+
+    if not PRE_RENDERIZAR:
+        return
+
+    textos = [t for t in textos_estaticos(config) if not caminho(t, idioma).exists()]
+    if not textos:
+        return
+
+    if _pre_render is None:
+        # Um worker: gTTS chama um serviço externo, sem pressa para textos estáticos
+        _pre_render = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tts")
+    _pre_render.submit(_pre_renderizar_textos, textos, idioma)
+
+
+def varrer() -> int:
+    """
+    Aplica a cota de disco: remove os áudios usados há mais tempo até ficar
+    abaixo de 90% da cota
+
+    Returns:
+        Número de arquivos removidos
+    """
+    global _removidos
+
+    if not CACHE_DIR.exists():
+        return 0
+
+    arquivos = []
+    total = 0
+    for path in CACHE_DIR.rglob("*.mp3"):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        arquivos.append((stat.st_mtime, stat.st_size, path))
+        total += stat.st_size
+
+    if total <= COTA_BYTES:
+        return 0
+
+    alvo = COTA_BYTES * 0.9
+    removidos = 0
+    for _, tamanho, path in sorted(arquivos):
+        if total <= alvo:
+            break
+        try:
+            path.unlink()
+            total -= tamanho
+            removidos += 1
+        except FileNotFoundError:
+            pass
+
+    with _contadores_lock:
+        _removidos += removidos
+    print(f"🗑️  Cache de áudios: {removidos} arquivo(s) removido(s) para respeitar a cota")
+    return removidos
+
+
+def _loop_varredura():
+    while not _parar.wait(INTERVALO_VARREDURA):
+        try:
+            varrer()
+        except Exception as e:
+            print(f"⚠️  Erro na varredura do cache de áudios: {e}")
+
+
+def iniciar_varredura():
+    """Inicia a varredura periódica da cota (chamar no startup)"""
+    global _varredura
+
+    if _varredura is not None and _varredura.is_alive():
+        return
+
+    _parar.clear()
+    _varredura = threading.Thread(target=_loop_varredura, name="tts-varredura", daemon=True)
+    _varredura.start()
+
+
+def encerrar():
+    """Para a varredura e a pré-renderização (chamar no shutdown)"""
+    global _pre_render
+
+    _parar.set()
+    if _pre_render is not None:
+        _pre_render.shutdown(wait=False, cancel_futures=True)
+        _pre_render = None
+
+
+def estatisticas() -> Dict:
+    """Ocupação do cache e contadores"""
+    arquivos = 0
+    total = 0
+    if CACHE_DIR.exists():
+        for path in CACHE_DIR.rglob("*.mp3"):
+            try:
+                total += path.stat().st_size
+                arquivos += 1
+            except FileNotFoundError:
+                pass
+
+    with _contadores_lock:
+        hits, misses, removidos = _hits, _misses, _removidos
+
+    consultas = hits + misses
+    return {
+        "arquivos": arquivos,
+        "tamanho_bytes": total,
+        "cota_bytes": COTA_BYTES,
+        "hits": hits,
+        "misses": misses,
+        "taxa_acerto": round(hits / consultas * 100, 1) if consultas else 0.0,
+        "removidos_pela_cota": removidos
+    }
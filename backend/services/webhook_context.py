@@ -0,0 +1,138 @@
+"""
+Contexto de processamento de um webhook (pedido, plano, bot e conversa)
+- Pedido + plano + configuração do bot em cache no processo, invalidado
+  pelos routers que gravam essas tabelas (e com TTL curto, para gravações
+  feitas por outros processos)
+- Cache frio: pedido, plano, configuração e conversa ativa em uma única
+  consulta com joins; cache quente: só a consulta da conversa
+"""
+import os
+import time
+import threading
+from typing import Dict, Optional, Tuple
+from sqlalchemy import and_
+from sqlalchemy.orm import Session, joinedload
+
+import models
+
+
+# Configurações (via .env)
+TTL_SEGUNDOS = float(os.getenv("WEBHOOK_CONTEXT_CACHE_TTL", "60"))
+
+_cache: Dict[int, Tuple[models.Pedido, Optional[models.ConfiguracaoBot], float]] = {}
+_lock = threading.Lock()
+_hits = 0
+_misses = 0
+
+
+class WebhookContext:
+    """Dados necessários para processar uma mensagem recebida"""
+
+    def __init__(
+        self,
+        pedido: Optional[models.Pedido],
+        config: Optional[models.ConfiguracaoBot],
+        conversa: Optional[models.Conversa]
+    ):
+        self.pedido = pedido
+        self.plano = pedido.plano if pedido is not None else None
+        self.config = config
+        self.conversa = conversa
+
+
+def _consulta_conversa(db: Session, pedido_id: int, phone: str):
+    return db.query(models.Conversa).filter(
+        models.Conversa.pedido_id == pedido_id,
+        models.Conversa.contato_numero == phone,
+        models.Conversa.status == models.StatusConversa.ATIVA
+    )
+
+
+def _do_cache(pedido_id: int) -> Optional[Tuple[models.Pedido, Optional[models.ConfiguracaoBot]]]:
+    global _hits, _misses
+
+    with _lock:
+        item = _cache.get(pedido_id)
+        if item and item[2] > time.time():
+            _hits += 1
+            return item[0], item[1]
+        _misses += 1
+        return None
+
+
+def _guardar(db: Session, pedido: models.Pedido, config: Optional[models.ConfiguracaoBot]):
+    """Guarda cópias desanexadas da sessão (leitura apenas, compartilhadas entre webhooks)"""
+    db.expunge(pedido)
+    if pedido.plano is not None:
+        db.expunge(pedido.plano)
+    if config is not None:
+        db.expunge(config)
+
+    with _lock:
+        _cache[pedido.id] = (pedido, config, time.time() + TTL_SEGUNDOS)
+
+
+def carregar(db: Session, pedido_id: int, phone: Optional[str]) -> WebhookContext:
+    """
+    Carrega pedido, plano, configuração do bot e conversa ativa do contato
+
+    Pedido/plano/configuração vêm do cache quando possível; a conversa é
+    sempre lida na sessão informada (pode ser alterada pelo processamento).
+
+    Args:
+        db: Sessão do processamento do webhook
+        pedido_id: ID do pedido
+        phone: Número do contato (None = não buscar conversa)
+
+    Returns:
+        WebhookContext (pedido None se não existir)
+    """
+    cacheado = _do_cache(pedido_id)
+    if cacheado is not None:
+        pedido, config = cacheado
+        conversa = _consulta_conversa(db, pedido_id, phone).first() if phone else None
+        return WebhookContext(pedido, config, conversa)
+
+    # Uma única consulta: pedido + plano + configuração + conversa ativa
+    query = db.query(models.Pedido, models.ConfiguracaoBot, models.Conversa)\
+        .options(joinedload(models.Pedido.plano))\
+        .outerjoin(models.ConfiguracaoBot, models.ConfiguracaoBot.pedido_id == models.Pedido.id)\
+        .outerjoin(models.Conversa, and_(
+            models.Conversa.pedido_id == models.Pedido.id,
+            models.Conversa.contato_numero == phone,
+            models.Conversa.status == models.StatusConversa.ATIVA
+        ))\
+        .filter(models.Pedido.id == pedido_id)
+
+    row = query.first()
+    if row is None:
+        return WebhookContext(None, None, None)
+
+    pedido, config, conversa = row
+    _guardar(db, pedido, config)
+    return WebhookContext(pedido, config, conversa if phone else None)
+
+
+def invalidar(pedido_id: int):
+    """Descarta pedido/plano/configuração do cache (chamar após gravar)"""
+    with _lock:
+        _cache.pop(pedido_id, None)
+
+
+def invalidar_todos():
+    """Descarta todo o cache (ex: plano alterado, afeta vários pedidos)"""
+    with _lock:
+        _cache.clear()
+
+
+def estatisticas() -> Dict:
+    """Pedidos em cache e taxa de acerto"""
+    with _lock:
+        consultas = _hits + _misses
+        return {
+            "pedidos": len(_cache),
+            "ttl_segundos": TTL_SEGUNDOS,
+            "hits": _hits,
+            "misses": _misses,
+            "taxa_acerto": round(_hits / consultas * 100, 1) if consultas else 0.0
+        }
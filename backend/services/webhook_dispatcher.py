@@ -0,0 +1,151 @@
+"""
+Dispatcher de webhooks em lanes serializadas
+- Cada conversa (pedido_id + telefone) é mapeada para uma lane fixa via hash
+- Cada lane processa seus webhooks em ordem, um por vez
+- Lanes diferentes rodam em paralelo
+- Expõe profundidade e lag de cada lane
+"""
+import asyncio
+import time
+import zlib
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+
+class _MetricasLane:
+    """Contadores de uma lane"""
+
+    def __init__(self):
+        self.enfileirados_em = deque()  # timestamps dos itens aguardando na lane
+        self.em_processamento = False
+        self.processados = 0
+        self.erros = 0
+        self.ultimo_lag = 0.0
+        self.soma_lag = 0.0
+        self.max_lag = 0.0
+
+
+class WebhookDispatcher:
+    def __init__(
+        self,
+        handler: Callable[[Any], Awaitable[None]],
+        num_lanes: int = 4,
+        on_done: Optional[Callable[[Any, Optional[str]], Any]] = None
+    ):
+        """
+        Inicializa dispatcher
+
+        Args:
+            handler: Corrotina que processa um item
+            num_lanes: Número de lanes (workers) paralelas
+            on_done: Callback chamado ao fim de cada item (item, erro);
+                se for corrotina, a lane aguarda antes do próximo item
+        """
+        self.handler = handler
+        self.on_done = on_done
+        self.num_lanes = max(1, num_lanes)
+        self.lanes: List[asyncio.Queue] = [asyncio.Queue() for _ in range(self.num_lanes)]
+        self.metricas_lanes = [_MetricasLane() for _ in range(self.num_lanes)]
+        self.workers: List[asyncio.Task] = []
+
+    def lane_para(self, chave: str) -> int:
+        """Retorna a lane de uma chave (hash estável entre processos e reinícios)"""
+        return zlib.crc32(chave.encode("utf-8")) % self.num_lanes
+
+    def submeter(self, chave: str, item: Any, enfileirado_em: Optional[float] = None) -> int:
+        """
+        Coloca um item na lane da sua conversa
+
+        Args:
+            chave: Chave da conversa ("{pedido_id}:{telefone}")
+            item: Item repassado ao handler
+            enfileirado_em: Timestamp (time.time()) de chegada, para medir lag
+
+        Returns:
+            Índice da lane
+        """
+        indice = self.lane_para(chave)
+        chegada = enfileirado_em if enfileirado_em is not None else time.time()
+        self.metricas_lanes[indice].enfileirados_em.append(chegada)
+        self.lanes[indice].put_nowait((chegada, item))
+        return indice
+
+    def total_pendente(self) -> int:
+        """Itens aguardando ou em processamento em todas as lanes"""
+        return sum(
+            len(m.enfileirados_em) + (1 if m.em_processamento else 0)
+            for m in self.metricas_lanes
+        )
+
+    async def _worker(self, indice: int):
+        """Processa os itens de uma lane em ordem"""
+        fila = self.lanes[indice]
+        metricas = self.metricas_lanes[indice]
+
+        while True:
+            chegada, item = await fila.get()
+            metricas.enfileirados_em.popleft()
+            metricas.em_processamento = True
+
+            lag = max(0.0, time.time() - chegada)
+            metricas.ultimo_lag = lag
+            metricas.soma_lag += lag
+            metricas.max_lag = max(metricas.max_lag, lag)
+
+            erro = None
+            try:
+                await self.handler(item)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ Erro na lane {indice}: {e}")
+                erro = str(e)
+                metricas.erros += 1
+            finally:
+                metricas.processados += 1
+                metricas.em_processamento = False
+                fila.task_done()
+
+            if self.on_done:
+                try:
+                    resultado = self.on_done(item, erro)
+                    if asyncio.iscoroutine(resultado):
+                        await resultado
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    print(f"⚠️ Erro no callback da lane {indice}: {e}")
+
+    def iniciar(self):
+        """Inicia um worker por lane"""
+        for indice in range(self.num_lanes):
+            self.workers.append(asyncio.create_task(self._worker(indice)))
+        print(f"🛣️  Dispatcher de webhooks iniciado com {self.num_lanes} lanes")
+
+    async def parar(self):
+        """Cancela os workers das lanes"""
+        for task in self.workers:
+            task.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers.clear()
+
+    def metricas(self) -> List[Dict]:
+        """Profundidade e lag de cada lane"""
+        agora = time.time()
+        resultado = []
+
+        for indice, m in enumerate(self.metricas_lanes):
+            lag_atual = agora - m.enfileirados_em[0] if m.enfileirados_em else 0.0
+            resultado.append({
+                "lane": indice,
+                "profundidade": len(m.enfileirados_em),
+                "em_processamento": m.em_processamento,
+                "processados": m.processados,
+                "erros": m.erros,
+                "lag_atual_s": round(lag_atual, 3),
+                "ultimo_lag_s": round(m.ultimo_lag, 3),
+                "lag_medio_s": round(m.soma_lag / m.processados, 3) if m.processados else 0.0,
+                "lag_max_s": round(m.max_lag, 3)
+            })
+
+        return resultado
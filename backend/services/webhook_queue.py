@@ -0,0 +1,330 @@
+"""
+Fila durável de webhooks do Evolution API
+- O endpoint apenas grava o webhook na tabela webhooks_recebidos e responde
+- Um alimentador reserva webhooks e os entrega ao WebhookDispatcher
+- Webhooks da mesma conversa caem na mesma lane e são processados em ordem
+- No máximo um webhook por conversa reservado por processo: o próximo só é
+  reservado depois que o anterior termina (inclusive quando volta para a fila)
+- Reservas em andamento têm o lease renovado periodicamente; se o processo
+  cair, o lease expira e o webhook é reprocessado
+"""
+import os
+import json
+import uuid
+import socket
+import asyncio
+import calendar
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+from sqlalchemy import or_, and_, func
+from sqlalchemy.orm import Session
+
+import models
+from database import SessionLocal
+from services.webhook_dispatcher import WebhookDispatcher
+
+
+# Configurações (via .env)
+NUM_LANES = int(os.getenv("WEBHOOK_WORKERS", "4"))
+CAPACIDADE_POR_LANE = int(os.getenv("WEBHOOK_CAPACIDADE_LANE", "8"))
+LEASE_SEGUNDOS = int(os.getenv("WEBHOOK_LEASE_SECONDS", "300"))
+MAX_TENTATIVAS = int(os.getenv("WEBHOOK_MAX_TENTATIVAS", "3"))
+INTERVALO_POLLING = float(os.getenv("WEBHOOK_POLL_INTERVAL", "2.0"))
+RETENCAO_DIAS = int(os.getenv("WEBHOOK_RETENCAO_DIAS", "7"))
+
+# Handler chamado para cada webhook: handler(pedido_id, data)
+WebhookHandler = Callable[[int, dict], Awaitable[None]]
+
+# Identifica este processo como dono das reservas (sufixo aleatório: o PID
+# pode se repetir depois de reiniciar, ex: em containers)
+CONSUMIDOR_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+_handler: Optional[WebhookHandler] = None
+_dispatcher: Optional[WebhookDispatcher] = None
+_alimentador: Optional[asyncio.Task] = None
+_novo_webhook: Optional[asyncio.Event] = None
+_renovador: Optional[asyncio.Task] = None
+
+# Webhooks reservados por este processo: webhook_id -> chave da conversa
+_em_posse: Dict[int, str] = {}
+
+
+def montar_chave_conversa(pedido_id: int, phone: Optional[str]) -> str:
+    """Chave que garante ordem de processamento por contato"""
+    return f"{pedido_id}:{phone or ''}"
+
+
+def enfileirar_webhook(db: Session, pedido_id: int, phone: Optional[str], data: dict) -> models.WebhookRecebido:
+    """
+    Grava o webhook na fila durável (um INSERT + commit)
+
+    Args:
+        db: Sessão do banco de dados
+        pedido_id: ID do pedido
+        phone: Número do contato (define a ordem de processamento)
+        data: JSON do webhook
+
+    Returns:
+        Registro gravado na fila
+    """
+    webhook = models.WebhookRecebido(
+        pedido_id=pedido_id,
+        chave_conversa=montar_chave_conversa(pedido_id, phone),
+        payload=json.dumps(data, ensure_ascii=False),
+        status=models.StatusWebhook.PENDENTE
+    )
+    db.add(webhook)
+    db.commit()
+
+    # Acordar consumidores deste processo
+    if _novo_webhook is not None:
+        _novo_webhook.set()
+
+    return webhook
+
+
+def _reservar_lote(db: Session, limite: int, chaves_em_posse: Set[str]) -> List[models.WebhookRecebido]:
+    """
+    Reserva até `limite` webhooks processáveis, em ordem de chegada.
+
+    Só a cabeça de cada conversa (menor id ainda PENDENTE/PROCESSANDO) é
+    candidata, e conversas com webhook em andamento neste processo
+    (chaves_em_posse) ficam de fora. Assim um webhook que falha e volta para
+    a fila é reprocessado antes dos seguintes da conversa, e uma conversa
+    com muitos pendentes não ocupa o lote das outras. A reserva é um UPDATE
+    condicional, então funciona com vários processos consumindo a mesma
+    tabela.
+    """
+    W = models.WebhookRecebido
+    agora = datetime.utcnow()
+    lease = agora + timedelta(seconds=LEASE_SEGUNDOS)
+
+    # Leases vencidos só de outros processos (os deste processo são renovados)
+    reservavel = or_(
+        W.status == models.StatusWebhook.PENDENTE,
+        and_(
+            W.status == models.StatusWebhook.PROCESSANDO,
+            W.bloqueado_ate < agora,
+            or_(W.consumidor.is_(None), W.consumidor != CONSUMIDOR_ID)
+        )
+    )
+
+    # Cabeça de cada conversa; se estiver em processamento com lease válido, a conversa espera
+    cabecas = db.query(func.min(W.id)).filter(
+        W.status.in_([models.StatusWebhook.PENDENTE, models.StatusWebhook.PROCESSANDO])
+    ).group_by(W.chave_conversa)
+
+    consulta = db.query(W.id).filter(W.id.in_(cabecas), reservavel)
+    if chaves_em_posse:
+        consulta = consulta.filter(W.chave_conversa.notin_(chaves_em_posse))
+    ids = [webhook_id for webhook_id, in consulta.order_by(W.id).limit(limite).all()]
+
+    if not ids:
+        db.rollback()
+        return []
+
+    # Outro processo pode ter reservado alguns no meio tempo: só ficam os que este atualizou
+    db.query(W).filter(W.id.in_(ids), reservavel).update({
+        W.status: models.StatusWebhook.PROCESSANDO,
+        W.bloqueado_ate: lease,
+        W.consumidor: CONSUMIDOR_ID,
+        W.tentativas: W.tentativas + 1
+    }, synchronize_session=False)
+    db.commit()
+
+    return db.query(W).filter(
+        W.id.in_(ids),
+        W.status == models.StatusWebhook.PROCESSANDO,
+        W.consumidor == CONSUMIDOR_ID,
+        W.bloqueado_ate == lease
+    ).order_by(W.id).all()
+
+
+def _finalizar(db: Session, webhook_id: int, erro: Optional[str] = None):
+    """Marca webhook como concluído, ou devolve para a fila em caso de erro"""
+    webhook = db.query(models.WebhookRecebido).filter(models.WebhookRecebido.id == webhook_id).first()
+    if not webhook:
+        return
+
+    if erro is None:
+        webhook.status = models.StatusWebhook.CONCLUIDO
+        webhook.processado_em = datetime.utcnow()
+    elif webhook.tentativas >= MAX_TENTATIVAS:
+        webhook.status = models.StatusWebhook.FALHOU
+        webhook.erro = erro
+        webhook.processado_em = datetime.utcnow()
+    else:
+        webhook.status = models.StatusWebhook.PENDENTE
+        webhook.erro = erro
+
+    webhook.bloqueado_ate = None
+    webhook.consumidor = None
+    db.commit()
+
+
+def limpar_concluidos(db: Session, dias: int = RETENCAO_DIAS) -> int:
+    """Remove webhooks concluídos mais antigos que a retenção"""
+    limite = datetime.utcnow() - timedelta(days=dias)
+    removidos = db.query(models.WebhookRecebido).filter(
+        models.WebhookRecebido.status == models.StatusWebhook.CONCLUIDO,
+        models.WebhookRecebido.processado_em < limite
+    ).delete(synchronize_session=False)
+    db.commit()
+    return removidos
+
+
+def estatisticas_fila(db: Session) -> Dict[str, int]:
+    """Contagem de webhooks por status"""
+    rows = db.query(
+        models.WebhookRecebido.status,
+        func.count(models.WebhookRecebido.id)
+    ).group_by(models.WebhookRecebido.status).all()
+
+    stats = {status.value: 0 for status in models.StatusWebhook}
+    for status, total in rows:
+        stats[status.value] = total
+    return stats
+
+
+async def _processar(item: Dict):
+    """Executa o handler para um webhook reservado (roda dentro da lane)"""
+    await _handler(item["pedido_id"], item["data"])
+
+
+def _finalizar_em_sessao(webhook_id: int, erro: Optional[str]):
+    db = SessionLocal()
+    try:
+        _finalizar(db, webhook_id, erro)
+    finally:
+        db.close()
+
+
+async def _ao_terminar(item: Dict, erro: Optional[str]):
+    """Grava o resultado do webhook (fora do event loop), libera a conversa e acorda o alimentador"""
+    try:
+        await asyncio.to_thread(_finalizar_em_sessao, item["webhook_id"], erro)
+    finally:
+        # Mesmo se a gravação falhar: o lease para de ser renovado e expira
+        _em_posse.pop(item["webhook_id"], None)
+
+    if _novo_webhook is not None:
+        _novo_webhook.set()
+
+
+def _reservar_em_sessao(limite: int, chaves_em_posse: Set[str]) -> List[Dict]:
+    db = SessionLocal()
+    try:
+        return [
+            {
+                "webhook_id": webhook.id,
+                "pedido_id": webhook.pedido_id,
+                "chave": webhook.chave_conversa,
+                "recebido_em": calendar.timegm(webhook.recebido_em.utctimetuple()),
+                "data": json.loads(webhook.payload)
+            }
+            for webhook in _reservar_lote(db, limite, chaves_em_posse)
+        ]
+    finally:
+        db.close()
+
+
+def _renovar_leases_em_sessao(webhook_ids: List[int]) -> int:
+    W = models.WebhookRecebido
+    db = SessionLocal()
+    try:
+        renovados = db.query(W).filter(
+            W.id.in_(webhook_ids),
+            W.status == models.StatusWebhook.PROCESSANDO,
+            W.consumidor == CONSUMIDOR_ID
+        ).update({
+            W.bloqueado_ate: datetime.utcnow() + timedelta(seconds=LEASE_SEGUNDOS)
+        }, synchronize_session=False)
+        db.commit()
+        return renovados
+    finally:
+        db.close()
+
+
+async def _renovar_leases():
+    """Estende o lease dos webhooks deste processo (na lane ou em processamento)"""
+    intervalo = max(1.0, LEASE_SEGUNDOS / 3)
+
+    while True:
+        try:
+            await asyncio.sleep(intervalo)
+            if _em_posse:
+                await asyncio.to_thread(_renovar_leases_em_sessao, list(_em_posse))
+        except asyncio.CancelledError:
+            break
+        except Exception as e:
+            print(f"⚠️  Erro ao renovar leases da fila de webhooks: {e}")
+
+
+async def _alimentar():
+    """Reserva webhooks da tabela e distribui entre as lanes do dispatcher"""
+    capacidade = _dispatcher.num_lanes * CAPACIDADE_POR_LANE
+    print(f"📥 Alimentador da fila de webhooks iniciado ({CONSUMIDOR_ID})")
+
+    while True:
+        try:
+            livres = capacidade - _dispatcher.total_pendente()
+            reservados = []
+
+            if livres > 0:
+                reservados = await asyncio.to_thread(_reservar_em_sessao, livres, set(_em_posse.values()))
+
+            for item in reservados:
+                _em_posse[item["webhook_id"]] = item["chave"]
+                _dispatcher.submeter(item["chave"], item, enfileirado_em=item["recebido_em"])
+
+            if not reservados:
+                _novo_webhook.clear()
+                try:
+                    await asyncio.wait_for(_novo_webhook.wait(), timeout=INTERVALO_POLLING)
+                except asyncio.TimeoutError:
+                    pass
+
+        except asyncio.CancelledError:
+            break
+        except Exception as e:
+            print(f"❌ Erro no alimentador da fila de webhooks: {e}")
+            await asyncio.sleep(INTERVALO_POLLING)
+
+
+def iniciar_consumidores(handler: WebhookHandler, num_lanes: int = NUM_LANES):
+    """Inicia o dispatcher e o alimentador da fila (chamar no startup da aplicação)"""
+    global _handler, _dispatcher, _alimentador, _novo_webhook, _renovador
+
+    _handler = handler
+    _novo_webhook = asyncio.Event()
+
+    # Limpeza de webhooks antigos
+    db = SessionLocal()
+    try:
+        removidos = limpar_concluidos(db)
+        if removidos:
+            print(f"🗑️  {removidos} webhooks antigos removidos da fila")
+    finally:
+        db.close()
+
+    _dispatcher = WebhookDispatcher(_processar, num_lanes=num_lanes, on_done=_ao_terminar)
+    _dispatcher.iniciar()
+    _alimentador = asyncio.create_task(_alimentar())
+    _renovador = asyncio.create_task(_renovar_leases())
+
+
+async def parar_consumidores():
+    """Para alimentador e lanes (webhooks em andamento voltam à fila pelo lease)"""
+    for tarefa in (_alimentador, _renovador):
+        if tarefa is not None:
+            tarefa.cancel()
+            await asyncio.gather(tarefa, return_exceptions=True)
+    if _dispatcher is not None:
+        await _dispatcher.parar()
+
+
+def metricas_lanes() -> List[Dict]:
+    """Profundidade e lag das lanes deste processo"""
+    if _dispatcher is None:
+        return []
+    return _dispatcher.metricas()